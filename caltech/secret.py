@@ -0,0 +1,5 @@
+PROJECT_PATH = '/tmp/caltech_local/'
+SECRET_KEY = 'local-test-key'
+INTERVIEW_CALENDAR_GROUP_ID = 'interviews@example.com'
+use_mock = True
+room_id = None
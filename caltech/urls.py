@@ -21,8 +21,13 @@ urlpatterns = patterns('',
     url(r'^interview_post/', 'jeeves.views.interview_post'),
     url(r'^find_times/', 'jeeves.views.find_times'),
     url(r'^find_times_post/', 'jeeves.views.find_times_post'),
+    url(r'^find_times_heatmap/', 'jeeves.views.find_times_heatmap'),
+    url(r'^find_times_busy/', 'jeeves.views.find_times_busy'),
+    url(r'^free_interviewers/', 'jeeves.views.free_interviewers'),
     url(r'^tracker/', 'jeeves.views.tracker'),
     url(r'^modify_interview/', 'jeeves.views.modify_interview'),
+    url(r'^replacement_interviewers/', 'jeeves.views.replacement_interviewers'),
+    url(r'^calendar_notification/', 'jeeves.views.calendar_notification'),
 
     url(r'^accounts/login/$', 'django.contrib.auth.views.login', {'template_name': 'admin/login.html'}),
     url(r'^login/$', 'django.contrib.auth.views.login', {'template_name': 'admin/login.html'}),
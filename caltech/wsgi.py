@@ -23,6 +23,33 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "caltech.settings")
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+# Experimental: set search_processes in secret.py to split schedule searches
+# across a process pool. It's forked here, before the calendar client, the
+# prewarm thread or any database connection exist; under a preloading server
+# start it from a post_fork hook too.
+from jeeves.calendar import schedule_calculator
+schedule_calculator.start_search_pool()
+
+# Set warm_up_calendar_client = True in secret.py to build the calendar
+# service and open the freebusy store here rather than on the first request.
+# Only do that when each worker imports this module itself. A preloading
+# server (gunicorn --preload, uWSGI without lazy-apps) imports it once in the
+# master, and forked workers would share its httplib2 connection and SQLite
+# handle; call calendar_client.warm_up() from a post_fork hook there instead.
+from caltech import secret
+if getattr(secret, 'warm_up_calendar_client', False):
+    from jeeves.calendar.client import calendar_client
+    calendar_client.warm_up()
+
+# Keep the next business days' calendars fetched. Every process runs its
+# own scheduler, and a thread started in a preloading master doesn't carry
+# over into its workers, so with several workers prefer cron and
+# ./manage.py prewarm_calendars.
+from jeeves.calendar import prewarm
+if prewarm.PREWARM_IN_PROCESS:
+    from jeeves.calendar.client import calendar_client
+    prewarm.PrewarmScheduler(calendar_client).start()
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)
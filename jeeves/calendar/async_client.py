@@ -0,0 +1,60 @@
+"""Non-blocking versions of the Client calls.
+
+We're on Python 2, so there's no asyncio; instead each call is handed to a
+shared, bounded thread pool and comes back as a pending result (an
+AsyncResult). Start everything you need, then collect it with gather:
+
+    rooms, preferences = gather(
+        async_client.get_calendars(all_rooms, time_period),
+        async_client.get_calendars(preference_calendars, time_period),
+    )
+
+Calls go through the wrapped Client, so they share its freebusy cache. Its
+ServiceClient needs a service_factory to grow its service pool past the one
+service it was given, or the calls take turns on that service; the default
+Client has one.
+"""
+import threading
+from multiprocessing.pool import ThreadPool
+
+from caltech import secret
+
+MAX_CONCURRENT_CALLS = getattr(secret, 'max_concurrent_calendar_calls', 8)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(MAX_CONCURRENT_CALLS)
+    return _pool
+
+
+def gather(*pending_results):
+    """Wait for every pending result and return their values in order. Re-raises the first error."""
+    return [pending_result.get() for pending_result in pending_results]
+
+
+class AsyncClient(object):
+
+    def __init__(self, client, pool=None):
+        self._client = client
+        self._pool = pool
+
+    def get_calendars(self, interviewers, time_period):
+        return self._submit(self._client.get_calendars, list(interviewers), time_period)
+
+    def create_event(self, title, body, time_start, time_end, location, location_name):
+        return self._submit(self._client.create_event, title, body, time_start, time_end, location, location_name)
+
+    def delete_event(self, google_event_id, location=None, time_period=None):
+        return self._submit(self._client.delete_event, google_event_id, location=location, time_period=time_period)
+
+    def update_event(self, google_event_id, updated_description, location=None, time_period=None):
+        return self._submit(self._client.update_event, google_event_id, updated_description, location=location, time_period=time_period)
+
+    def _submit(self, function, *args, **kwargs):
+        return (self._pool or _get_pool()).apply_async(function, args, kwargs)
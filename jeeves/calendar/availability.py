@@ -0,0 +1,197 @@
+import collections
+from datetime import datetime
+from datetime import time
+
+import pytz
+
+from caltech import settings
+from . import lib
+
+
+AvailabilityRow = collections.namedtuple(
+    'AvailabilityRow',
+    ('free_set', 'busy_set', 'free_mask', 'busy_mask', 'open_mask'),
+)
+
+
+class AvailabilityMatrix(object):
+    """Bitmask view of a set of calendars over one time period.
+
+    The period is cut into slots of `resolution` minutes, aligned to the
+    clock, and each calendar gets a row of ints where bit i describes slot i:
+
+      free_mask: the whole slot is free
+      busy_mask: the whole slot is busy
+      open_mask: the slot starts inside free time
+
+    Slot-aligned questions become shifts and ANDs on those ints. Anything
+    that doesn't line up with the grid falls back to the row's IntervalSets,
+    so answers are always the same as asking the InterviewCalendar.
+    """
+
+    def __init__(self, time_period, resolution):
+        start = lib.to_epoch_minutes(time_period.start_time)
+        end = lib.to_epoch_minutes(time_period.end_time)
+        self.resolution = resolution
+        self.origin = start - start % resolution
+        self.num_slots = max(0, -(-(end - self.origin) // resolution))
+        self._rows = {}
+
+    def add_calendar(self, key, interview_calendar):
+        self._rows[key] = AvailabilityRow(
+            free_set=interview_calendar.free_set,
+            busy_set=interview_calendar.busy_set,
+            free_mask=self._covered_slots_mask(interview_calendar.free_set),
+            busy_mask=self._covered_slots_mask(interview_calendar.busy_set),
+            open_mask=self._open_slots_mask(interview_calendar.free_set),
+        )
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def row(self, key):
+        return self._rows[key]
+
+    def slot_time(self, index):
+        return lib.from_epoch_minutes(self.origin + index * self.resolution)
+
+    def slot_period(self, index, num_slots=1):
+        return lib.TimePeriod(self.slot_time(index), self.slot_time(index + num_slots))
+
+    def slot_range(self, time_period):
+        """(first slot, number of slots) for a grid-aligned period inside the grid, else None."""
+        start = lib.to_epoch_minutes(time_period.start_time) - self.origin
+        end = lib.to_epoch_minutes(time_period.end_time) - self.origin
+        if start % self.resolution or end % self.resolution:
+            return None
+        if start < 0 or end > self.num_slots * self.resolution or start >= end:
+            return None
+        return start // self.resolution, (end - start) // self.resolution
+
+    def has_availability_during(self, key, time_period):
+        row = self._rows.get(key)
+        if row is None:
+            return False
+        slot_range = self.slot_range(time_period)
+        if slot_range is None:
+            return row.free_set.contains(
+                lib.to_epoch_minutes(time_period.start_time),
+                lib.to_epoch_minutes(time_period.end_time),
+            )
+        return _all_bits_set(row.free_mask, *slot_range)
+
+    def is_blocked_during(self, key, time_period):
+        row = self._rows.get(key)
+        if row is None:
+            return False
+        slot_range = self.slot_range(time_period)
+        if slot_range is None:
+            return row.busy_set.contains(
+                lib.to_epoch_minutes(time_period.start_time),
+                lib.to_epoch_minutes(time_period.end_time),
+            )
+        return _all_bits_set(row.busy_mask, *slot_range)
+
+    def free_block_starts(self, key, num_slots):
+        """Mask with bit i set when slots i .. i + num_slots - 1 are all free."""
+        return consecutive_runs(self._rows[key].free_mask, num_slots)
+
+    def interview_chunks(self, key, num_slots):
+        """Yield free periods of num_slots slots that end strictly before the free time does."""
+        row = self._rows[key]
+        mask = consecutive_runs(row.free_mask, num_slots) & (row.open_mask >> num_slots)
+        for index in iter_set_bits(mask):
+            yield self.slot_period(index, num_slots)
+
+    def _covered_slots_mask(self, interval_set):
+        mask = 0
+        for start, end in interval_set:
+            first = max(0, -(-(start - self.origin) // self.resolution))
+            last = min(self.num_slots, (end - self.origin) // self.resolution)
+            if first < last:
+                mask |= ((1 << (last - first)) - 1) << first
+        return mask
+
+    def _open_slots_mask(self, interval_set):
+        mask = 0
+        for start, end in interval_set:
+            first = max(0, -(-(start - self.origin) // self.resolution))
+            last = min(self.num_slots, -(-(end - self.origin) // self.resolution))
+            if first < last:
+                mask |= ((1 << (last - first)) - 1) << first
+        return mask
+
+
+def heatmap(interview_calendars, days, start_hour, hours_per_day, chunks_per_hour):
+    """Who's free in each chunk of each day's working hours, START_HOUR for HOURS_PER_DAY hours.
+
+    Builds one AvailabilityMatrix over all the days and slices each day's
+    chunks out of every calendar's free_mask. Returns a dict per day with
+    its date, counts (how many calendars are free for the whole of each
+    chunk) and free (each calendar's free chunks, in interview_calendars
+    order, as encode_mask strings).
+    """
+    if not days:
+        return []
+    tz = pytz.timezone(settings.TIME_ZONE)
+    resolution = 60 // chunks_per_hour
+    num_chunks = hours_per_day * chunks_per_hour
+    day_starts = [
+        lib.to_epoch_minutes(tz.localize(datetime.combine(day, time(start_hour))))
+        for day in days
+    ]
+    matrix = AvailabilityMatrix(
+        lib.TimePeriod(
+            lib.from_epoch_minutes(day_starts[0]),
+            lib.from_epoch_minutes(day_starts[-1] + num_chunks * resolution),
+        ),
+        resolution,
+    )
+    for index, interview_calendar in enumerate(interview_calendars):
+        matrix.add_calendar(index, interview_calendar)
+
+    day_mask = (1 << num_chunks) - 1
+    heatmap_days = []
+    for day, day_start in zip(days, day_starts):
+        first_slot = (day_start - matrix.origin) // resolution
+        free_masks = [(matrix.row(index).free_mask >> first_slot) & day_mask for index in xrange(len(interview_calendars))]
+        counts = [0] * num_chunks
+        for free_mask in free_masks:
+            for chunk in iter_set_bits(free_mask):
+                counts[chunk] += 1
+        heatmap_days.append(dict(
+            date=day.isoformat(),
+            counts=counts,
+            free=[encode_mask(free_mask, num_chunks) for free_mask in free_masks],
+        ))
+    return heatmap_days
+
+
+def encode_mask(mask, num_bits):
+    """Hex, lowest bits first: character k holds bits 4k to 4k + 3, with bit 4k + j as its 2 ** j bit.
+
+    That way a reader can test bit i with parseInt(encoded[i >> 2], 16) >> (i & 3) & 1.
+    """
+    return ''.join('%x' % ((mask >> shift) & 0xf) for shift in xrange(0, num_bits, 4))
+
+
+def consecutive_runs(mask, num_slots):
+    """Bit i of the result is set when bits i .. i + num_slots - 1 of mask are all set."""
+    runs = mask
+    for shift in xrange(1, num_slots):
+        runs &= mask >> shift
+    return runs
+
+
+def iter_set_bits(mask):
+    index = 0
+    while mask:
+        if mask & 1:
+            yield index
+        mask >>= 1
+        index += 1
+
+
+def _all_bits_set(mask, first, count):
+    wanted = ((1 << count) - 1) << first
+    return mask & wanted == wanted
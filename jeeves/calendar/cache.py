@@ -0,0 +1,373 @@
+import collections
+import itertools
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from datetime import timedelta
+
+import pytz
+
+from caltech import secret
+from caltech import settings
+from . import lib
+
+FREEBUSY_CACHE_TTL = getattr(secret, 'freebusy_cache_ttl', 5 * 60)  # Seconds
+FREEBUSY_CACHE_MAX_BYTES = getattr(secret, 'freebusy_cache_max_bytes', 16 * 1024 * 1024)
+# Set to a file path to share the cache between every worker on the box
+# through SQLite; otherwise each process keeps its own
+FREEBUSY_STORE_PATH = getattr(secret, 'freebusy_store_path', None)
+
+# Rough cost of an entry, for eviction: the key, the entry and its two lists,
+# plus two ints per busy interval
+ENTRY_OVERHEAD_BYTES = 400
+INTERVAL_BYTES = 2 * 32
+
+
+def days_covered(time_period):
+    """Local days that time_period overlaps. Naive times are taken as local time."""
+    tz = pytz.timezone(settings.TIME_ZONE)
+    day = lib.localize(time_period.start_time).astimezone(tz).date()
+    last_day = (lib.localize(time_period.end_time) - timedelta(microseconds=1)).astimezone(tz).date()
+    days = []
+    while day <= last_day:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def day_bounds(day):
+    """(start, end) of a local day in epoch minutes."""
+    tz = pytz.timezone(settings.TIME_ZONE)
+    start = tz.localize(datetime(day.year, day.month, day.day))
+    next_day = day + timedelta(days=1)
+    end = tz.localize(datetime(next_day.year, next_day.month, next_day.day))
+    return lib.to_epoch_minutes(start), lib.to_epoch_minutes(end)
+
+
+def day_period(days):
+    """TimePeriod from the start of the first day to the end of the last."""
+    start, _ = day_bounds(days[0])
+    _, end = day_bounds(days[-1])
+    return lib.TimePeriod(lib.from_epoch_minutes(start), lib.from_epoch_minutes(end))
+
+
+CacheEntry = collections.namedtuple('CacheEntry', ('fetched_at', 'busy_set', 'size', 'ttl'))
+
+
+class FreeBusyCache(object):
+    """Busy intervals per calendar per local day, in memory.
+
+    Each (calendar id, day) bucket holds that day's busy time as an
+    IntervalSet of epoch minutes. A lookup only hits when every day asked
+    for is cached and younger than its TTL, so a fetched week answers any
+    query inside it. Days are put with the cache's TTL unless the caller
+    gives one, as prewarming does. Least recently used days are dropped once the
+    estimated size passes max_bytes.
+    """
+
+    def __init__(self, ttl=FREEBUSY_CACHE_TTL, max_bytes=FREEBUSY_CACHE_MAX_BYTES, clock=time.time):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, calendar_id, days):
+        """One IntervalSet per day if all of them are fresh, otherwise None."""
+        now = self._clock()
+        busy_sets = []
+        with self._lock:
+            for day in days:
+                entry = self._entries.get((calendar_id, day))
+                if entry is None or now - entry.fetched_at > entry.ttl:
+                    self.misses += 1
+                    return None
+                busy_sets.append(entry.busy_set)
+            for day in days:
+                self._touch((calendar_id, day))
+            self.hits += 1
+        return busy_sets
+
+    def put(self, calendar_id, day, busy_set, fetched_at=None, ttl=None):
+        if fetched_at is None:
+            fetched_at = self._clock()
+        entry = CacheEntry(fetched_at, busy_set, ENTRY_OVERHEAD_BYTES + len(busy_set) * INTERVAL_BYTES, ttl or self.ttl)
+        with self._lock:
+            self._remove((calendar_id, day))
+            self._entries[(calendar_id, day)] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def add_busy(self, calendar_id, day, busy_set):
+        """Merge busy_set into a cached day, keeping its age. Days not cached are left alone."""
+        with self._lock:
+            entry = self._entries.get((calendar_id, day))
+            if entry is None:
+                return
+            merged = entry.busy_set.union(busy_set)
+            self._remove((calendar_id, day))
+            self._entries[(calendar_id, day)] = CacheEntry(
+                entry.fetched_at,
+                merged,
+                ENTRY_OVERHEAD_BYTES + len(merged) * INTERVAL_BYTES,
+                entry.ttl,
+            )
+            self.size += self._entries[(calendar_id, day)].size
+
+    def invalidate(self, calendar_id, days=None):
+        with self._lock:
+            if days is None:
+                keys = [key for key in self._entries if key[0] == calendar_id]
+            else:
+                keys = [(calendar_id, day) for day in days]
+            for key in keys:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return dict(
+            entries=len(self._entries),
+            size=self.size,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+    def _touch(self, key):
+        self._entries[key] = self._entries.pop(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+
+class FreeBusyStore(object):
+    """Same interface as FreeBusyCache, kept in a SQLite file.
+
+    Every process using the same path shares it, so a calendar fetched by one
+    WSGI worker is a hit in all of them. WAL mode lets workers read while
+    another writes. Each row keeps when it expires, so prewarmed days can
+    outlive the TTL; expired rows are purged every so often.
+    """
+
+    PURGE_EVERY = 100  # puts
+
+    def __init__(self, path, ttl=FREEBUSY_CACHE_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self._clock = clock
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._puts_since_purge = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, calendar_id, days):
+        rows = self._connection().execute(
+            'SELECT day, expires_at, busy FROM freebusy WHERE calendar_id = ? AND day IN (%s)' % ', '.join('?' * len(days)),
+            [calendar_id] + [day.isoformat() for day in days],
+        ).fetchall()
+        now = self._clock()
+        entries = dict((day, (expires_at, busy)) for day, expires_at, busy in rows)
+        busy_sets = []
+        for day in days:
+            entry = entries.get(day.isoformat())
+            if entry is None or now > entry[0]:
+                self._count(misses=1)
+                return None
+            starts, ends = json.loads(entry[1])
+            busy_sets.append(lib.IntervalSet(zip(starts, ends)))
+        self._count(hits=1)
+        return busy_sets
+
+    def put(self, calendar_id, day, busy_set, fetched_at=None, ttl=None):
+        if fetched_at is None:
+            fetched_at = self._clock()
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO freebusy (calendar_id, day, fetched_at, expires_at, busy) VALUES (?, ?, ?, ?, ?)',
+            (calendar_id, day.isoformat(), fetched_at, fetched_at + (ttl or self.ttl), json.dumps([busy_set.starts, busy_set.ends])),
+        )
+        with self._lock:
+            self._puts_since_purge += 1
+            purge = self._puts_since_purge >= self.PURGE_EVERY
+            if purge:
+                self._puts_since_purge = 0
+        if purge:
+            connection.execute('DELETE FROM freebusy WHERE expires_at < ?', (self._clock(),))
+
+    def add_busy(self, calendar_id, day, busy_set):
+        connection = self._connection()
+        # Take the write lock before reading so two workers can't lose each other's update
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT busy FROM freebusy WHERE calendar_id = ? AND day = ?',
+                (calendar_id, day.isoformat()),
+            ).fetchone()
+            if row is not None:
+                starts, ends = json.loads(row[0])
+                merged = lib.IntervalSet(zip(starts, ends)).union(busy_set)
+                connection.execute(
+                    'UPDATE freebusy SET busy = ? WHERE calendar_id = ? AND day = ?',
+                    (json.dumps([merged.starts, merged.ends]), calendar_id, day.isoformat()),
+                )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def invalidate(self, calendar_id, days=None):
+        if days is None:
+            self._connection().execute('DELETE FROM freebusy WHERE calendar_id = ?', (calendar_id,))
+        else:
+            self._connection().executemany(
+                'DELETE FROM freebusy WHERE calendar_id = ? AND day = ?',
+                [(calendar_id, day.isoformat()) for day in days],
+            )
+
+    def clear(self):
+        self._connection().execute('DELETE FROM freebusy')
+
+    def stats(self):
+        entries, = self._connection().execute('SELECT COUNT(*) FROM freebusy').fetchone()
+        return dict(entries=entries, hits=self.hits, misses=self.misses)
+
+    def _count(self, hits=0, misses=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(freebusy)')]
+            if columns and 'expires_at' not in columns:
+                # A store from before rows kept their expiry; it's only a cache
+                connection.execute('DROP TABLE freebusy')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS freebusy ('
+                'calendar_id TEXT NOT NULL, '
+                'day TEXT NOT NULL, '
+                'fetched_at REAL NOT NULL, '
+                'expires_at REAL NOT NULL, '
+                'busy TEXT NOT NULL, '
+                'PRIMARY KEY (calendar_id, day))'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS freebusy_expires_at ON freebusy (expires_at)')
+            self._local.connection = connection
+        return connection
+
+
+def default_freebusy_cache():
+    """The store every default Client shares, or a per process cache without a store path.
+
+    Mock freebusy is made up on every run, so it's never persisted.
+    """
+    if FREEBUSY_STORE_PATH and not secret.use_mock:
+        return FreeBusyStore(FREEBUSY_STORE_PATH)
+    return FreeBusyCache()
+
+
+class CachingServiceClient(object):
+    """Answers freebusy queries from a FreeBusyCache where it can.
+
+    Calendars that miss are fetched from the wrapped service client for the
+    whole of every day the query covers, so later queries inside those days
+    hit.
+    """
+
+    def __init__(self, service_client, cache):
+        self._service_client = service_client
+        self.cache = cache
+
+    def process_calendar_query(self, calendar_query):
+        from .client import CalendarResponse
+        from .client import InterviewCalendar
+
+        days = days_covered(calendar_query.time_period)
+        if not days:
+            return self._service_client.process_calendar_query(calendar_query)
+        busy_sets = {}
+        missing = []
+        for interviewer in calendar_query.interviewers:
+            cached = self.cache.get(interviewer.external_id, days)
+            if cached is None:
+                missing.append(interviewer)
+            else:
+                busy_sets[interviewer.external_id] = cached
+
+        chunk_latencies = []
+        if missing:
+            fetched_busy_sets, chunk_latencies = self._fetch_days(missing, days)
+            busy_sets.update(fetched_busy_sets)
+
+        query_start = lib.to_epoch_minutes(calendar_query.time_period.start_time)
+        query_end = lib.to_epoch_minutes(calendar_query.time_period.end_time)
+        calendar_response = CalendarResponse.from_interview_calendars(
+            calendar_query,
+            [
+                InterviewCalendar.from_busy_set(
+                    interviewer,
+                    calendar_query.time_period,
+                    lib.IntervalSet(itertools.chain(*busy_sets[interviewer.external_id])).clip(query_start, query_end),
+                )
+                for interviewer in calendar_query.interviewers
+                if interviewer.external_id in busy_sets
+            ],
+        )
+        calendar_response.chunk_latencies = chunk_latencies
+        return calendar_response
+
+    def refresh_calendar_query(self, calendar_query, ttl=None):
+        """Refetch every calendar in the query for the days it covers, hits or not. Returns how many came back.
+
+        The days are cached for ttl seconds instead of the cache's TTL when given.
+        """
+        days = days_covered(calendar_query.time_period)
+        if not days:
+            return 0
+        busy_sets, _ = self._fetch_days(calendar_query.interviewers, days, ttl)
+        return len(busy_sets)
+
+    def _fetch_days(self, interviewers, days, ttl=None):
+        from .client import CalendarQuery
+
+        fetched_response = self._service_client.process_calendar_query(CalendarQuery(interviewers, day_period(days)))
+        busy_sets = {}
+        for interview_calendar in fetched_response.interview_calendars:
+            calendar_id = interview_calendar.interviewer.external_id
+            busy_sets[calendar_id] = []
+            for day in days:
+                day_busy_set = interview_calendar.busy_set.clip(*day_bounds(day))
+                self.cache.put(calendar_id, day, day_busy_set, ttl=ttl)
+                busy_sets[calendar_id].append(day_busy_set)
+        return busy_sets, fetched_response.chunk_latencies
+
+    def process_calendar_create(self, calendar):
+        return self._service_client.process_calendar_create(calendar)
+
+    def process_calendar_delete(self, google_event_id):
+        return self._service_client.process_calendar_delete(google_event_id)
+
+    def process_calendar_update(self, google_event_id, updated_description):
+        return self._service_client.process_calendar_update(google_event_id, updated_description)
+
+    def process_calendar_batch(self, operations):
+        return self._service_client.process_calendar_batch(operations)
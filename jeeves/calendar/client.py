@@ -1,25 +1,55 @@
+import collections
+import gzip
+import itertools
+import logging
 import random
+import sys
+import threading
+import time
 from datetime import timedelta
 from httplib import BadStatusLine
+from multiprocessing.pool import ThreadPool
 
 import json
+from apiclient.http import BatchHttpRequest
+from django.core.exceptions import ImproperlyConfigured
 from django.core.serializers.json import DjangoJSONEncoder
 
 from caltech import secret
+from . import cache
+from . import mirror
+from . import service_pool
 from . import schedule
 from . import lib
 
+logger = logging.getLogger(__name__)
+
+# Google won't answer a freebusy query for more calendars than this
 MAX_INTERVIEWERS_IN_QUERY = 50
+# Google takes up to 1000 calls per batch, but recommends far fewer
+MAX_EVENTS_IN_BATCH = 50
+MAX_EVENTS_IN_PAGE = 250
+MAX_CONCURRENT_QUERIES = getattr(secret, 'max_concurrent_calendar_queries', 4)
+# Save every calendar call to this log, or serve calls from one instead of Google
+CALENDAR_RECORD_PATH = getattr(secret, 'calendar_record_path', None)
+CALENDAR_REPLAY_PATH = getattr(secret, 'calendar_replay_path', None)
+CALENDAR_REPLAY_LATENCY_MS = getattr(secret, 'calendar_replay_latency_ms', 0)
+
+ChunkLatency = collections.namedtuple('ChunkLatency', ('num_calendars', 'latency_ms'))
+
 
 class CalendarQuery(object):
 
     def __init__(self, interviewers, time_period):
-        self.interviewers = random.sample(
-                interviewers,
-                min(MAX_INTERVIEWERS_IN_QUERY, len(interviewers))
-        )
+        self.interviewers = list(interviewers)
         self.time_period = time_period
 
+    def chunks(self, chunk_size=MAX_INTERVIEWERS_IN_QUERY):
+        return [
+                CalendarQuery(self.interviewers[index:index + chunk_size], self.time_period)
+                for index in xrange(0, len(self.interviewers), chunk_size)
+        ]
+
     def to_query_body(self, force_all_interviewers=False):
         return dict(
                 timeMin=lib.format_datetime_utc(self.time_period.start_time),
@@ -59,46 +89,139 @@ class CalendarCreate(object):
         )
 
 
+class EventOperation(object):
+    """One event insert, patch or delete in an EventBatch.
+
+    response and error are filled in once the batch is sent; error is set,
+    and response is None, if that one call failed.
+    """
+
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+
+    def __init__(self, kind, google_event_id=None, calendar=None, updated_description=None, location=None, time_period=None):
+        self.kind = kind
+        self.google_event_id = google_event_id
+        self.calendar = calendar
+        self.updated_description = updated_description
+        self.location = location
+        self.time_period = time_period
+        self.done = False
+        self.response = None
+        self.error = None
+
+    def __repr__(self):
+        return "EventOperation(%s, %s)" % (self.kind, self.google_event_id)
+
+
+class EventBatch(object):
+    """Collects event inserts, patches and deletes and sends them as batch requests:
+
+        with calendar_client.batch() as batch:
+            for interview in interviews:
+                batch.delete_event(interview.google_event_id)
+        failed = batch.errors
+
+    Each call returns its EventOperation. Leaving the with block sends the
+    batch unless it's leaving on an exception; execute sends it by hand.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.operations = []
+
+    def create_event(self, title, body, time_start, time_end, location, location_name):
+        return self._add(EventOperation(
+                EventOperation.CREATE,
+                calendar=CalendarCreate(title, body, time_start, time_end, location, location_name),
+                location=location,
+                time_period=lib.TimePeriod(time_start, time_end),
+        ))
+
+    def delete_event(self, google_event_id, location=None, time_period=None):
+        return self._add(EventOperation(EventOperation.DELETE, google_event_id, location=location, time_period=time_period))
+
+    def update_event(self, google_event_id, updated_description, location=None, time_period=None):
+        return self._add(EventOperation(
+                EventOperation.UPDATE,
+                google_event_id,
+                updated_description=updated_description,
+                location=location,
+                time_period=time_period,
+        ))
+
+    def execute(self):
+        pending = [operation for operation in self.operations if not operation.done]
+        if pending:
+            self._client.execute_batch(pending)
+        return self.operations
+
+    @property
+    def errors(self):
+        return [operation for operation in self.operations if operation.error is not None]
+
+    def _add(self, operation):
+        self.operations.append(operation)
+        return operation
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+
 class InterviewCalendar(object):
 
-    def __init__(self, interviewer, period_of_interest, start_end_pairs):
+    def __init__(self, interviewer, period_of_interest, start_end_pairs, busy_set=None):
         self.interviewer = interviewer
 
-        busy_times = [
-                (
-                    lib.parse_utc_datetime(dt_dict['start']),
-                    lib.parse_utc_datetime(dt_dict['end']),
-                )
-                for dt_dict in start_end_pairs
-        ]
+        if busy_set is None:
+            busy_set = lib.IntervalSet(
+                    (
+                        lib.parse_utc_epoch_minutes(dt_dict['start']),
+                        lib.parse_utc_epoch_minutes(dt_dict['end']),
+                    )
+                    for dt_dict in start_end_pairs
+            )
+        self.busy_set = busy_set
+        self.free_set = self.busy_set.complement(
+                lib.to_epoch_minutes(period_of_interest.start_time),
+                lib.to_epoch_minutes(period_of_interest.end_time),
+        )
+        self._busy_times = None
+        self._free_times = None
 
-        self.busy_times = [
-                lib.TimePeriod(start_time, end_time)
-                for (start_time, end_time) in lib.collapse_times(
-                    busy_times,
-                )
-        ]
+    @classmethod
+    def from_busy_set(cls, interviewer, period_of_interest, busy_set):
+        """Build from an IntervalSet of epoch minutes instead of a freebusy response."""
+        return cls(interviewer, period_of_interest, None, busy_set=busy_set)
 
-        self.free_times = [
-                lib.TimePeriod(start_time, end_time)
-                for (start_time, end_time) in lib.calculate_free_times(
-                    busy_times,
-                    period_of_interest.start_time,
-                    period_of_interest.end_time
-                )
-        ]
+    @property
+    def busy_times(self):
+        if self._busy_times is None:
+            self._busy_times = self.busy_set.to_time_periods()
+        return self._busy_times
+
+    @property
+    def free_times(self):
+        if self._free_times is None:
+            self._free_times = self.free_set.to_time_periods()
+        return self._free_times
 
     def has_availability_during(self, time_period):
-        for free_time in self.free_times:
-            if free_time.contains(time_period):
-                return True
-        return False
+        return self.free_set.contains(
+                lib.to_epoch_minutes(time_period.start_time),
+                lib.to_epoch_minutes(time_period.end_time),
+        )
 
     def is_blocked_during(self, time_period):
-        for busy_time in self.busy_times:
-            if busy_time.contains(time_period):
-                return True
-        return False
+        return self.busy_set.contains(
+                lib.to_epoch_minutes(time_period.start_time),
+                lib.to_epoch_minutes(time_period.end_time),
+        )
 
     def __repr__(self):
         return self.interviewer.address
@@ -113,6 +236,14 @@ class CalendarResponse(object):
                 if interviewer.external_id in calendars
         ]
         self._memoize_lookup = {}
+        # One ChunkLatency per freebusy request this response was built from
+        self.chunk_latencies = []
+
+    @classmethod
+    def from_interview_calendars(cls, calendar_query, interview_calendars):
+        calendar_response = cls(calendar_query, dict(calendars={}))
+        calendar_response.interview_calendars = list(interview_calendars)
+        return calendar_response
 
     def get_interviewer(self, interviewer_address):
         if interviewer_address in self._memoize_lookup:
@@ -158,35 +289,317 @@ class CalendarResponse(object):
         return selected, not_selected
 
 
+class CalendarQueryPlan(object):
+    """Everything one page needs from freebusy, fetched together.
+
+    Add calendars under whatever purpose they're for (a group, the rooms,
+    preference calendars); execute() asks for each calendar id once, in as
+    few chunks as the API allows, and hands back a CalendarResponse per
+    purpose built over the shared busy times.
+    """
+
+    def __init__(self, time_period):
+        self.time_period = time_period
+        self._purposes = collections.OrderedDict()
+
+    def add(self, purpose, interviewers):
+        self._purposes.setdefault(purpose, []).extend(interviewers)
+        return self
+
+    @property
+    def calendars(self):
+        """One interviewer per distinct calendar id, in the order they were added."""
+        calendars = collections.OrderedDict()
+        for interviewers in self._purposes.itervalues():
+            for interviewer in interviewers:
+                if interviewer.external_id is not None:
+                    calendars.setdefault(interviewer.external_id, interviewer)
+        return calendars.values()
+
+    def execute(self, client):
+        calendar_response = client.get_calendars(self.calendars, self.time_period)
+        return PlannedCalendars(self, calendar_response)
+
+
+class PlannedCalendars(object):
+
+    def __init__(self, calendar_query_plan, calendar_response):
+        self.time_period = calendar_query_plan.time_period
+        self.calendar_response = calendar_response
+        self._purposes = calendar_query_plan._purposes
+        self._busy_sets = dict(
+                (interview_calendar.interviewer.external_id, interview_calendar.busy_set)
+                for interview_calendar in calendar_response.interview_calendars
+        )
+        self.num_requested = sum(len(interviewers) for interviewers in self._purposes.itervalues())
+        self.num_fetched = len(self._busy_sets)
+
+    @property
+    def chunk_latencies(self):
+        return self.calendar_response.chunk_latencies
+
+    def response(self, purpose):
+        return CalendarResponse.from_interview_calendars(
+                CalendarQuery(self._purposes.get(purpose, []), self.time_period),
+                [
+                    InterviewCalendar.from_busy_set(interviewer, self.time_period, self._busy_sets[interviewer.external_id])
+                    for interviewer in self._purposes.get(purpose, [])
+                    if interviewer.external_id in self._busy_sets
+                ],
+        )
+
+
 class Client(object):
 
-    def __init__(self, service_client=None):
+    def __init__(self, service_client=None, freebusy_cache=None, coalesce=None):
         if service_client is not None:
             self._service_client = service_client
 
+        elif CALENDAR_REPLAY_PATH:
+            self._service_client = ReplayServiceClient(CALENDAR_REPLAY_PATH, latency_ms=CALENDAR_REPLAY_LATENCY_MS)
         elif secret.use_mock:
             self._service_client = MockServiceClient()
         else:
-            self._service_client = ServiceClient(schedule.build_service())
+            self._service_client = ServiceClient(None, service_factory=schedule.build_service)
+        if service_client is None and CALENDAR_RECORD_PATH:
+            self._service_client = RecordingServiceClient(self._service_client, CALENDAR_RECORD_PATH)
+        self._base_service_client = self._service_client
+
+        self.mirror = None
+        # The mock and replay clients have no events to mirror
+        if service_client is None and mirror.CALENDAR_MIRROR and hasattr(self._base_service_client, 'list_events'):
+            if not mirror.WEBHOOK_TOKEN:
+                # Otherwise anyone who learns a channel id can make us sync
+                raise ImproperlyConfigured('calendar_mirror needs a calendar_webhook_token in secret.py')
+            self.mirror = mirror.CalendarMirror(self._base_service_client)
+            self._service_client = MirroringServiceClient(self._service_client, self.mirror)
+
+        if coalesce is None:
+            coalesce = service_client is None
+        self.coalescing_client = None
+        if coalesce:
+            self._service_client = self.coalescing_client = CoalescingServiceClient(self._service_client)
+
+        if freebusy_cache is None and service_client is None and cache.FREEBUSY_CACHE_TTL:
+            freebusy_cache = cache.default_freebusy_cache()
+        if freebusy_cache is not None:
+            self._service_client = cache.CachingServiceClient(self._service_client, freebusy_cache)
+        self.freebusy_cache = freebusy_cache
+        if self.mirror is not None:
+            self.mirror.freebusy_cache = freebusy_cache
+
+    def warm_up(self):
+        """Build the calendar service and open the freebusy cache now instead of on the first request.
+
+        Returns how long that took, in milliseconds.
+        """
+        start = time.time()
+        if hasattr(self._base_service_client, 'warm_up'):
+            self._base_service_client.warm_up()
+        if self.freebusy_cache is not None:
+            self.freebusy_cache.stats()
+        elapsed_ms = (time.time() - start) * 1000
+        logger.info("calendar client warmed up in %.0fms", elapsed_ms)
+        return elapsed_ms
 
     def get_calendars(self, interviewers, time_period):
         return self._service_client.process_calendar_query(CalendarQuery(interviewers, time_period))
 
+    def prefetch_calendars(self, interviewers, time_period, ttl=None):
+        """Fetch calendars into the freebusy cache even if they're already there, so they're fresh for the next request.
+
+        With ttl, they stay fresh for that many seconds rather than the cache's TTL.
+        """
+        if self.freebusy_cache is None:
+            self.get_calendars(interviewers, time_period)
+            return
+        self._service_client.refresh_calendar_query(CalendarQuery(interviewers, time_period), ttl=ttl)
+
+    def service_stats(self):
+        """The underlying ServiceClient's stats, or None when there isn't one."""
+        if hasattr(self._base_service_client, 'stats'):
+            return self._base_service_client.stats()
+        return None
+
     def create_event(self, title, body, time_start, time_end, location, location_name):
-        return self._service_client.process_calendar_create(CalendarCreate(title, body, time_start, time_end, location, location_name))
+        try:
+            event = self._service_client.process_calendar_create(CalendarCreate(title, body, time_start, time_end, location, location_name))
+        except Exception:
+            self._invalidate_event_calendars(location, lib.TimePeriod(time_start, time_end))
+            raise
+        for calendar_id in (secret.INTERVIEW_CALENDAR_GROUP_ID, location):
+            if calendar_id:
+                self.add_busy_time(calendar_id, lib.TimePeriod(time_start, time_end))
+        return event
+
+    def delete_event(self, google_event_id, location=None, time_period=None):
+        """Without location and time_period every cached day of the interview calendar is dropped."""
+        try:
+            return self._service_client.process_calendar_delete(google_event_id)
+        finally:
+            self._invalidate_event_calendars(location, time_period)
+
+    def update_event(self, google_event_id, updated_description, location=None, time_period=None):
+        try:
+            return self._service_client.process_calendar_update(google_event_id, updated_description)
+        finally:
+            self._invalidate_event_calendars(location, time_period)
+
+    def batch(self):
+        return EventBatch(self)
+
+    def execute_batch(self, operations):
+        """Send EventOperations together and fill in each one's response or error."""
+        try:
+            results = self._service_client.process_calendar_batch(operations)
+        except Exception:
+            for operation in operations:
+                self._invalidate_event_calendars(operation.location, operation.time_period)
+            raise
+
+        for operation, (response, error) in zip(operations, results):
+            operation.done = True
+            operation.response = response
+            operation.error = error
+            if operation.kind == EventOperation.CREATE and error is None:
+                for calendar_id in (secret.INTERVIEW_CALENDAR_GROUP_ID, operation.location):
+                    if calendar_id:
+                        self.add_busy_time(calendar_id, operation.time_period)
+            else:
+                self._invalidate_event_calendars(operation.location, operation.time_period)
+        return operations
+
+    def add_busy_time(self, calendar_id, time_period):
+        """Write a booking we just made into cached freebusy so the next query sees it without a refetch.
+
+        Naive times are taken as local time.
+        """
+        if self.freebusy_cache is None:
+            return
+        time_period = lib.TimePeriod(lib.localize(time_period.start_time), lib.localize(time_period.end_time))
+        start = lib.to_epoch_minutes(time_period.start_time)
+        end = lib.to_epoch_minutes(time_period.end_time)
+        for day in cache.days_covered(time_period):
+            day_start, day_end = cache.day_bounds(day)
+            self.freebusy_cache.add_busy(
+                calendar_id,
+                day,
+                lib.IntervalSet([(max(start, day_start), min(end, day_end))]),
+            )
+
+    def invalidate_calendar(self, calendar_id, time_period=None):
+        """Drop cached freebusy for calendar_id, only the days of time_period if given."""
+        if self.freebusy_cache is None:
+            return
+        days = cache.days_covered(time_period) if time_period is not None else None
+        self.freebusy_cache.invalidate(calendar_id, days)
+
+    def _invalidate_event_calendars(self, location, time_period):
+        for calendar_id in (secret.INTERVIEW_CALENDAR_GROUP_ID, location):
+            if calendar_id:
+                self.invalidate_calendar(calendar_id, time_period)
+
+class SingleFlight(object):
+    """Lets concurrent callers asking for the same key share one call.
+
+    The first caller for a key runs the function; anyone asking for that key
+    before it returns waits and gets the same result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.calls = 0
+        self.saved_calls = 0
+
+    def do(self, key, function, *args):
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+                self.calls += 1
+            else:
+                self.saved_calls += 1
+
+        if leader:
+            try:
+                call.result = function(*args)
+            except Exception:
+                call.exc_info = sys.exc_info()
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.exc_info is not None:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        return call.result
+
+    def stats(self):
+        return dict(calls=self.calls, saved_calls=self.saved_calls)
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class CoalescingServiceClient(object):
+    """Shares one in-flight freebusy call between identical concurrent queries."""
+
+    def __init__(self, service_client):
+        self._service_client = service_client
+        self.single_flight = SingleFlight()
+
+    def process_calendar_query(self, calendar_query):
+        key = (
+                tuple(sorted(set(interviewer.external_id for interviewer in calendar_query.interviewers))),
+                lib.to_epoch_minutes(calendar_query.time_period.start_time),
+                lib.to_epoch_minutes(calendar_query.time_period.end_time),
+        )
+        shared_response = self.single_flight.do(key, self._service_client.process_calendar_query, calendar_query)
+
+        # Rebuild over our own interviewers, in our own order
+        busy_sets = dict(
+                (interview_calendar.interviewer.external_id, interview_calendar.busy_set)
+                for interview_calendar in shared_response.interview_calendars
+        )
+        calendar_response = CalendarResponse.from_interview_calendars(
+                calendar_query,
+                [
+                    InterviewCalendar.from_busy_set(interviewer, calendar_query.time_period, busy_sets[interviewer.external_id])
+                    for interviewer in calendar_query.interviewers
+                    if interviewer.external_id in busy_sets
+                ],
+        )
+        calendar_response.chunk_latencies = shared_response.chunk_latencies
+        return calendar_response
 
-    def delete_event(self, google_event_id):
+    def process_calendar_create(self, calendar):
+        return self._service_client.process_calendar_create(calendar)
+
+    def process_calendar_delete(self, google_event_id):
         return self._service_client.process_calendar_delete(google_event_id)
 
-    def update_event(self, google_event_id, updated_description):
+    def process_calendar_update(self, google_event_id, updated_description):
         return self._service_client.process_calendar_update(google_event_id, updated_description)
 
+    def process_calendar_batch(self, operations):
+        return self._service_client.process_calendar_batch(operations)
+
+
 class MockServiceClient(object):
 
     def process_calendar_query(self, calendar_query):
         mock_service_response = dict(
                 calendars=dict(
-                    (interviewer.address, self._build_random_calendar(interviewer, calendar_query.time_period))
+                    (interviewer.external_id, self._build_random_calendar(interviewer, calendar_query.time_period))
                     for interviewer in calendar_query.interviewers
                 )
         )
@@ -219,7 +632,7 @@ class TestServiceClient(object):
     def process_calendar_query(self, calendar_query):
         mock_service_response = dict(
                 calendars=dict(
-                    (interviewer.address, self._regurgitate_registered_busyness(interviewer.address, calendar_query.time_period))
+                    (interviewer.external_id, self._regurgitate_registered_busyness(interviewer.external_id, calendar_query.time_period))
                     for interviewer in calendar_query.interviewers
                 )
         )
@@ -235,35 +648,442 @@ class TestServiceClient(object):
         return dict(busy=busy_times)
 
 
+class MirroringServiceClient(object):
+    """Answers freebusy from a CalendarMirror for the calendars it has fresh, and from service_client for the rest."""
+
+    def __init__(self, service_client, calendar_mirror):
+        self._service_client = service_client
+        self._calendar_mirror = calendar_mirror
+        self.mirrored = 0
+        self.fetched = 0
+
+    def process_calendar_query(self, calendar_query):
+        time_period = calendar_query.time_period
+        busy_sets = self._calendar_mirror.busy_sets(
+                set(interviewer.external_id for interviewer in calendar_query.interviewers),
+                lib.to_epoch_minutes(time_period.start_time),
+                lib.to_epoch_minutes(time_period.end_time),
+        )
+        unmirrored = [interviewer for interviewer in calendar_query.interviewers if interviewer.external_id not in busy_sets]
+        fetched_calendars = {}
+        chunk_latencies = []
+        if unmirrored:
+            fetched_response = self._service_client.process_calendar_query(CalendarQuery(unmirrored, time_period))
+            fetched_calendars = dict(
+                (interview_calendar.interviewer.external_id, interview_calendar)
+                for interview_calendar in fetched_response.interview_calendars
+            )
+            chunk_latencies = fetched_response.chunk_latencies
+        self.mirrored += len(calendar_query.interviewers) - len(unmirrored)
+        self.fetched += len(unmirrored)
+
+        interview_calendars = []
+        for interviewer in calendar_query.interviewers:
+            if interviewer.external_id in busy_sets:
+                interview_calendars.append(InterviewCalendar.from_busy_set(interviewer, time_period, busy_sets[interviewer.external_id]))
+            elif interviewer.external_id in fetched_calendars:
+                interview_calendars.append(fetched_calendars[interviewer.external_id])
+        calendar_response = CalendarResponse.from_interview_calendars(calendar_query, interview_calendars)
+        calendar_response.chunk_latencies = chunk_latencies
+        return calendar_response
+
+    def process_calendar_create(self, calendar):
+        return self._service_client.process_calendar_create(calendar)
+
+    def process_calendar_delete(self, google_event_id):
+        return self._service_client.process_calendar_delete(google_event_id)
+
+    def process_calendar_update(self, google_event_id, updated_description):
+        return self._service_client.process_calendar_update(google_event_id, updated_description)
+
+    def process_calendar_batch(self, operations):
+        return self._service_client.process_calendar_batch(operations)
+
+
+class CallLog(object):
+    """An append-only, gzipped log of calendar calls, one compact JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def append(self, entry):
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = gzip.open(self.path, 'ab')
+            self._file.write(line)
+            # So a killed process still leaves a readable log
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def read(path):
+        with gzip.open(path, 'rb') as log_file:
+            for line in log_file:
+                yield json.loads(line)
+
+
+class RecordingServiceClient(object):
+    """Passes calls through to service_client and saves each one to a CallLog at path.
+
+    Freebusy is saved as epoch minute [starts, ends] lists per calendar and
+    event writes as their request and response or error, each with how
+    long the call took. ReplayServiceClient serves a log back.
+    """
+
+    def __init__(self, service_client, path):
+        self._service_client = service_client
+        self.call_log = CallLog(path)
+
+    def warm_up(self):
+        if hasattr(self._service_client, 'warm_up'):
+            self._service_client.warm_up()
+
+    def stats(self):
+        if hasattr(self._service_client, 'stats'):
+            return self._service_client.stats()
+        return None
+
+    def process_calendar_query(self, calendar_query):
+        start = time.time()
+        calendar_response = self._service_client.process_calendar_query(calendar_query)
+        self.call_log.append(dict(
+            call='freebusy',
+            start=lib.to_epoch_minutes(calendar_query.time_period.start_time),
+            end=lib.to_epoch_minutes(calendar_query.time_period.end_time),
+            busy=dict(
+                (interview_calendar.interviewer.external_id, [interview_calendar.busy_set.starts, interview_calendar.busy_set.ends])
+                for interview_calendar in calendar_response.interview_calendars
+            ),
+            ms=int((time.time() - start) * 1000),
+        ))
+        return calendar_response
+
+    def list_events(self, calendar_id, sync_token=None, page_token=None):
+        # Not recorded; replay has no mirror to feed
+        return self._service_client.list_events(calendar_id, sync_token=sync_token, page_token=page_token)
+
+    def watch_events(self, calendar_id, channel):
+        return self._service_client.watch_events(calendar_id, channel)
+
+    def process_calendar_create(self, calendar):
+        return self._record(EventOperation(EventOperation.CREATE, calendar=calendar), self._service_client.process_calendar_create, calendar)
+
+    def process_calendar_delete(self, google_event_id):
+        return self._record(EventOperation(EventOperation.DELETE, google_event_id), self._service_client.process_calendar_delete, google_event_id)
+
+    def process_calendar_update(self, google_event_id, updated_description):
+        return self._record(
+                EventOperation(EventOperation.UPDATE, google_event_id, updated_description=updated_description),
+                self._service_client.process_calendar_update,
+                google_event_id,
+                updated_description,
+        )
+
+    def process_calendar_batch(self, operations):
+        start = time.time()
+        results = self._service_client.process_calendar_batch(operations)
+        self.call_log.append(dict(
+            call='batch',
+            operations=[
+                _event_entry(operation, response, error)
+                for operation, (response, error) in zip(operations, results)
+            ],
+            ms=int((time.time() - start) * 1000),
+        ))
+        return results
+
+    def _record(self, operation, function, *args):
+        start = time.time()
+        try:
+            response = function(*args)
+        except Exception as error:
+            self.call_log.append(dict(_event_entry(operation, None, error), ms=int((time.time() - start) * 1000)))
+            raise
+        self.call_log.append(dict(_event_entry(operation, response, None), ms=int((time.time() - start) * 1000)))
+        return response
+
+
+def _event_entry(operation, response, error):
+    return dict(
+        call=operation.kind,
+        event_id=operation.google_event_id,
+        body=operation.calendar.to_query_body() if operation.calendar is not None else operation.updated_description,
+        response=response,
+        error=str(error) if error is not None else None,
+    )
+
+
+class ReplayError(Exception):
+    """A recorded call that failed, failing again."""
+
+
+class ReplayServiceClient(object):
+    """Serves calendar calls from a log written by RecordingServiceClient, without touching Google.
+
+    A calendar's freebusy comes from any recorded query whose window covers
+    the one asked for, clipped to it; calendars no recorded query covers
+    come back free and are counted in misses. Event writes get the recorded
+    responses (or errors) for that kind of call in order, then made up ones
+    once those run out.
+
+    Each call sleeps latency_ms first, or with recorded_latency, the mean
+    time that kind of call took when it was recorded.
+    """
+
+    def __init__(self, path, latency_ms=0, recorded_latency=False):
+        self.latency_ms = latency_ms
+        self.recorded_latency = recorded_latency
+        self.misses = 0
+        self._busy_by_calendar = collections.defaultdict(list)
+        self._event_results = collections.defaultdict(collections.deque)
+        self._latencies = collections.defaultdict(list)
+        self._event_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        for entry in CallLog.read(path):
+            self._latencies[entry['call']].append(entry['ms'])
+            if entry['call'] == 'freebusy':
+                for calendar_id, (starts, ends) in entry['busy'].iteritems():
+                    self._busy_by_calendar[calendar_id].append(
+                        (entry['start'], entry['end'], lib.IntervalSet(zip(starts, ends))),
+                    )
+            else:
+                for event_entry in entry.get('operations', [entry]):
+                    self._event_results[event_entry['call']].append((event_entry['response'], event_entry['error']))
+
+    def process_calendar_query(self, calendar_query):
+        self._wait('freebusy')
+        start = lib.to_epoch_minutes(calendar_query.time_period.start_time)
+        end = lib.to_epoch_minutes(calendar_query.time_period.end_time)
+        return CalendarResponse.from_interview_calendars(calendar_query, [
+            InterviewCalendar.from_busy_set(interviewer, calendar_query.time_period, self._busy_set(interviewer.external_id, start, end))
+            for interviewer in calendar_query.interviewers
+        ])
+
+    def process_calendar_create(self, calendar):
+        self._wait(EventOperation.CREATE)
+        return self._replay_event(EventOperation(EventOperation.CREATE, calendar=calendar))
+
+    def process_calendar_delete(self, google_event_id):
+        self._wait(EventOperation.DELETE)
+        return self._replay_event(EventOperation(EventOperation.DELETE, google_event_id))
+
+    def process_calendar_update(self, google_event_id, updated_description):
+        self._wait(EventOperation.UPDATE)
+        return self._replay_event(EventOperation(EventOperation.UPDATE, google_event_id, updated_description=updated_description))
+
+    def process_calendar_batch(self, operations):
+        self._wait('batch')
+        results = []
+        for operation in operations:
+            try:
+                results.append((self._replay_event(operation), None))
+            except ReplayError as error:
+                results.append((None, error))
+        return results
+
+    def _busy_set(self, calendar_id, start, end):
+        for recorded_start, recorded_end, busy_set in self._busy_by_calendar.get(calendar_id, []):
+            if recorded_start <= start and end <= recorded_end:
+                return busy_set.clip(start, end)
+        with self._lock:
+            self.misses += 1
+        return lib.IntervalSet()
+
+    def _replay_event(self, operation):
+        with self._lock:
+            recorded_results = self._event_results[operation.kind]
+            if recorded_results:
+                response, error = recorded_results.popleft()
+                if error is not None:
+                    raise ReplayError(error)
+                return response
+            event_id = 'replayed-%s' % next(self._event_ids)
+
+        if operation.kind == EventOperation.CREATE:
+            return dict(operation.calendar.to_query_body(), id=event_id)
+        if operation.kind == EventOperation.UPDATE:
+            return dict(id=operation.google_event_id, description=operation.updated_description)
+        return ''
+
+    def _wait(self, call):
+        latency_ms = self.latency_ms
+        if self.recorded_latency and self._latencies[call]:
+            latency_ms = sum(self._latencies[call]) / float(len(self._latencies[call]))
+        if latency_ms:
+            time.sleep(latency_ms / 1000.0)
+
+
 class ServiceClient(object):
+    """Talks to the Google Calendar API.
 
-    def __init__(self, service):
-        self._service = service
+    Freebusy queries are split into chunks of MAX_INTERVIEWERS_IN_QUERY
+    calendars. Every call checks a service out of a ServicePool for its
+    duration, since httplib2 connections can't be shared between threads.
+    Given a service_factory, the pool grows to service_pool_size services
+    and chunks are sent concurrently from a thread pool; without one, calls
+    take turns on the single service. Services are only built when a call
+    needs one, so service may be None when there's a service_factory.
+    """
+
+    def __init__(
+            self,
+            service,
+            service_factory=None,
+            max_concurrent_queries=MAX_CONCURRENT_QUERIES,
+            service_pool_size=service_pool.SERVICE_POOL_SIZE,
+    ):
+        assert service is not None or service_factory is not None
+        self.service_pool = service_pool.ServicePool(
+                service_factory,
+                size=service_pool_size,
+                services=[service] if service is not None else [],
+        )
+        self._max_concurrent_queries = max_concurrent_queries if service_factory is not None else 1
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.api_calls = 0
+        self.response_bytes = 0
 
-    @lib.retry_decorator(BadStatusLine)
     def process_calendar_query(self, calendar_query):
-        query_body = calendar_query.to_query_body()
-        print "query body:"
-        #pprint(query_body)
-        return CalendarResponse(
-                calendar_query,
-                self._service.freebusy().query(body=query_body).execute()
+        chunks = calendar_query.chunks()
+        if len(chunks) > 1 and self._max_concurrent_queries > 1:
+            results = self._get_pool().map(self._timed_query_freebusy, chunks)
+        else:
+            results = [self._timed_query_freebusy(chunk) for chunk in chunks]
+
+        calendars = {}
+        for service_response, _ in results:
+            calendars.update(service_response['calendars'])
+        calendar_response = CalendarResponse(calendar_query, dict(calendars=calendars))
+        calendar_response.chunk_latencies = [chunk_latency for _, chunk_latency in results]
+        logger.info(
+                "freebusy for %s calendars in %s chunks: %s",
+                len(calendar_query.interviewers),
+                len(chunks),
+                ', '.join('%s in %.0fms' % chunk_latency for chunk_latency in calendar_response.chunk_latencies),
         )
+        return calendar_response
 
     @lib.retry_decorator(BadStatusLine)
-    def process_calendar_create(self, calendar):
-        body = calendar.to_query_body()
+    def query_freebusy(self, calendar_query):
+        """The raw freebusy response for a query of at most MAX_INTERVIEWERS_IN_QUERY calendars."""
+        with self.service_pool.checkout() as service:
+            return self._count(service.freebusy().query(body=calendar_query.to_query_body()).execute())
+
+    def _timed_query_freebusy(self, calendar_query):
+        start = time.time()
+        service_response = self.query_freebusy(calendar_query)
+        return service_response, ChunkLatency(len(calendar_query.interviewers), (time.time() - start) * 1000)
+
+    def warm_up(self):
+        with self.service_pool.checkout():
+            pass
 
-        return self._service.events().insert(calendarId=secret.INTERVIEW_CALENDAR_GROUP_ID, body=body).execute()
+    def stats(self):
+        """API calls made and the size of their JSON responses, for sizing jobs."""
+        with self._stats_lock:
+            return dict(api_calls=self.api_calls, response_bytes=self.response_bytes)
+
+    def _count(self, response):
+        response_bytes = len(json.dumps(response))
+        with self._stats_lock:
+            self.api_calls += 1
+            self.response_bytes += response_bytes
+        return response
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self._max_concurrent_queries)
+        return self._pool
+
+    @lib.retry_decorator(BadStatusLine)
+    def process_calendar_create(self, calendar):
+        return self._execute_event_operation(EventOperation(EventOperation.CREATE, calendar=calendar))
 
     @lib.retry_decorator(BadStatusLine)
     def process_calendar_delete(self, google_event_id):
-        return self._service.events().delete(calendarId=secret.INTERVIEW_CALENDAR_GROUP_ID, eventId=google_event_id).execute()
+        return self._execute_event_operation(EventOperation(EventOperation.DELETE, google_event_id))
 
     @lib.retry_decorator(BadStatusLine)
     def process_calendar_update(self, google_event_id, updated_description):
-        body = {'description': updated_description}
-        return self._service.events().patch(calendarId=secret.INTERVIEW_CALENDAR_GROUP_ID, eventId=google_event_id, body=body).execute()
+        return self._execute_event_operation(
+                EventOperation(EventOperation.UPDATE, google_event_id, updated_description=updated_description),
+        )
+
+    def process_calendar_batch(self, operations):
+        """Send event operations MAX_EVENTS_IN_BATCH at a time as multipart batch requests.
+
+        Returns a (response, error) pair for each operation, in order.
+        """
+        results = []
+        for start in xrange(0, len(operations), MAX_EVENTS_IN_BATCH):
+            results.extend(self._send_batch(operations[start:start + MAX_EVENTS_IN_BATCH]))
+        return results
+
+    @lib.retry_decorator(BadStatusLine)
+    def _send_batch(self, operations):
+        results = {}
+
+        def record_result(request_id, response, error):
+            results[request_id] = (response, error)
+
+        with self.service_pool.checkout() as service:
+            batch = _new_batch_http_request(service)
+            for index, operation in enumerate(operations):
+                batch.add(_event_request(service, operation), callback=record_result, request_id=str(index))
+            batch.execute()
+        self._count([response for response, _ in results.itervalues()])
+        logger.info("sent %s event operations in one batch", len(operations))
+        return [results[str(index)] for index in xrange(len(operations))]
+
+    @lib.retry_decorator(BadStatusLine)
+    def list_events(self, calendar_id, sync_token=None, page_token=None):
+        """A page of calendar_id's events, or of the ones that changed since sync_token."""
+        with self.service_pool.checkout() as service:
+            return self._count(service.events().list(
+                    calendarId=calendar_id,
+                    syncToken=sync_token,
+                    pageToken=page_token,
+                    singleEvents=True,
+                    maxResults=MAX_EVENTS_IN_PAGE,
+            ).execute())
+
+    @lib.retry_decorator(BadStatusLine)
+    def watch_events(self, calendar_id, channel):
+        with self.service_pool.checkout() as service:
+            return self._count(service.events().watch(calendarId=calendar_id, body=channel).execute())
+
+    def _execute_event_operation(self, operation):
+        with self.service_pool.checkout() as service:
+            return self._count(_event_request(service, operation).execute())
+
+
+def _event_request(service, operation):
+    events = service.events()
+    if operation.kind == EventOperation.CREATE:
+        return events.insert(calendarId=secret.INTERVIEW_CALENDAR_GROUP_ID, body=operation.calendar.to_query_body())
+    if operation.kind == EventOperation.UPDATE:
+        body = {'description': operation.updated_description}
+        return events.patch(calendarId=secret.INTERVIEW_CALENDAR_GROUP_ID, eventId=operation.google_event_id, body=body)
+    return events.delete(calendarId=secret.INTERVIEW_CALENDAR_GROUP_ID, eventId=operation.google_event_id)
+
+
+def _new_batch_http_request(service):
+    # Newer apiclient services build their own batches; ours predates that
+    if hasattr(service, 'new_batch_http_request'):
+        return service.new_batch_http_request()
+    return BatchHttpRequest()
 
 
 # Define a module level client that people can import
@@ -0,0 +1,197 @@
+"""Who is free when, answered from availability we already have locally.
+
+FreeIndex keeps an inverted index per local day: for every slot of the
+day, the set of interviewers free for the whole of it, as a bitmask over
+the day's interviewers. It's built from the Client's freebusy cache, and
+from the calendar mirror when there is one, and never calls the calendar
+API; interviewers whose day isn't in either are reported as unknown
+rather than fetched. Run prewarm_calendars so there are few of those.
+
+A day's index is rebuilt once it's older than FREE_INDEX_TTL, so a booking
+made through another process shows up within that long.
+"""
+import threading
+import time
+
+from caltech import secret
+from jeeves import capacity
+from jeeves import models
+from . import cache
+from . import lib
+
+FREE_INDEX_RESOLUTION = 15  # Minutes per slot
+FREE_INDEX_TTL = getattr(secret, 'free_index_ttl', 60)  # Seconds
+
+
+class DayIndex(object):
+    """One local day's slots, each the bitmask of the interviewers free for all of it.
+
+    Bit i stands for interviewer_ids[i]. Interviewers without cached
+    availability for the day have no bits set and are in unknown.
+    preferred_by_slot does the same for the busy time on each interviewer's
+    preferences calendar, which is when they'd like to interview.
+    """
+
+    def __init__(self, day, interviewer_ids, busy_sets, resolution=FREE_INDEX_RESOLUTION, built_at=None, preference_busy_sets=None):
+        self.day = day
+        self.start, self.end = cache.day_bounds(day)
+        self.resolution = resolution
+        self.interviewer_ids = list(interviewer_ids)
+        self._bits = dict((interviewer_id, bit) for bit, interviewer_id in enumerate(self.interviewer_ids))
+        self.built_at = built_at
+        self.unknown = set()
+        self.free_by_slot = [0] * ((self.end - self.start) // resolution)
+        self.preferred_by_slot = [0] * len(self.free_by_slot)
+        for bit, interviewer_id in enumerate(self.interviewer_ids):
+            busy_set = busy_sets.get(interviewer_id)
+            if busy_set is None:
+                self.unknown.add(interviewer_id)
+                continue
+            self._mark_covered_slots(self.free_by_slot, bit, busy_set.complement(self.start, self.end))
+        for interviewer_id, preference_busy_set in (preference_busy_sets or {}).iteritems():
+            if interviewer_id in self._bits:
+                self._mark_covered_slots(self.preferred_by_slot, self._bits[interviewer_id], preference_busy_set)
+
+    def bit(self, interviewer_id):
+        """interviewer_id's bit in the masks, or None if it isn't indexed."""
+        return self._bits.get(interviewer_id)
+
+    def free_mask(self, start, end, duration):
+        """Bitmask of interviewers free for duration consecutive minutes somewhere in [start, end), in epoch minutes."""
+        num_slots = max(1, -(-duration // self.resolution))
+        first_slot = max(0, -(-(start - self.start) // self.resolution))
+        last_slot = min(len(self.free_by_slot), (end - self.start) // self.resolution)
+        everyone = (1 << len(self.interviewer_ids)) - 1
+        mask = 0
+        for run_start in xrange(first_slot, last_slot - num_slots + 1):
+            run = everyone
+            for slot in xrange(run_start, run_start + num_slots):
+                run &= self.free_by_slot[slot]
+                if not run:
+                    break
+            mask |= run
+        return mask
+
+    def preferred_mask(self, start, end):
+        """Bitmask of interviewers whose preferences calendar is busy for all of [start, end)."""
+        first_slot = max(0, -(-(start - self.start) // self.resolution))
+        last_slot = min(len(self.preferred_by_slot), (end - self.start) // self.resolution)
+        if first_slot >= last_slot:
+            return 0
+        mask = (1 << len(self.interviewer_ids)) - 1
+        for slot in xrange(first_slot, last_slot):
+            mask &= self.preferred_by_slot[slot]
+        return mask
+
+    def interviewer_ids_in(self, mask):
+        return [interviewer_id for bit, interviewer_id in enumerate(self.interviewer_ids) if mask >> bit & 1]
+
+    def _mark_covered_slots(self, mask_by_slot, bit, interval_set):
+        for start, end in interval_set:
+            # Only slots the interval covers from end to end
+            first_slot = max(0, -(-(start - self.start) // self.resolution))
+            last_slot = min(len(mask_by_slot), (end - self.start) // self.resolution)
+            for slot in xrange(first_slot, last_slot):
+                mask_by_slot[slot] |= 1 << bit
+
+
+class FreeIndex(object):
+    """DayIndexes over every Interviewer, built from calendar_client's cached availability as days are asked about."""
+
+    def __init__(self, calendar_client, resolution=FREE_INDEX_RESOLUTION, ttl=FREE_INDEX_TTL, clock=time.time):
+        self._calendar_client = calendar_client
+        self.resolution = resolution
+        self.ttl = ttl
+        self._clock = clock
+        self._days = {}
+        self._lock = threading.Lock()
+
+    def day_index(self, day):
+        with self._lock:
+            day_index = self._days.get(day)
+        if day_index is None or self._clock() - day_index.built_at > self.ttl:
+            day_index = self._build(day)
+            with self._lock:
+                self._days[day] = day_index
+        return day_index
+
+    def invalidate(self, day=None):
+        with self._lock:
+            if day is None:
+                self._days.clear()
+            else:
+                self._days.pop(day, None)
+
+    def free_interviewers(self, interviewers, time_period, duration):
+        """Interviewers free for duration minutes somewhere in time_period, least loaded that week first.
+
+        Returns (free, unknown): free is a list of (interviewer, weekly load)
+        pairs, and unknown the interviewers we have no cached availability
+        for on some day of the period.
+        """
+        interviewers = list(interviewers)
+        start = lib.to_epoch_minutes(time_period.start_time)
+        end = lib.to_epoch_minutes(time_period.end_time)
+        free_ids = set()
+        unknown_ids = set()
+        for day in cache.days_covered(time_period):
+            day_index = self.day_index(day)
+            free_ids.update(day_index.interviewer_ids_in(day_index.free_mask(start, end, duration)))
+            unknown_ids.update(day_index.unknown)
+            # Interviewers added since the day was indexed
+            indexed_ids = set(day_index.interviewer_ids)
+            unknown_ids.update(interviewer.id for interviewer in interviewers if interviewer.id not in indexed_ids)
+
+        free = [interviewer for interviewer in interviewers if interviewer.id in free_ids]
+        weekly_loads = capacity.load_weekly_loads([interviewer.id for interviewer in free], time_period.start_time)
+        ranked = sorted(
+            (
+                (interviewer, weekly_loads[interviewer.id].load if interviewer.id in weekly_loads else 0)
+                for interviewer in free
+            ),
+            key=lambda interviewer_load: (interviewer_load[1], interviewer_load[0].display_name),
+        )
+        unknown = [interviewer for interviewer in interviewers if interviewer.id in unknown_ids and interviewer.id not in free_ids]
+        return ranked, unknown
+
+    def _build(self, day):
+        built_at = self._clock()
+        interviewers = list(models.Interviewer.objects.all())
+        busy_sets_by_calendar = self._cached_busy_sets(
+            [interviewer.external_id for interviewer in interviewers]
+            + [interviewer.preferences_address for interviewer in interviewers if interviewer.preferences_address],
+            day,
+        )
+
+        return DayIndex(
+            day,
+            [interviewer.id for interviewer in interviewers],
+            dict(
+                (interviewer.id, busy_sets_by_calendar[interviewer.external_id])
+                for interviewer in interviewers
+                if interviewer.external_id in busy_sets_by_calendar
+            ),
+            self.resolution,
+            built_at,
+            preference_busy_sets=dict(
+                (interviewer.id, busy_sets_by_calendar[interviewer.preferences_address])
+                for interviewer in interviewers
+                if interviewer.preferences_address in busy_sets_by_calendar
+            ),
+        )
+
+    def _cached_busy_sets(self, calendar_ids, day):
+        """{calendar id: day's IntervalSet} from the mirror and the freebusy cache, for the calendars either has."""
+        start, end = cache.day_bounds(day)
+        busy_sets_by_calendar = {}
+        calendar_mirror = getattr(self._calendar_client, 'mirror', None)
+        if calendar_mirror is not None:
+            busy_sets_by_calendar.update(calendar_mirror.busy_sets(calendar_ids, start, end))
+        freebusy_cache = getattr(self._calendar_client, 'freebusy_cache', None)
+        if freebusy_cache is not None:
+            for calendar_id in calendar_ids:
+                if calendar_id not in busy_sets_by_calendar:
+                    cached = freebusy_cache.get(calendar_id, [day])
+                    if cached is not None:
+                        busy_sets_by_calendar[calendar_id] = cached[0]
+        return busy_sets_by_calendar
@@ -1,6 +1,9 @@
 from datetime import timedelta
 from datetime import datetime
+import bisect
+import calendar
 import itertools
+import re
 import time
 
 import pytz
@@ -8,6 +11,7 @@ import pytz
 from caltech import settings
 
 TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+RFC3339_RE = re.compile(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.\d+)?(?:Z|([+-])(\d\d):(\d\d))$')
 
 
 class TimePeriod(object):
@@ -43,53 +47,157 @@ def parse_utc_datetime(dt):
     # Google gives us back times in UTC
     return parsed.astimezone(pytz.timezone(settings.TIME_ZONE))
 
+def parse_utc_epoch_minutes(dt):
+    return to_epoch_minutes(datetime.strptime(dt, TIME_FORMAT))
+
+def parse_rfc3339_epoch_minutes(dt):
+    """Event times come back with the calendar's offset, e.g. 2014-08-05T10:00:00-07:00, not always in UTC."""
+    match = RFC3339_RE.match(dt)
+    if match is None:
+        raise ValueError("Not an RFC 3339 time: %s" % dt)
+    local_time, sign, offset_hours, offset_minutes = match.groups()
+    minutes = to_epoch_minutes(datetime.strptime(local_time, "%Y-%m-%dT%H:%M:%S"))
+    if sign is not None:
+        offset = int(offset_hours) * 60 + int(offset_minutes)
+        minutes += -offset if sign == '+' else offset
+    return minutes
+
 def pairwise(iterable):
     "s -> (s0,s1), (s1,s2), (s2, s3), ..."
     a, b = itertools.tee(iterable)
     next(b, None)
     return itertools.izip(a, b)
 
-def collapse_times(time_pairs):
-    if len(time_pairs) <= 1:
-        return time_pairs
+def localize(dt):
+    """dt if it's aware, otherwise dt taken as local time."""
+    if dt.tzinfo is None:
+        return pytz.timezone(settings.TIME_ZONE).localize(dt)
+    return dt
 
-    time_pairs = sorted(time_pairs)
+def to_epoch_minutes(dt):
+    return calendar.timegm(dt.utctimetuple()) // 60
 
-    tmp_first = None
-    collapsed_times = []
-    # Collapse adjecent time-blocks together into a single block
-    for chunk1, chunk2 in pairwise(time_pairs):
-        if chunk1[1] >= chunk2[0]:
-            if tmp_first is None:
-                tmp_first = chunk1[0]
-        else:
-            if tmp_first is None:
-                collapsed_times.append(chunk1)
+def from_epoch_minutes(minutes):
+    return datetime.fromtimestamp(minutes * 60, pytz.utc).astimezone(pytz.timezone(settings.TIME_ZONE))
+
+
+class IntervalSet(object):
+    """Sorted, non-overlapping intervals stored as parallel start/end lists.
+
+    Endpoints are normally epoch minutes (see from_time_periods), but any
+    orderable values work, which is what collapse_times relies on.
+    Point queries are bisects, so they're O(log n) in the number of intervals.
+    """
+
+    def __init__(self, pairs=()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(pairs):
+            if start >= end:
+                continue
+            if self.ends and start <= self.ends[-1]:
+                if end > self.ends[-1]:
+                    self.ends[-1] = end
             else:
-                collapsed_times.append((tmp_first, chunk1[1]))
-                tmp_first = None
+                self.starts.append(start)
+                self.ends.append(end)
+
+    @classmethod
+    def _from_sorted(cls, starts, ends):
+        interval_set = cls()
+        interval_set.starts = starts
+        interval_set.ends = ends
+        return interval_set
+
+    @classmethod
+    def from_time_periods(cls, time_periods):
+        return cls(
+            (to_epoch_minutes(time_period.start_time), to_epoch_minutes(time_period.end_time))
+            for time_period in time_periods
+        )
+
+    def __len__(self):
+        return len(self.starts)
 
-    if tmp_first is None:
-        collapsed_times.append(chunk2)
-    else:
-        collapsed_times.append((tmp_first, chunk2[1]))
+    def __iter__(self):
+        return itertools.izip(self.starts, self.ends)
 
-    return collapsed_times
+    def __eq__(self, other):
+        return isinstance(other, IntervalSet) and self.starts == other.starts and self.ends == other.ends
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "IntervalSet(%s)" % (list(self),)
+
+    def contains(self, start, end):
+        """Whether [start, end] lies entirely inside a single interval."""
+        index = bisect.bisect_right(self.starts, start) - 1
+        return index >= 0 and self.ends[index] >= end
+
+    def overlaps(self, start, end):
+        """Whether any interval shares more than an endpoint with (start, end)."""
+        index = bisect.bisect_right(self.ends, start)
+        return index < len(self.starts) and self.starts[index] < end
+
+    def union(self, other):
+        return IntervalSet(itertools.chain(self, other))
+
+    def intersection(self, other):
+        starts = []
+        ends = []
+        i = j = 0
+        while i < len(self.starts) and j < len(other.starts):
+            start = max(self.starts[i], other.starts[j])
+            end = min(self.ends[i], other.ends[j])
+            if start < end:
+                starts.append(start)
+                ends.append(end)
+            if self.ends[i] < other.ends[j]:
+                i += 1
+            else:
+                j += 1
+        return IntervalSet._from_sorted(starts, ends)
+
+    def complement(self, start, end):
+        """The gaps between our intervals, clipped to [start, end]."""
+        starts = []
+        ends = []
+        current = start
+        index = bisect.bisect_right(self.ends, start)
+        for interval_start, interval_end in itertools.izip(self.starts[index:], self.ends[index:]):
+            if interval_start >= end:
+                break
+            if interval_start > current:
+                starts.append(current)
+                ends.append(interval_start)
+            current = max(current, interval_end)
+        if current < end:
+            starts.append(current)
+            ends.append(end)
+        return IntervalSet._from_sorted(starts, ends)
+
+    def clip(self, start, end):
+        return self.intersection(IntervalSet._from_sorted([start], [end]))
+
+    def to_time_periods(self):
+        return [
+            TimePeriod(from_epoch_minutes(start), from_epoch_minutes(end))
+            for start, end in self
+        ]
+
+
+def collapse_times(time_pairs):
+    if len(time_pairs) <= 1:
+        return time_pairs
+
+    # Collapse adjecent time-blocks together into a single block
+    return list(IntervalSet(time_pairs))
 
 def calculate_free_times(busy_times, start_time, end_time):
     # Turn busy times into free times
-    free_times = []
-    for busy_time in busy_times:
-        if busy_time[0] <= start_time:
-            start_time = busy_time[1]
-            continue
-
-        free_times.append((start_time, busy_time[0]))
-        start_time = busy_time[1]
-    if start_time < end_time:
-        free_times.append((start_time, end_time))
-
-    return free_times
+    return list(IntervalSet(busy_times).complement(start_time, end_time))
 
 def retry_decorator(exception_to_retry, max_number_of_tries=3, sleeping_function=lambda: time.sleep(1)):
     def decorator(function):
@@ -0,0 +1,227 @@
+"""A local copy of the events on our scheduling calendars.
+
+Instead of asking Google for freebusy on every request, we keep each
+interviewer, room and preference calendar's busy events in the database
+(MirroredCalendar and MirroredEvent) and bring them up to date
+incrementally:
+
+- sync pulls only what changed since the last sync, using the sync token
+  Google handed back last time; the first sync, or one after Google
+  expires the token, pulls everything.
+- watch asks Google to POST to our webhook (views.calendar_notification)
+  whenever a calendar changes, and the webhook syncs that calendar.
+- ./manage.py sync_calendar_mirror, run from cron, syncs every calendar
+  and renews channels before they expire, in case a notification went
+  missing.
+
+With calendar_mirror = True and a calendar_webhook_token in secret.py, the
+default Client answers freebusy queries for recently synced calendars from
+the mirror and asks Google only about the rest. Calendars we can't read events from (sync
+fails with a 403 or 404) just stay on freebusy. The freebusy cache sits in
+front of the mirror, so a sync that changes a calendar drops that
+calendar's cached days.
+"""
+import collections
+import logging
+import uuid
+from datetime import datetime
+from datetime import timedelta
+
+import pytz
+from apiclient.errors import HttpError
+from django.db import transaction
+from django.utils import timezone
+
+from caltech import secret
+from jeeves import models
+from . import cache
+from . import lib
+
+CALENDAR_MIRROR = getattr(secret, 'calendar_mirror', False)
+# Where Google should send change notifications, e.g. https://caltech.example.com/calendar_notification/
+WEBHOOK_URL = getattr(secret, 'calendar_webhook_url', None)
+# Sent back with every notification; the mirror won't run without one
+WEBHOOK_TOKEN = getattr(secret, 'calendar_webhook_token', None)
+# A calendar that hasn't synced for this long is asked about over freebusy again
+MIRROR_MAX_AGE = timedelta(seconds=getattr(secret, 'calendar_mirror_max_age', 60 * 60))
+RENEW_CHANNELS_BEFORE = timedelta(days=1)
+# Events deleted per query, to stay under sqlite's limit on query parameters
+DELETE_CHUNK_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def scheduling_calendar_ids():
+    """Every calendar we schedule against: interviewers, rooms and preferences."""
+    calendar_ids = set()
+    for interviewer in models.Interviewer.objects.all():
+        calendar_ids.add(interviewer.external_id)
+        if interviewer.preferences_address:
+            calendar_ids.add(interviewer.preferences_address)
+    calendar_ids.update(room.external_id for room in models.Room.objects.all())
+    return sorted(calendar_ids)
+
+
+def busy_minutes(event):
+    """The (start, end) epoch minutes an event blocks, or None if it doesn't block any time."""
+    if event.get('status') == 'cancelled' or event.get('transparency') == 'transparent':
+        return None
+    for attendee in event.get('attendees', []):
+        if attendee.get('self') and attendee.get('responseStatus') == 'declined':
+            return None
+    if 'start' not in event or 'end' not in event:
+        return None
+    if 'dateTime' in event['start']:
+        return (
+            lib.parse_rfc3339_epoch_minutes(event['start']['dateTime']),
+            lib.parse_rfc3339_epoch_minutes(event['end']['dateTime']),
+        )
+    # All day events, which run midnight to midnight locally
+    return (
+        cache.day_bounds(datetime.strptime(event['start']['date'], '%Y-%m-%d').date())[0],
+        cache.day_bounds(datetime.strptime(event['end']['date'], '%Y-%m-%d').date())[0],
+    )
+
+
+class CalendarMirror(object):
+
+    def __init__(self, service_client, max_age=MIRROR_MAX_AGE, clock=timezone.now, freebusy_cache=None):
+        self._service_client = service_client
+        self.max_age = max_age
+        self._clock = clock
+        self.freebusy_cache = freebusy_cache
+
+    def busy_sets(self, calendar_ids, start, end):
+        """{calendar id: IntervalSet} between epoch minutes start and end, for the calendars that are mirrored and fresh."""
+        calendar_ids_by_pk = dict(
+            models.MirroredCalendar.objects.filter(
+                calendar_id__in=list(calendar_ids),
+                sync_token__isnull=False,
+                synced_at__gte=self._clock() - self.max_age,
+            ).values_list('id', 'calendar_id')
+        )
+        busy_pairs = dict((calendar_id, []) for calendar_id in calendar_ids_by_pk.itervalues())
+        if calendar_ids_by_pk:
+            events = models.MirroredEvent.objects.filter(
+                calendar__in=calendar_ids_by_pk.keys(),
+                start_minute__lt=end,
+                end_minute__gt=start,
+            ).values_list('calendar', 'start_minute', 'end_minute')
+            for calendar_pk, event_start, event_end in events:
+                busy_pairs[calendar_ids_by_pk[calendar_pk]].append((max(event_start, start), min(event_end, end)))
+        return dict((calendar_id, lib.IntervalSet(pairs)) for calendar_id, pairs in busy_pairs.iteritems())
+
+    def sync(self, calendar_id):
+        """Pull what changed on calendar_id since its last sync, or all of it the first time. Returns how many events changed."""
+        mirrored_calendar, _ = models.MirroredCalendar.objects.get_or_create(calendar_id=calendar_id)
+        sync_token = mirrored_calendar.sync_token
+        try:
+            events, next_sync_token = self._list_events(calendar_id, sync_token)
+        except HttpError as error:
+            if sync_token is None or error.resp.status != 410:
+                raise
+            # Google expired our sync token, so start over
+            sync_token = None
+            events, next_sync_token = self._list_events(calendar_id, None)
+
+        changed_minutes = self._apply(mirrored_calendar, events, next_sync_token, full_sync=sync_token is None)
+        self._invalidate_freebusy(calendar_id, changed_minutes, full_sync=sync_token is None)
+        return len(events)
+
+    def watch(self, calendar_id):
+        """Ask Google to notify WEBHOOK_URL when calendar_id changes."""
+        channel = dict(id=uuid.uuid4().hex, type='web_hook', address=WEBHOOK_URL, token=WEBHOOK_TOKEN)
+        response = self._service_client.watch_events(calendar_id, channel)
+
+        mirrored_calendar, _ = models.MirroredCalendar.objects.get_or_create(calendar_id=calendar_id)
+        mirrored_calendar.channel_id = channel['id']
+        mirrored_calendar.resource_id = response['resourceId']
+        mirrored_calendar.channel_expiration = datetime.fromtimestamp(int(response['expiration']) / 1000.0, pytz.utc)
+        mirrored_calendar.save()
+
+    def handle_notification(self, channel_id, resource_id, resource_state):
+        """Sync the calendar a change notification is about. Returns False for channels we don't know."""
+        mirrored_calendars = models.MirroredCalendar.objects.filter(channel_id=channel_id, resource_id=resource_id)[:1]
+        if not mirrored_calendars:
+            return False
+        # Google sends a 'sync' notification when a channel opens; nothing has changed yet
+        if resource_state != 'sync':
+            self.sync(mirrored_calendars[0].calendar_id)
+        return True
+
+    def refresh(self, calendar_ids):
+        """Sync each calendar, and watch it if its channel is missing or about to expire. Returns the ids that failed."""
+        channel_expirations = dict(
+            models.MirroredCalendar.objects.filter(calendar_id__in=calendar_ids).values_list('calendar_id', 'channel_expiration')
+        )
+        renew_before = self._clock() + RENEW_CHANNELS_BEFORE
+        failed = []
+        for calendar_id in calendar_ids:
+            try:
+                self.sync(calendar_id)
+                channel_expiration = channel_expirations.get(calendar_id)
+                if WEBHOOK_URL and (channel_expiration is None or channel_expiration < renew_before):
+                    self.watch(calendar_id)
+            except HttpError as error:
+                logger.warning("couldn't mirror %s: %s", calendar_id, error)
+                models.MirroredCalendar.objects.filter(calendar_id=calendar_id).update(sync_error=str(error.resp.status))
+                failed.append(calendar_id)
+        return failed
+
+    def _invalidate_freebusy(self, calendar_id, changed_minutes, full_sync):
+        if self.freebusy_cache is None:
+            return
+        if full_sync:
+            # We don't know what the cache had before, so none of it can be trusted
+            self.freebusy_cache.invalidate(calendar_id)
+            return
+        days = set()
+        for start, end in changed_minutes:
+            days.update(cache.days_covered(lib.TimePeriod(lib.from_epoch_minutes(start), lib.from_epoch_minutes(end))))
+        if days:
+            self.freebusy_cache.invalidate(calendar_id, sorted(days))
+
+    def _list_events(self, calendar_id, sync_token):
+        events = []
+        page_token = None
+        while True:
+            response = self._service_client.list_events(calendar_id, sync_token=sync_token, page_token=page_token)
+            events.extend(response.get('items', []))
+            page_token = response.get('nextPageToken')
+            if page_token is None:
+                return events, response['nextSyncToken']
+
+    @transaction.commit_on_success
+    def _apply(self, mirrored_calendar, events, next_sync_token, full_sync):
+        """Returns the (start, end) minutes of every event version removed or added, outside a full sync."""
+        # An event can change more than once between syncs; its last version wins
+        latest_events = collections.OrderedDict((event['id'], event) for event in events)
+        mirrored_events = models.MirroredEvent.objects.filter(calendar=mirrored_calendar)
+        changed_minutes = []
+        if full_sync:
+            mirrored_events.delete()
+        else:
+            event_ids = latest_events.keys()
+            for start in xrange(0, len(event_ids), DELETE_CHUNK_SIZE):
+                replaced_events = mirrored_events.filter(event_id__in=event_ids[start:start + DELETE_CHUNK_SIZE])
+                changed_minutes.extend(replaced_events.values_list('start_minute', 'end_minute'))
+                replaced_events.delete()
+
+        new_events = []
+        for event_id, event in latest_events.iteritems():
+            minutes = busy_minutes(event)
+            if minutes is not None and minutes[0] < minutes[1]:
+                changed_minutes.append(minutes)
+                new_events.append(models.MirroredEvent(
+                    calendar=mirrored_calendar,
+                    event_id=event_id,
+                    start_minute=minutes[0],
+                    end_minute=minutes[1],
+                ))
+        models.MirroredEvent.objects.bulk_create(new_events)
+
+        mirrored_calendar.sync_token = next_sync_token
+        mirrored_calendar.synced_at = self._clock()
+        mirrored_calendar.sync_error = ''
+        mirrored_calendar.save()
+        return changed_minutes
@@ -0,0 +1,129 @@
+"""Fetch every scheduling calendar ahead of time so requests find it cached.
+
+prewarm fetches the calendars of every Interviewer, Room and preferences
+address for the next PREWARM_BUSINESS_DAYS business days, in one
+chunked freebusy query, into the client's freebusy store. Run it with
+./manage.py prewarm_calendars from cron, or set prewarm_in_process = True
+in secret.py to have each web process run it every PREWARM_INTERVAL
+seconds (see caltech/wsgi.py).
+
+Prewarmed days stay fresh for PREWARM_CACHE_TTL rather than
+freebusy_cache_ttl, so a nightly run still answers the next day's
+requests. Our own bookings and event changes write through to or drop
+those days, and so does a calendar mirror sync; changes made straight in
+Google only show up at the next run, so run it more often than nightly if
+that matters.
+"""
+import collections
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django import db
+from django.utils import timezone
+
+from caltech import secret
+from jeeves import models
+from . import cache
+from . import lib
+from . import mirror
+
+PREWARM_BUSINESS_DAYS = getattr(secret, 'prewarm_business_days', 10)
+PREWARM_INTERVAL = getattr(secret, 'prewarm_interval', 60 * 60)  # Seconds
+PREWARM_CACHE_TTL = getattr(secret, 'prewarm_cache_ttl', 24 * 60 * 60)  # Seconds
+PREWARM_IN_PROCESS = getattr(secret, 'prewarm_in_process', False)
+
+logger = logging.getLogger(__name__)
+
+PrewarmReport = collections.namedtuple(
+    'PrewarmReport',
+    ['num_calendars', 'first_day', 'last_day', 'seconds', 'api_calls', 'response_bytes'],
+)
+
+
+def business_days(first_day, num_days):
+    """The first num_days weekdays from first_day on."""
+    days = []
+    day = first_day
+    while len(days) < num_days:
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def prewarm(calendar_client, num_days=PREWARM_BUSINESS_DAYS, today=None):
+    """Refetch every scheduling calendar for the next num_days business days. Returns a PrewarmReport."""
+    start = time.time()
+    stats_before = calendar_client.service_stats()
+    if today is None:
+        today = timezone.localtime(timezone.now()).date()
+    days = business_days(today, num_days)
+    calendars = [
+        models.InterviewerStruct(address=calendar_id, external_id=calendar_id)
+        for calendar_id in mirror.scheduling_calendar_ids()
+    ]
+
+    # One window over the weekends in between costs a few more days per calendar, but far fewer requests
+    first_day_start, _ = cache.day_bounds(days[0])
+    _, last_day_end = cache.day_bounds(days[-1])
+    calendar_client.prefetch_calendars(
+        calendars,
+        lib.TimePeriod(lib.from_epoch_minutes(first_day_start), lib.from_epoch_minutes(last_day_end)),
+        ttl=PREWARM_CACHE_TTL,
+    )
+
+    stats_after = calendar_client.service_stats()
+    api_calls = response_bytes = None
+    if stats_before is not None:
+        api_calls = stats_after['api_calls'] - stats_before['api_calls']
+        response_bytes = stats_after['response_bytes'] - stats_before['response_bytes']
+    report = PrewarmReport(len(calendars), days[0], days[-1], time.time() - start, api_calls, response_bytes)
+    logger.info("prewarmed %s", format_report(report))
+    return report
+
+
+def format_report(report):
+    return "%s calendars from %s to %s in %.1fs: %s API calls, %s KB" % (
+        report.num_calendars,
+        report.first_day,
+        report.last_day,
+        report.seconds,
+        report.api_calls if report.api_calls is not None else '?',
+        report.response_bytes // 1024 if report.response_bytes is not None else '?',
+    )
+
+
+class PrewarmScheduler(object):
+    """Runs prewarm every interval seconds on a daemon thread until stopped."""
+
+    def __init__(self, calendar_client, interval=PREWARM_INTERVAL, num_days=PREWARM_BUSINESS_DAYS):
+        self._calendar_client = calendar_client
+        self.interval = interval
+        self.num_days = num_days
+        self.last_report = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.last_report = prewarm(self._calendar_client, self.num_days)
+            except Exception:
+                logger.exception("prewarm failed")
+            finally:
+                # This thread's connection would otherwise sit open between runs
+                db.close_connection()
+            self._stopped.wait(self.interval)
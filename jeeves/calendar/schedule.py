@@ -1,15 +1,33 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import logging
+import os
+import time
+
 import httplib2
-from apiclient.discovery import build
+from apiclient.discovery import DISCOVERY_URI
+from apiclient.discovery import build_from_document
 from oauth2client.client import flow_from_clientsecrets
 from oauth2client.file import Storage
 from oauth2client.tools import run
 
+from caltech import secret
+
 CLIENT_SECRETS = 'auth.json'
 TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
+# The Calendar v3 discovery document rarely changes; delete the file to refetch it
+DISCOVERY_DOCUMENT_PATH = getattr(
+    secret,
+    'calendar_discovery_document_path',
+    secret.PROJECT_PATH + 'calendar-v3-discovery.json',
+)
+
+logger = logging.getLogger(__name__)
+
+
 def build_service():
+    start = time.time()
     # Set up a Flow object to be used if we need to authenticate.
     FLOW = flow_from_clientsecrets(
             CLIENT_SECRETS,
@@ -21,11 +39,38 @@ def build_service():
     credentials = storage.get()
     if credentials is None or credentials.invalid:
         credentials = run(FLOW, storage)
+    credentials_time = time.time()
 
     # Create an httplib2.Http object to handle our HTTP requests and authorize it
     # with our good Credentials.
     http = httplib2.Http()
     http = credentials.authorize(http)
 
-    service = build('calendar', 'v3', http=http)
+    discovery_document = load_discovery_document(http)
+    discovery_time = time.time()
+
+    service = build_from_document(discovery_document, base=DISCOVERY_URI, http=http)
+    logger.info(
+            "built calendar service in %.0fms (credentials %.0fms, discovery document %.0fms)",
+            (time.time() - start) * 1000,
+            (credentials_time - start) * 1000,
+            (discovery_time - credentials_time) * 1000,
+    )
     return service
+
+
+def load_discovery_document(http, path=DISCOVERY_DOCUMENT_PATH):
+    """The Calendar v3 discovery document, from disk if we've fetched it before."""
+    if os.path.exists(path):
+        with open(path) as discovery_file:
+            return discovery_file.read()
+
+    response, content = http.request(DISCOVERY_URI.replace('{api}', 'calendar').replace('{apiVersion}', 'v3'))
+    if response.status >= 400:
+        raise IOError("Couldn't fetch the calendar discovery document: %s" % response.status)
+    # Write then rename so a worker never reads half a document
+    temporary_path = '%s.%s' % (path, os.getpid())
+    with open(temporary_path, 'w') as discovery_file:
+        discovery_file.write(content)
+    os.rename(temporary_path, path)
+    return content
@@ -3,21 +3,33 @@ from datetime import timedelta
 import collections
 import heapq
 import itertools
+import multiprocessing
 import random
 import time
 import pytz
 
 
 from caltech import secret
+from jeeves import capacity
 from jeeves import models
 from jeeves.calendar import lib
+from jeeves.calendar.async_client import AsyncClient
+from jeeves.calendar.availability import AvailabilityMatrix
+from jeeves.calendar.client import CalendarQueryPlan
 from jeeves.calendar.client import calendar_client
 
+SEARCH_PROCESSES = getattr(secret, 'search_processes', None)
+
 MINUTES_OF_INTERVIEW = 45
 SCAN_RESOLUTION = 15  # Minutes
 IDEAL_PADDING_TIME = 15  # Minutes
 BREAK = 'Break'
 
+# Row kinds in the AvailabilityMatrix built for each calculate_schedules call
+INTERVIEWER_ROW = 'interviewer'
+ROOM_ROW = 'room'
+PREFERENCE_ROW = 'preference'
+
 
 class NoInterviewersAvailableError(Exception): pass
 
@@ -77,44 +89,59 @@ class Interview(object):
         self.interview_slots = interview_slots
         self.room = room
         self.priority = priority
-InterviewerGroup = collections.namedtuple('InterviewerGroup', ('num_required', 'interviewers'))
 
+    @property
+    def fingerprint(self):
+        return schedule_fingerprint(self.interview_slots, self.room)
 
-def load_number_of_alternate_events(interviewer_id, week_start, week_end):
-    alternative_events = models.AlternateRecruitingEvent.objects.filter(
-        interviewer_id=interviewer_id,
-    )
-    number_of_events_in_the_week = 0
-    for event in alternative_events:
-        week = event.time.date().isocalendar()[1]
-        if week_start == week:
-            number_of_events_in_the_week += 1
+    @property
+    def start_time(self):
+        if self.room is not None:
+            return self.room.start_time
+        return self.interview_slots[0].start_time
 
-    return number_of_events_in_the_week
+    def __eq__(self, other):
+        return isinstance(other, Interview) and self.fingerprint == other.fingerprint
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.fingerprint)
+
+
+def schedule_fingerprint(interview_slots, room=None):
+    """Canonical, hashable identity of a schedule: who interviews at which minute, and in which room.
+
+    Breaks are left out; where they go is implied by everybody else's times.
+    room is the schedule's room InterviewSlot, if it has one yet.
+    """
+    return tuple(
+        (interview_slot.interviewer, lib.to_epoch_minutes(interview_slot.start_time))
+        for interview_slot in interview_slots
+        if interview_slot.interviewer != BREAK
+    ) + (room.external_id if room is not None else None,)
+
+
+InterviewerGroup = collections.namedtuple('InterviewerGroup', ('num_required', 'interviewers'))
 
 
 def _prune_interviewers_for_capacity(interviewers, time_period):
-    week_start = time_period.start_time.date().isocalendar()[1]
-    week_end = time_period.end_time.date().isocalendar()[1]
-    assert week_start == week_end
+    week = capacity.iso_week(capacity.local_day(time_period.start_time))
+    assert week == capacity.iso_week(capacity.local_day(time_period.end_time))
+    weekly_loads = capacity.load_weekly_loads(
+        [interviewer.interviewer.id for interviewer in interviewers],
+        time_period.start_time,
+    )
     pruned_interviewers = {}
     for interviewer in interviewers:
-        interview_slots = interviewer.interviewer.interviewslot_set.all()
-        interviews = 0
-        for interview_slot in interview_slots:
-            week = interview_slot.start_time.date().isocalendar()[1]
-            if week == week_start:
-                interviews += 1
-
         if interviewer.interviewer.real_max_interviews is None:
             raise ValueError("Max interviews cannot be None, call an engineer")
-        number_of_alternate_events = load_number_of_alternate_events(
-            interviewer.interviewer.id,
-            week_start,
-            week_end,
-        )
-        if interviews < interviewer.interviewer.real_max_interviews:
-            pruned_interviewers[interviewer.interviewer.address] = (interviewer, interviews + number_of_alternate_events)
+        weekly_load = weekly_loads.get(interviewer.interviewer.id)
+        if weekly_load is None:
+            weekly_load = models.InterviewerWeeklyLoad(interviewer_id=interviewer.interviewer.id)
+        if weekly_load.interviews < interviewer.interviewer.real_max_interviews:
+            pruned_interviewers[interviewer.interviewer.address] = (interviewer, weekly_load.load)
 
     return pruned_interviewers
 
@@ -141,16 +168,45 @@ def calculate_schedules(
     time_period,
     possible_break=None,
     max_schedules=100,
-    interview_type=None
+    interview_type=None,
+    randomized_search=False,
+    top_k=None,
+    search_pool=None,
+    deadline_ms=None,
+    search_stats=None,
+    rooms=None,
+    preferences=None,
 ):
     """Exposed method for calculating new interviews.
 
+    By default candidate schedules come from search_possible_schedules, which
+    walks every valid order once. Pass randomized_search=True to sample random
+    orders instead, the way we used to.
+
+    With top_k, only the top_k highest priority schedules are kept, and the
+    search skips any partial order that couldn't make it into them.
+
+    With a SearchPool, passed as search_pool or started with
+    start_search_pool, the (non random) search is split across its worker
+    processes.
+
+    With deadline_ms, the search stops once that many milliseconds have gone
+    by and returns the best schedules found so far. Pass a SearchStats as
+    search_stats to find out whether that happened and how much was explored.
+
+    rooms and preferences may be passed in already fetched, see
+    fetch_calendars_for_scheduling; otherwise they're fetched here.
+
     Returns:
       List of <Interview>s
     """
-    num_attempts = 0
-    created_interviews = []
-    rooms = get_all_rooms(time_period)
+    start = time.time()
+    deadline = start + deadline_ms / 1000.0 if deadline_ms is not None else None
+    if search_stats is None:
+        search_stats = SearchStats()
+    if search_pool is None:
+        search_pool = _search_pool
+
     interviewers = list(itertools.chain.from_iterable(
         interviewer_group.interviewers for interviewer_group in interviewer_groups
     ))
@@ -160,54 +216,348 @@ def calculate_schedules(
         raise NoInterviewersAvailableError
     interviewers = zip(*interviewer_to_num_interviews_map.values())[0]
     interviewer_groups = _prune_overcapacity_interviewers_from_groups(interviewer_groups, interviewers)
-    preferences = get_preferences(interviewers, time_period)
-
-    for possible_schedule in possible_schedules(
-        interviewer_groups,
-        time_period,
-        possible_break,
-        max_schedules
-    ):
+    rooms, preferences = _fetch_rooms_and_preferences(interviewers, time_period, rooms, preferences)
+    availability = build_availability_matrix(time_period, interviewers, rooms, preferences)
+
+    search_problem = SearchProblem(
+        position_candidates=_position_candidates(interviewer_groups),
+        time_period=time_period,
+        possible_break=possible_break,
+        availability=availability,
+        rooms=_search_rooms(rooms),
+        # The calendars that go with the load counts aren't needed to score
+        interviewer_to_num_interviews_map=dict(
+            (address, (None, num_interviews))
+            for address, (_, num_interviews) in interviewer_to_num_interviews_map.iteritems()
+        ),
+        interview_type=interview_type,
+        max_schedules=max_schedules,
+        top_k=top_k,
+    )
 
-        interview = create_interview(
-            possible_schedule,
-            interviewers,
-            rooms,
-            preferences,
-            interviewer_to_num_interviews_map,
-            interview_type=interview_type
+    if randomized_search:
+        collector = _ScheduleCollector(search_problem, deadline)
+        collector.collect(possible_schedules(
+            interviewer_groups,
+            time_period,
+            possible_break,
+            max_schedules,
+            availability,
+        ))
+        created_interviews = collector.interviews
+        search_stats.merge(collector.stats)
+    elif search_pool is not None:
+        created_interviews = search_pool.search(search_problem, deadline, search_stats)
+    else:
+        created_interviews, stats = _search_partition(search_problem, deadline=deadline)
+        search_stats.merge(stats)
+    search_stats.elapsed_ms = int((time.time() - start) * 1000)
+
+    return sorted(created_interviews, key=lambda x: (x.start_time, x.priority))
+
+
+# Everything a search needs once calendars are loaded. It only holds plain
+# data (free time is in the AvailabilityMatrix's IntervalSets and bitmasks),
+# so it pickles small for worker processes.
+SearchProblem = collections.namedtuple('SearchProblem', (
+    'position_candidates',
+    'time_period',
+    'possible_break',
+    'availability',
+    'rooms',
+    'interviewer_to_num_interviews_map',
+    'interview_type',
+    'max_schedules',
+    'top_k',
+))
+
+
+# What create_interview needs to know about a room besides its free time
+SearchRoom = collections.namedtuple('SearchRoom', ('address', 'display_name', 'external_id', 'is_suitable_for_onsite'))
+
+
+def _search_rooms(room_calendars):
+    if room_calendars is None:
+        return None
+    return sorted(
+        SearchRoom(
+            address=room_calendar.interviewer.address,
+            display_name=room_calendar.interviewer.display_name,
+            external_id=room_calendar.interviewer.external_id,
+            is_suitable_for_onsite=room_calendar.interviewer.is_suitable_for_onsite,
         )
+        for room_calendar in room_calendars
+    )
 
-        # Add the schedule if it meets our validity heuristics
-        if (
-            interview is not None
-            and interview not in created_interviews
-        ):
-            created_interviews.append(interview)
 
-        num_attempts += 1
-        if num_attempts > 100000 or len(created_interviews) > max_schedules:
-            print "exiting %s %s" % (num_attempts, len(created_interviews))
-            break
+class SearchStats(object):
+    """How a calculate_schedules search went."""
 
-    return sorted(created_interviews, key=lambda x: (x.room.start_time, x.priority))
+    DEADLINE = 'deadline'
+    MAX_ATTEMPTS = 'max_attempts'
+    MAX_SCHEDULES = 'max_schedules'
 
-def get_all_rooms(time_period):
-    all_rooms = models.Room.objects.all()
-    return calendar_client.get_calendars(all_rooms, time_period).interview_calendars
+    def __init__(self):
+        self.num_explored = 0
+        self.stopped_by = None
+        self.elapsed_ms = 0
 
-def get_preferences(interviewers, time_period):
-    preferences = calendar_client.get_calendars(
-        [
-            models.InterviewerStruct(
-                external_id=interviewer.interviewer.preferences_address,
-                address=interviewer.interviewer.address
+    @property
+    def completed(self):
+        """Whether the search ran out of schedules to look at, rather than being cut off."""
+        return self.stopped_by is None
+
+    def merge(self, other):
+        self.num_explored += other.num_explored
+        self.stopped_by = self.stopped_by or other.stopped_by
+
+    def to_dict(self):
+        return {
+            'completed': self.completed,
+            'stopped_by': self.stopped_by,
+            'num_explored': self.num_explored,
+            'elapsed_ms': self.elapsed_ms,
+        }
+
+
+class _ScheduleCollector(object):
+    """Scores candidate schedules and keeps the ones calculate_schedules returns."""
+
+    def __init__(self, search_problem, deadline=None):
+        self._search_problem = search_problem
+        self._deadline = deadline
+        self.stats = SearchStats()
+        self.num_attempts = 0
+        self._created_interviews = []
+        # Min-heap of (priority, tie breaker, interview) holding the best top_k
+        self._best_interviews = []
+        self._seen_fingerprints = set()
+
+        self.priority_bound = None
+        if search_problem.top_k is not None:
+            self.priority_bound = _PriorityBound(
+                search_problem.availability,
+                search_problem.rooms,
+                search_problem.interviewer_to_num_interviews_map,
+                search_problem.interview_type,
+                floor=self._priority_floor,
             )
-            for interviewer in interviewers
-        ],
-        time_period,
+
+    def out_of_time(self):
+        if self._deadline is not None and time.time() >= self._deadline:
+            self.stats.stopped_by = SearchStats.DEADLINE
+            return True
+        return False
+
+    def _priority_floor(self):
+        if len(self._best_interviews) >= self._search_problem.top_k:
+            return self._best_interviews[0][0]
+        return None
+
+    @property
+    def interviews(self):
+        if self._search_problem.top_k is not None:
+            return [interview for _, _, interview in self._best_interviews]
+        return list(self._created_interviews)
+
+    def collect(self, schedule_generator):
+        search_problem = self._search_problem
+        for possible_schedule in schedule_generator:
+
+            # Random orders repeat a lot, don't bother scoring one we've seen.
+            # No room yet, but create_interview picks it from the times alone.
+            fingerprint = schedule_fingerprint(possible_schedule)
+            if fingerprint in self._seen_fingerprints:
+                interview = None
+            else:
+                self._seen_fingerprints.add(fingerprint)
+                interview = create_interview(
+                    possible_schedule,
+                    search_problem.availability,
+                    search_problem.rooms,
+                    search_problem.interviewer_to_num_interviews_map,
+                    interview_type=search_problem.interview_type
+                )
+
+            # Add the schedule if it meets our validity heuristics
+            if interview is not None and search_problem.top_k is not None:
+                heapq.heappush(self._best_interviews, (interview.priority, self.num_attempts, interview))
+                if len(self._best_interviews) > search_problem.top_k:
+                    heapq.heappop(self._best_interviews)
+            elif interview is not None:
+                self._created_interviews.append(interview)
+
+            self.num_attempts += 1
+            self.stats.num_explored = self.num_attempts
+            if self.num_attempts > 100000:
+                self.stats.stopped_by = SearchStats.MAX_ATTEMPTS
+            elif len(self._created_interviews) > search_problem.max_schedules:
+                self.stats.stopped_by = SearchStats.MAX_SCHEDULES
+            elif not self.out_of_time():
+                continue
+            print "exiting %s %s" % (self.num_attempts, len(self._created_interviews) or len(self._best_interviews))
+            break
+
+
+def _search_partition(search_problem, partition=0, num_partitions=1, deadline=None):
+    """Run the backtracking search over every num_partitions'th start, beginning at partition.
+
+    Returns the interviews kept and the SearchStats for the run.
+    """
+    collector = _ScheduleCollector(search_problem, deadline)
+    collector.collect(_search_positions(
+        search_problem.position_candidates,
+        search_problem.time_period,
+        search_problem.possible_break,
+        search_problem.availability,
+        priority_bound=collector.priority_bound,
+        partition=(partition, num_partitions),
+        out_of_time=collector.out_of_time,
+    ))
+    return collector.interviews, collector.stats
+
+
+def _search_worker_partition(search_problem_and_partition):
+    search_problem, partition, num_partitions, deadline = search_problem_and_partition
+    return _search_partition(search_problem, partition, num_partitions, deadline)
+
+
+class SearchPool(object):
+    """Worker processes calculate_schedules can split its search across.
+
+    Experimental: it has only been timed on a single core, where it's slower
+    than searching serially (scripts/benchmark_parallel_search.py).
+
+    Fork it once, before the process opens database connections or starts
+    threads, and reuse it; start_search_pool does that for the web server.
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self._pool = multiprocessing.Pool(processes)
+
+    def search(self, search_problem, deadline=None, search_stats=None):
+        """Split the search by start time across the pool and merge what comes back.
+
+        Starts are dealt out round robin, so every worker gets a mix of early
+        and late ones. Each worker keeps its own top_k (or max_schedules),
+        which is all the merged result can need from it.
+        """
+        results = self._pool.map(
+            _search_worker_partition,
+            [(search_problem, partition, self.processes, deadline) for partition in xrange(self.processes)],
+        )
+
+        partitions = []
+        for interviews, stats in results:
+            partitions.append(interviews)
+            if search_stats is not None:
+                search_stats.merge(stats)
+        return _merge_partitions(partitions, search_problem)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+
+_search_pool = None
+
+
+def start_search_pool(processes=SEARCH_PROCESSES):
+    """Start the SearchPool calculate_schedules uses by default, if processes > 1."""
+    global _search_pool
+    if _search_pool is None and processes is not None and processes > 1:
+        _search_pool = SearchPool(processes)
+    return _search_pool
+
+
+def _merge_partitions(partitions, search_problem):
+    interviews_by_fingerprint = {}
+    for interviews in partitions:
+        for interview in interviews:
+            interviews_by_fingerprint.setdefault(interview.fingerprint, interview)
+    interviews = interviews_by_fingerprint.values()
+
+    if search_problem.top_k is not None:
+        interviews.sort(key=lambda x: (-x.priority, x.start_time, x.fingerprint))
+        return interviews[:search_problem.top_k]
+
+    interviews.sort(key=lambda x: (x.start_time, x.fingerprint))
+    return interviews[:search_problem.max_schedules + 1]
+
+
+def _fetch_rooms_and_preferences(interviewers, time_period, rooms=None, preferences=None):
+    """Fetch whichever of rooms and preferences weren't passed in, side by side."""
+    async_client = AsyncClient(calendar_client)
+    pending_rooms = pending_preferences = None
+    if rooms is None:
+        pending_rooms = async_client.get_calendars(models.Room.objects.all(), time_period)
+    if preferences is None:
+        pending_preferences = async_client.get_calendars(
+            preference_calendars([interviewer.interviewer for interviewer in interviewers]),
+            time_period,
+        )
+    if pending_rooms is not None:
+        rooms = pending_rooms.get().interview_calendars
+    if pending_preferences is not None:
+        preferences = pending_preferences.get()
+    return rooms, preferences
+
+
+def preference_calendars(interviewers):
+    return [
+        models.InterviewerStruct(
+            external_id=interviewer.preferences_address,
+            address=interviewer.address
+        )
+        for interviewer in interviewers
+        if interviewer.preferences_address
+    ]
+
+
+ROOMS = 'rooms'
+PREFERENCES = 'preferences'
+
+
+def fetch_calendars_for_scheduling(interviewer_groups, time_period):
+    """Fetch every calendar calculate_schedules needs with one CalendarQueryPlan.
+
+    interviewer_groups hold Interviewer models. Returns the groups with
+    InterviewCalendars in their place, the room calendars and the
+    preference CalendarResponse, ready to hand to calculate_schedules.
+    """
+    plan = CalendarQueryPlan(time_period)
+    for index, interviewer_group in enumerate(interviewer_groups):
+        plan.add(index, interviewer_group.interviewers)
+    plan.add(ROOMS, models.Room.objects.all())
+    plan.add(PREFERENCES, preference_calendars(set(itertools.chain.from_iterable(
+        interviewer_group.interviewers for interviewer_group in interviewer_groups
+    ))))
+    planned_calendars = plan.execute(calendar_client)
+
+    interviewer_groups_with_calendars = [
+        InterviewerGroup(
+            num_required=interviewer_group.num_required,
+            interviewers=planned_calendars.response(index).interview_calendars,
+        )
+        for index, interviewer_group in enumerate(interviewer_groups)
+    ]
+    return (
+        interviewer_groups_with_calendars,
+        planned_calendars.response(ROOMS).interview_calendars,
+        planned_calendars.response(PREFERENCES),
     )
-    return preferences
+
+
+def build_availability_matrix(time_period, interviewers, rooms, preferences):
+    availability = AvailabilityMatrix(time_period, SCAN_RESOLUTION)
+    for interviewer in interviewers:
+        availability.add_calendar((INTERVIEWER_ROW, interviewer.interviewer.address), interviewer)
+    for room in rooms or []:
+        availability.add_calendar((ROOM_ROW, room.interviewer.address), room)
+    for preference in preferences.interview_calendars:
+        availability.add_calendar((PREFERENCE_ROW, preference.interviewer.address), preference)
+    return availability
 
 
 def has_same_interviewer_twice(possible_order):
@@ -226,7 +576,7 @@ def generate_possible_orders_forever(interviewer_groups):
         yield possible_order
 
 
-def possible_schedules(interviewer_groups, time_period, possible_break, max_schedules):
+def possible_schedules(interviewer_groups, time_period, possible_break, max_schedules, availability):
     """A generator to generate a bunch of valid orders of interviewers whose times work.
 
     Does not take into account rooms, time padding, or previously generated interviews.
@@ -245,14 +595,14 @@ def possible_schedules(interviewer_groups, time_period, possible_break, max_sche
             for i in xrange(2):
                 order_with_break = list(possible_order)
                 order_with_break.insert(i, break_interview_slot)
-                validated_order = try_order_with_anchor(order_with_break, anchor_index=i)
+                validated_order = try_order_with_anchor(order_with_break, i, availability)
                 if validated_order is not None and _validate_interview_times(validated_order, time_period):
                     yield validated_order
 
         else:
             address_of_anchor = possible_order[0].interviewer.address
             name_of_anchor = possible_order[0].interviewer.display_name
-            for possible_slot in possible_interview_chunks(possible_order[0].free_times):
+            for possible_slot in possible_interview_chunks(availability, address_of_anchor):
                 possible_order[0] = InterviewSlot(
                     interviewer=address_of_anchor,
                     start_time=possible_slot.start_time,
@@ -260,7 +610,7 @@ def possible_schedules(interviewer_groups, time_period, possible_break, max_sche
                     interviewer_name=name_of_anchor
                 )
 
-                validated_order = try_order_with_anchor(possible_order, anchor_index=0)
+                validated_order = try_order_with_anchor(possible_order, 0, availability)
                 if validated_order is not None and _validate_interview_times(validated_order, time_period):
                     yield validated_order
 
@@ -273,7 +623,221 @@ def _validate_interview_times(validated_order, time_period):
     return True
 
 
-def try_order_with_anchor(possible_order, anchor_index):
+def search_possible_schedules(interviewer_groups, time_period, possible_break, availability, priority_bound=None):
+    """Generate every valid schedule exactly once, round robin over start times.
+
+    Each candidate start fixes the time every position in the order has to be
+    interviewing, so we fill positions one by one with a backtracking search,
+    only considering interviewers who are free at that position's time and
+    haven't been used earlier in the order.
+
+    With a _PriorityBound, starts are taken in order, candidates are tried
+    best score first and any branch that can't beat priority_bound.floor()
+    is cut off.
+    """
+    return _search_positions(
+        _position_candidates(interviewer_groups),
+        time_period,
+        possible_break,
+        availability,
+        priority_bound=priority_bound,
+    )
+
+
+def _position_candidates(interviewer_groups):
+    """(address, display name) of who could fill each position of an order."""
+    return [
+        [
+            (interviewer.interviewer.address, interviewer.interviewer.display_name)
+            for interviewer in interviewer_group.interviewers
+        ]
+        for interviewer_group in interviewer_groups
+        for _ in xrange(interviewer_group.num_required)
+    ]
+
+
+def _search_positions(
+    position_candidates,
+    time_period,
+    possible_break,
+    availability,
+    priority_bound=None,
+    partition=(0, 1),
+    out_of_time=None,
+):
+    if not position_candidates:
+        return
+
+    # Without a break the first interviewer anchors the schedule, so hold
+    # them to the same chunks possible_schedules would offer.
+    anchor_chunk_starts = dict(
+        (address, set(chunk.start_time for chunk in possible_interview_chunks(availability, address)))
+        for address, _ in position_candidates[0]
+    )
+
+    partition_index, num_partitions = partition
+    frame_fills = (
+        _fill_frame(frame, position_candidates, availability, anchor_chunk_starts, priority_bound, out_of_time)
+        for frame_index, frame in enumerate(_schedule_frames(position_candidates, possible_break, anchor_chunk_starts))
+        if frame_index % num_partitions == partition_index
+    )
+    if priority_bound is None:
+        # Without top_k the caller stops at max_schedules, so take one
+        # schedule from each start in turn rather than filling up on the
+        # earliest ones.
+        validated_orders = _round_robin(list(frame_fills))
+    else:
+        validated_orders = itertools.chain.from_iterable(frame_fills)
+
+    for validated_order in validated_orders:
+        if out_of_time is not None and out_of_time():
+            return
+        if _validate_interview_times(validated_order, time_period):
+            yield validated_order
+
+
+def _round_robin(iterables):
+    """Yield the first item of each iterable, then the second of each, and so on."""
+    iterators = collections.deque(iter(iterable) for iterable in iterables)
+    while iterators:
+        iterator = iterators.popleft()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            continue
+        iterators.append(iterator)
+        yield item
+
+
+def _schedule_frames(position_candidates, possible_break, anchor_chunk_starts):
+    """Yield the slot times for a whole schedule, one list per possible start.
+
+    An entry is a TimePeriod for an interviewer position, or the break's
+    InterviewSlot. Mirrors the anchors possible_schedules tries.
+    """
+    num_positions = len(position_candidates)
+    interview_length = timedelta(minutes=MINUTES_OF_INTERVIEW)
+
+    if possible_break is not None:
+        # only try breaks in the first two interview slots
+        for break_index in xrange(min(2, num_positions + 1)):
+            frame = []
+            for position in xrange(num_positions):
+                if position < break_index:
+                    frame.append(lib.time_period_of_length_after_time(
+                        possible_break.start_time,
+                        MINUTES_OF_INTERVIEW,
+                        position - break_index,
+                    ))
+                else:
+                    frame.append(lib.time_period_of_length_after_time(
+                        possible_break.end_time,
+                        MINUTES_OF_INTERVIEW,
+                        position - break_index,
+                    ))
+            frame.insert(break_index, InterviewSlot(
+                interviewer=BREAK,
+                start_time=possible_break.start_time,
+                end_time=possible_break.end_time,
+            ))
+            yield frame
+        return
+
+    for anchor_start in sorted(set().union(*anchor_chunk_starts.values())):
+        yield [
+            lib.TimePeriod(
+                anchor_start + position * interview_length,
+                anchor_start + (position + 1) * interview_length,
+            )
+            for position in xrange(num_positions)
+        ]
+
+
+def _fill_frame(frame, position_candidates, availability, anchor_chunk_starts, priority_bound=None, out_of_time=None):
+    period_positions = [
+        (frame_index, period)
+        for frame_index, period in enumerate(frame)
+        if not isinstance(period, InterviewSlot)
+    ]
+
+    eligible = []
+    for position, (frame_index, period) in enumerate(period_positions):
+        if position == 0 and len(period_positions) == len(frame):
+            candidates = [
+                candidate for candidate in position_candidates[position]
+                if period.start_time in anchor_chunk_starts[candidate[0]]
+            ]
+        else:
+            candidates = [
+                candidate for candidate in position_candidates[position]
+                if availability.has_availability_during((INTERVIEWER_ROW, candidate[0]), period)
+            ]
+        if not candidates:
+            # Somebody can't be here at this time, no need to search
+            return
+        eligible.append(candidates)
+
+    if priority_bound is not None:
+        frame_score = priority_bound.frame_score(frame)
+        for position, (frame_index, period) in enumerate(period_positions):
+            eligible[position] = sorted(
+                (
+                    (priority_bound.slot_score(InterviewSlot(address, period.start_time, period.end_time)), (address, display_name))
+                    for address, display_name in eligible[position]
+                ),
+                reverse=True,
+            )
+        # best_remaining[i] is the most positions i onwards could add
+        best_remaining = [0] * (len(eligible) + 1)
+        for position in reversed(xrange(len(eligible))):
+            best_remaining[position] = best_remaining[position + 1] + eligible[position][0][0]
+    else:
+        frame_score = 0
+        eligible = [[(0, candidate) for candidate in candidates] for candidates in eligible]
+        best_remaining = None
+
+    chosen = []
+    used_addresses = set()
+
+    def backtrack(position, partial_score):
+        if out_of_time is not None and out_of_time():
+            return
+        if best_remaining is not None and not priority_bound.can_beat_floor(
+            frame_score + partial_score + best_remaining[position]
+        ):
+            return
+
+        if position == len(eligible):
+            validated_order = [
+                InterviewSlot(interviewer=BREAK, start_time=slot.start_time, end_time=slot.end_time)
+                if isinstance(slot, InterviewSlot) else None
+                for slot in frame
+            ]
+            for (frame_index, period), (address, display_name) in zip(period_positions, chosen):
+                validated_order[frame_index] = InterviewSlot(
+                    interviewer=address,
+                    start_time=period.start_time,
+                    end_time=period.end_time,
+                    interviewer_name=display_name,
+                )
+            yield validated_order
+            return
+
+        for slot_score, (address, display_name) in eligible[position]:
+            if address in used_addresses:
+                continue
+            used_addresses.add(address)
+            chosen.append((address, display_name))
+            for validated_order in backtrack(position + 1, partial_score + slot_score):
+                yield validated_order
+            chosen.pop()
+            used_addresses.remove(address)
+
+    for validated_order in backtrack(0, 0):
+        yield validated_order
+
+
+def try_order_with_anchor(possible_order, anchor_index, availability):
     """Given a random order with an anchor that his its times filled already, see if the rest of the times would make sense.
 
     Replace interviewers in the possible order with InterviewSlots, which are interviewers with associated times.
@@ -303,7 +867,7 @@ def try_order_with_anchor(possible_order, anchor_index):
                 position - anchor_index - 1
             )
 
-        if not interviewer.has_availability_during(required_slot):
+        if not availability.has_availability_during((INTERVIEWER_ROW, interviewer.interviewer.address), required_slot):
             # This order won't work, return it as invalid
             return None
         interview_slots.append(
@@ -318,57 +882,50 @@ def try_order_with_anchor(possible_order, anchor_index):
     return interview_slots
 
 
-def calculate_preference_scores(interview_slots, preference_calendars):
+def calculate_preference_scores(interview_slots, availability):
     return [
-        _preference_score(
-            interview_slot,
-            preference_calendars.get_interviewer(interview_slot.interviewer),
-        )
+        _preference_score(interview_slot, availability)
         for interview_slot in interview_slots
     ]
 
 
-def calculate_interviewer_schedule_padding_scores(possible_schedule, interviewer_calendars):
-    interviewer_by_address = dict(
-        (interviewer_calendar.interviewer.address, interviewer_calendar)
-        for interviewer_calendar in interviewer_calendars
-    )
+def calculate_interviewer_schedule_padding_scores(possible_schedule, availability):
+    return [
+        _padding_score(interviewer_slot, availability)
+        for interviewer_slot in possible_schedule
+    ]
 
-    padding_scores = []
-    for interviewer_slot in possible_schedule:
-        if interviewer_slot.interviewer == BREAK:
-            padding_scores.append(5)
-            continue
 
-        interviewer_calendar = interviewer_by_address[interviewer_slot.interviewer]
-        interviewer_time_with_padding = lib.TimePeriod(
-            interviewer_slot.start_time,
-            interviewer_slot.end_time + timedelta(minutes=IDEAL_PADDING_TIME)
-        )
+def _padding_score(interviewer_slot, availability):
+    if interviewer_slot.interviewer == BREAK:
+        return 5
 
-        if interviewer_calendar.has_availability_during(interviewer_time_with_padding):
-            padding_scores.append(5)
-        else:
-            padding_scores.append(0)
+    interviewer_time_with_padding = lib.TimePeriod(
+        interviewer_slot.start_time,
+        interviewer_slot.end_time + timedelta(minutes=IDEAL_PADDING_TIME)
+    )
 
-    return padding_scores
+    if availability.has_availability_during((INTERVIEWER_ROW, interviewer_slot.interviewer), interviewer_time_with_padding):
+        return 5
+    return 0
 
 
-def _preference_score(interviewer_slot, preferences_calendar):
+def _preference_score(interviewer_slot, availability):
     if interviewer_slot.interviewer == BREAK:
         return 10
 
-    if not preferences_calendar:
+    preference_key = (PREFERENCE_ROW, interviewer_slot.interviewer)
+    if preference_key not in availability:
         return 0
 
     assert interviewer_slot.start_time.date() == interviewer_slot.end_time.date()
 
-    if preferences_calendar.is_blocked_during(lib.TimePeriod(interviewer_slot.start_time, interviewer_slot.end_time)):
+    if availability.is_blocked_during(preference_key, lib.TimePeriod(interviewer_slot.start_time, interviewer_slot.end_time)):
         return 15
     return 0
 
 
-def create_interview(possible_schedule, interviewers, rooms, preferences, interviewer_to_num_interviews_map, interview_type=None):
+def create_interview(possible_schedule, availability, rooms, interviewer_to_num_interviews_map, interview_type=None):
     if possible_schedule is None:
         return None
 
@@ -380,32 +937,36 @@ def create_interview(possible_schedule, interviewers, rooms, preferences, interv
             possible_schedule[0].start_time,
             possible_schedule[-1].end_time
         )
-        possible_rooms = [room for room in rooms if room.has_availability_during(interview_duration)]
+        possible_rooms = [
+            room for room in rooms
+            if availability.has_availability_during((ROOM_ROW, room.address), interview_duration)
+        ]
         if possible_rooms:
-            # Choose a valid room randomly to avoid scheduling the same room always
-            # because of arbitrary db ordering
-            random_room = random.choice(possible_rooms)
+            room_score = max(_room_score(possible_room, interview_type) for possible_room in possible_rooms)
+            best_rooms = [
+                possible_room for possible_room in possible_rooms
+                if _room_score(possible_room, interview_type) == room_score
+            ]
+            # Rotate through equally good rooms by start time so we don't
+            # always book the same one, while every process picks alike
+            chosen_room = best_rooms[
+                lib.to_epoch_minutes(interview_duration.start_time) // SCAN_RESOLUTION % len(best_rooms)
+            ]
             room = InterviewSlot(
-                random_room.interviewer.display_name,
+                chosen_room.display_name,
                 interview_duration.start_time,
                 interview_duration.end_time,
-                external_id=random_room.interviewer.external_id,
+                external_id=chosen_room.external_id,
             )
-            room_score = 100
 
-            if interview_type == models.InterviewType.ON_SITE:
-                if not random_room.interviewer.is_suitable_for_onsite:
-                    room_score -= 20
-
-
-    preference_scores = calculate_preference_scores(possible_schedule, preferences)
+    preference_scores = calculate_preference_scores(possible_schedule, availability)
     preference_score = sum(preference_scores)
     for interview_slot, score in zip(possible_schedule, preference_scores):
         interview_slot.is_inside_time_preference = bool(score)
 
     interviewer_schedule_padding_scores = calculate_interviewer_schedule_padding_scores(
           possible_schedule,
-          interviewers,
+          availability,
     )
     interviewer_schedule_padding_score = sum(interviewer_schedule_padding_scores)
     for interview_slot, score in zip(possible_schedule, interviewer_schedule_padding_scores):
@@ -413,7 +974,7 @@ def create_interview(possible_schedule, interviewers, rooms, preferences, interv
 
     num_interviews_score = 50
     for interview_slot in possible_schedule:
-        num_interviews = interviewer_to_num_interviews_map.get(interview_slot.interviewer, (None, 0))[1]
+        num_interviews = _number_of_interviews(interview_slot.interviewer, interviewer_to_num_interviews_map)
         num_interviews_score -= (5 * num_interviews)
         interview_slot.number_of_interviews = num_interviews
 
@@ -432,30 +993,75 @@ def create_interview(possible_schedule, interviewers, rooms, preferences, interv
     )
 
 
-def possible_interview_chunks(free_times):
-    """Given a list of free times, yield them in 45 minute chunks."""
-    possible_free_times = filter_free_times_for_length(free_times)
+def _room_score(room, interview_type):
+    room_score = 100
+    if interview_type == models.InterviewType.ON_SITE:
+        if not room.is_suitable_for_onsite:
+            room_score -= 20
+    return room_score
+
 
-    for free_time in free_times:
-        potential_time = lib.TimePeriod(free_time.start_time, free_time.start_time + timedelta(minutes=MINUTES_OF_INTERVIEW))
-        while potential_time.end_time < free_time.end_time:
+def _number_of_interviews(interviewer_address, interviewer_to_num_interviews_map):
+    return interviewer_to_num_interviews_map.get(interviewer_address, (None, 0))[1]
 
-            # Only schedule interviews at minute multiples of the scan
-            # resolution. IE., if the resolution is 15 minutes, only consider
-            # interviews at 11:00, 11:15, 11:30
-            if potential_time.end_time.minute % SCAN_RESOLUTION == 0:
-                assert potential_time.start_time.minute % SCAN_RESOLUTION == 0
-                yield potential_time
 
-            potential_time = lib.TimePeriod(
-                    potential_time.start_time + timedelta(minutes=SCAN_RESOLUTION),
-                    potential_time.end_time + timedelta(minutes=SCAN_RESOLUTION),
-            )
+class _PriorityBound(object):
+    """Upper bounds on the priority create_interview can give a partial schedule.
+
+    create_interview's priority is a sum of a room score, a constant, and a
+    per-slot score (preference + padding - load) that only depends on who is
+    in the slot and when. So the search can score each slot as it places it,
+    and assume the best room and the best remaining interviewer everywhere
+    else. Anything whose bound can't beat the current floor gets pruned.
+    """
+
+    def __init__(self, availability, rooms, interviewer_to_num_interviews_map, interview_type, floor):
+        self._availability = availability
+        self._rooms = rooms
+        self._interviewer_to_num_interviews_map = interviewer_to_num_interviews_map
+        self._interview_type = interview_type
+        self.floor = floor
+
+    def frame_score(self, frame):
+        """Best case for everything in a frame except the interviewers."""
+        score = 50
+        for slot in frame:
+            if isinstance(slot, InterviewSlot):
+                score += self.slot_score(slot)
+
+        if self._rooms is not None:
+            interview_duration = lib.TimePeriod(frame[0].start_time, frame[-1].end_time)
+            room_scores = [
+                _room_score(room, self._interview_type)
+                for room in self._rooms
+                if self._availability.has_availability_during((ROOM_ROW, room.address), interview_duration)
+            ]
+            score += max(room_scores or [0])
+        return score
+
+    def slot_score(self, interview_slot):
+        return (
+            _preference_score(interview_slot, self._availability)
+            + _padding_score(interview_slot, self._availability)
+            - 5 * _number_of_interviews(interview_slot.interviewer, self._interviewer_to_num_interviews_map)
+        )
+
+    def can_beat_floor(self, bound):
+        floor = self.floor()
+        return floor is None or bound > floor
+
 
+def possible_interview_chunks(availability, interviewer_address):
+    """Given an interviewer's row in the availability matrix, yield their free 45 minute chunks.
 
-def filter_free_times_for_length(free_times):
-    """Given a list of free times, return chunks that are of the given length or greater."""
-    return [free_time for free_time in free_times if free_time.length_in_minutes >= MINUTES_OF_INTERVIEW]
+    Only schedule interviews at minute multiples of the scan resolution. IE.,
+    if the resolution is 15 minutes, only consider interviews at 11:00, 11:15,
+    11:30. The matrix is laid out on that grid already.
+    """
+    return availability.interview_chunks(
+        (INTERVIEWER_ROW, interviewer_address),
+        MINUTES_OF_INTERVIEW // SCAN_RESOLUTION,
+    )
 
 
 def persist_interview(interview_infos, interview_type, recruiter_id=None, google_event_id='', user_id=None):
@@ -483,6 +1089,22 @@ def persist_interview(interview_infos, interview_type, recruiter_id=None, google
             end_time=interview_info['end_time']
         )
 
+    interviewers = models.Interviewer.objects.in_bulk(
+        [interview_info['interviewer_id'] for interview_info in interview_infos]
+    )
+    for interview_info in interview_infos:
+        calendar_client.add_busy_time(
+            interviewers[interview_info['interviewer_id']].address,
+            lib.TimePeriod(interview_info['start_time'], interview_info['end_time']),
+        )
+    calendar_client.add_busy_time(
+        interview.room.address,
+        lib.TimePeriod(
+            min(interview_info['start_time'] for interview_info in interview_infos),
+            max(interview_info['end_time'] for interview_info in interview_infos),
+        ),
+    )
+
     return interview.id
 
 
@@ -577,11 +1199,73 @@ def create_calendar_body(time_name_pairs, recruiter, user):
     return body
 
 
+ReplacementInterviewer = collections.namedtuple('ReplacementInterviewer', ('interviewer', 'score', 'weekly_load'))
+
+
+def replacement_interviewers(interview_slot, interviewer_free_index):
+    """Who could take over interview_slot, best first.
+
+    Candidates share a requisition with the slot's interviewer, aren't
+    already on the interview, can do onsites if it's one, are under their
+    max interviews that week and are free for the whole slot. Each gets the
+    score create_interview gives a slot: time preference and padding, less
+    weekly load. Availability comes from interviewer_free_index, so this
+    never calls the calendar API.
+
+    Returns (ReplacementInterviewers, candidates with no cached availability).
+    """
+    interview = interview_slot.interview
+    candidates = models.Interviewer.objects.filter(
+        requisitions__in=interview_slot.interviewer.requisitions.all(),
+    ).exclude(
+        id__in=interview.interviewslot_set.values_list('interviewer_id', flat=True),
+    ).distinct()
+    if interview.type == models.InterviewType.ON_SITE:
+        candidates = [candidate for candidate in candidates if candidate.can_do_onsites]
+    candidates = list(candidates)
+
+    weekly_loads = capacity.load_weekly_loads([candidate.id for candidate in candidates], interview_slot.start_time)
+    start = lib.to_epoch_minutes(interview_slot.start_time)
+    end = lib.to_epoch_minutes(interview_slot.end_time)
+    day_index = interviewer_free_index.day_index(capacity.local_day(interview_slot.start_time))
+    free_mask = day_index.free_mask(start, end, end - start)
+    padded_mask = day_index.free_mask(start, end + IDEAL_PADDING_TIME, end - start + IDEAL_PADDING_TIME)
+    preferred_mask = day_index.preferred_mask(start, end)
+
+    replacements = []
+    unknown = []
+    for candidate in candidates:
+        weekly_load = weekly_loads.get(candidate.id)
+        if weekly_load is None:
+            weekly_load = models.InterviewerWeeklyLoad(interviewer_id=candidate.id)
+        if weekly_load.interviews >= candidate.real_max_interviews:
+            continue
+        bit = day_index.bit(candidate.id)
+        if bit is None or candidate.id in day_index.unknown:
+            unknown.append(candidate)
+            continue
+        if not free_mask >> bit & 1:
+            continue
+        score = (
+            (15 if preferred_mask >> bit & 1 else 0)
+            + (5 if padded_mask >> bit & 1 else 0)
+            - 5 * weekly_load.load
+        )
+        replacements.append(ReplacementInterviewer(candidate, score, weekly_load.load))
+
+    replacements.sort(key=lambda replacement: (-replacement.score, replacement.interviewer.display_name))
+    return replacements, unknown
+
+
 def change_interviewer(interview_slot_id, interviewer_id):
     slot = models.InterviewSlot.objects.get(id=interview_slot_id)
+    previous_interviewer = slot.interviewer
     slot.interviewer_id = interviewer_id
     google_event_id = slot.interview.google_event_id
     slot.save()
+    slot_period = lib.TimePeriod(slot.start_time, slot.end_time)
+    calendar_client.invalidate_calendar(previous_interviewer.address, slot_period)
+    calendar_client.add_busy_time(models.Interviewer.objects.get(id=interviewer_id).address, slot_period)
     if google_event_id:
         updated_description_list = []
         new_description = create_calendar_body(
@@ -593,18 +1277,39 @@ def change_interviewer(interview_slot_id, interviewer_id):
             slot.interview.recruiter,
             slot.interview.user,
         )
-        calendar_response = calendar_client.update_event(google_event_id, new_description)
+        calendar_response = calendar_client.update_event(
+            google_event_id,
+            new_description,
+            location=slot.interview.room.address,
+            time_period=lib.TimePeriod(slot.start_time, slot.end_time),
+        )
 
 
 
 def delete_interview(interview_id):
     interview = models.Interview.objects.get(id=interview_id)
+    slot_periods = []
     for slot in interview.interviewslot_set.all():
+        slot_periods.append(lib.TimePeriod(slot.start_time, slot.end_time))
+        # The interviewer may have other busy time overlapping the slot, so refetch rather than subtract
+        calendar_client.invalidate_calendar(slot.interviewer.address, slot_periods[-1])
         slot.delete()
     interview.delete()
+    interview_period = None
+    if slot_periods:
+        interview_period = lib.TimePeriod(
+            min(period.start_time for period in slot_periods),
+            max(period.end_time for period in slot_periods),
+        )
     google_event_id = interview.google_event_id
     if google_event_id:
-        calendar_response = calendar_client.delete_event(google_event_id)
+        calendar_response = calendar_client.delete_event(
+            google_event_id,
+            location=interview.room.address,
+            time_period=interview_period,
+        )
+    else:
+        calendar_client.invalidate_calendar(interview.room.address, interview_period)
 
 
 def get_all_recruiters():
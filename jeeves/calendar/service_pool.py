@@ -0,0 +1,84 @@
+import contextlib
+import threading
+import time
+
+from caltech import secret
+
+SERVICE_POOL_SIZE = getattr(secret, 'calendar_service_pool_size', 8)
+
+
+class ServicePool(object):
+    """A bounded pool of authorized calendar services.
+
+    Each service carries its own httplib2.Http, which can't be used by two
+    threads at once, so calls check one out for their duration. Services
+    are built by service_factory as demand grows, up to size, and reused
+    after that; the most recently returned one goes out first, so its
+    keep-alive connection is the likeliest to still be open. When every
+    service is checked out, callers wait.
+
+    Without a service_factory the pool is just the services it was given.
+    """
+
+    def __init__(self, service_factory=None, size=SERVICE_POOL_SIZE, services=()):
+        self.size = size
+        self._service_factory = service_factory
+        self._idle = list(services)
+        self._num_built = len(self._idle)
+        self._condition = threading.Condition()
+        self.checkouts = 0
+        self.builds = 0
+        self.reuses = 0
+        self.total_wait_ms = 0
+        self.max_wait_ms = 0
+
+    @contextlib.contextmanager
+    def checkout(self):
+        service = self._acquire()
+        try:
+            yield service
+        finally:
+            with self._condition:
+                self._idle.append(service)
+                self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return dict(
+                size=self.size,
+                built=self._num_built,
+                idle=len(self._idle),
+                checkouts=self.checkouts,
+                builds=self.builds,
+                reuses=self.reuses,
+                total_wait_ms=self.total_wait_ms,
+                max_wait_ms=self.max_wait_ms,
+            )
+
+    def _acquire(self):
+        start = time.time()
+        with self._condition:
+            while not self._idle and not self._can_build():
+                self._condition.wait()
+            wait_ms = (time.time() - start) * 1000
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            if self._idle:
+                self.reuses += 1
+                return self._idle.pop()
+            self._num_built += 1
+
+        try:
+            service = self._service_factory()
+        except Exception:
+            with self._condition:
+                self._num_built -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self.builds += 1
+        return service
+
+    def _can_build(self):
+        return self._service_factory is not None and self._num_built < self.size
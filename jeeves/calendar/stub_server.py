@@ -0,0 +1,350 @@
+"""A local stand-in for the bits of the Google Calendar API we use.
+
+StubCalendarServer answers freebusy queries and event inserts, patches and
+deletes over real HTTP, optionally after a fixed delay, so clients can be
+tested and benchmarked with real round trips. Event calls can also come in
+as one multipart batch, the way apiclient's BatchHttpRequest sends them.
+
+Each calendar's events can be listed, or just the ones changed since a sync
+token, and watched. Changes to a watched calendar queue up a notification
+in notifications, with the headers Google would send to the channel's
+address, for the test to deliver:
+
+    server = StubCalendarServer(latency_ms=50)
+    server.start()
+    service_client = ServiceClient(server.build_service(), service_factory=server.build_service)
+    ...
+    server.stop()
+"""
+import collections
+import itertools
+import json
+import re
+import threading
+import time
+import urllib
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+from email.feedparser import FeedParser
+from email.mime.multipart import MIMEMultipart
+from email.mime.nonmultipart import MIMENonMultipart
+
+import httplib2
+from apiclient.errors import HttpError
+from apiclient.http import BatchHttpRequest
+
+from . import lib
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubCalendarServer(object):
+
+    def __init__(self, latency_ms=0, port=0):
+        self.latency_ms = latency_ms
+        self.busyness = {}
+        self.events = {}
+        self.requests = []
+        self.channels = {}
+        self.notifications = []
+        self._event_calendars = {}
+        # Every event change in order; a sync token is a position in this list
+        self._changes = []
+        self._oldest_sync_token = 0
+        self._event_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._httpd = _ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%s' % self._httpd.server_address[1]
+
+    def register_busyness(self, calendar_id, time_period):
+        self.busyness.setdefault(calendar_id, []).append(dict(
+            start=lib.format_datetime_utc(time_period.start_time),
+            end=lib.format_datetime_utc(time_period.end_time),
+        ))
+
+    def add_event(self, calendar_id, time_period, **fields):
+        """Put an event on a calendar, as if someone else had."""
+        with self._lock:
+            return self._insert_event(calendar_id, dict(
+                fields,
+                start=dict(dateTime=lib.format_datetime_utc(time_period.start_time)),
+                end=dict(dateTime=lib.format_datetime_utc(time_period.end_time)),
+            ))
+
+    def remove_event(self, event_id):
+        with self._lock:
+            del self.events[event_id]
+            self._record_change(event_id)
+
+    def expire_sync_tokens(self):
+        """Make every sync token handed out so far fail with a 410, the way Google's eventually do."""
+        with self._lock:
+            self._oldest_sync_token = len(self._changes)
+
+    def take_notifications(self):
+        with self._lock:
+            notifications, self.notifications = self.notifications, []
+        return notifications
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def build_service(self):
+        return StubService(self.base_url)
+
+    def handle(self, method, path, body):
+        with self._lock:
+            self.requests.append((method, path))
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        return self._dispatch(method, path, body)
+
+    def handle_batch(self, content_type, raw_body):
+        """Answer a multipart/mixed batch in one round trip. Returns the response content type and body."""
+        with self._lock:
+            self.requests.append(('POST', '/batch'))
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+        parser = FeedParser()
+        parser.feed('content-type: %s\r\n\r\n' % content_type + raw_body)
+        response_message = MIMEMultipart('mixed')
+        # Like the request, the response's own headers go in the HTTP headers
+        setattr(response_message, '_write_headers', lambda self: None)
+        for part in parser.close().get_payload():
+            request_line, request = part.get_payload().split('\n', 1)
+            method, path, _ = request_line.split(' ', 2)
+            request_parser = FeedParser()
+            request_parser.feed(request)
+            request_body = request_parser.close().get_payload()
+            status, response = self._dispatch(method, path, json.loads(request_body) if request_body else None)
+
+            response_part = MIMENonMultipart('application', 'http')
+            response_part['Content-ID'] = '<response-%s' % part['Content-ID'][1:]
+            response_part.set_payload('HTTP/1.1 %s %s\r\nContent-Type: application/json\r\n\r\n%s' % (
+                status,
+                BaseHTTPRequestHandler.responses.get(status, ('',))[0],
+                json.dumps(response) if response is not None else '',
+            ))
+            response_message.attach(response_part)
+        # The boundary is only picked while serializing
+        payload = response_message.as_string()
+        return 'multipart/mixed; boundary="%s"' % response_message.get_boundary(), payload
+
+    def _dispatch(self, method, path, body):
+        path, _, query_string = path.partition('?')
+        query = dict(urlparse.parse_qsl(query_string))
+        if method == 'POST' and path == '/freeBusy':
+            with self._lock:
+                event_busy = collections.defaultdict(list)
+                for event_id, event in self.events.iteritems():
+                    if 'dateTime' in event.get('start', {}):
+                        event_busy[self._event_calendars[event_id]].append(
+                            dict(start=event['start']['dateTime'], end=event['end']['dateTime']),
+                        )
+                return 200, dict(calendars=dict(
+                    (item['id'], dict(busy=self.busyness.get(item['id'], []) + event_busy[item['id']]))
+                    for item in body['items']
+                ))
+
+        match = re.match(r'^/calendars/([^/]+)/events(?:/([^/]+))?$', path)
+        if match is None:
+            return 404, _error(404, 'not found')
+        calendar_id = urllib.unquote(match.group(1))
+        event_id = match.group(2)
+        with self._lock:
+            if method == 'GET' and event_id is None:
+                return self._list_events(calendar_id, query)
+            if method == 'POST' and event_id == 'watch':
+                return self._watch(calendar_id, body)
+            if method == 'POST' and event_id is None:
+                return 200, self._insert_event(calendar_id, body)
+            if event_id not in self.events:
+                return 404, _error(404, 'no such event')
+            if method == 'PATCH':
+                self.events[event_id].update(body)
+                self._record_change(event_id)
+                return 200, self.events[event_id]
+            if method == 'DELETE':
+                del self.events[event_id]
+                self._record_change(event_id)
+                return 204, None
+        return 405, _error(405, 'method not allowed')
+
+    def _insert_event(self, calendar_id, body):
+        event = dict(body, id=str(next(self._event_ids)))
+        self.events[event['id']] = event
+        self._event_calendars[event['id']] = calendar_id
+        self._record_change(event['id'])
+        return event
+
+    def _record_change(self, event_id):
+        calendar_id = self._event_calendars[event_id]
+        self._changes.append(event_id)
+        for channel in self.channels.get(calendar_id, []):
+            self.notifications.append(dict(
+                address=channel['address'],
+                channel_id=channel['id'],
+                resource_id=channel['resourceId'],
+                resource_state='exists',
+                token=channel.get('token'),
+            ))
+
+    def _list_events(self, calendar_id, query):
+        if 'syncToken' in query:
+            sync_token = int(query['syncToken'])
+            if sync_token < self._oldest_sync_token:
+                return 410, _error(410, 'sync token is no longer valid')
+            event_ids = list(collections.OrderedDict.fromkeys(self._changes[sync_token:]))
+        else:
+            event_ids = list(self.events)
+        events = [
+            self.events.get(event_id, dict(id=event_id, status='cancelled'))
+            for event_id in event_ids
+            if self._event_calendars[event_id] == calendar_id
+        ]
+
+        start = int(query.get('pageToken', 0))
+        end = start + int(query.get('maxResults', 250))
+        response = dict(items=events[start:end])
+        if end < len(events):
+            response['nextPageToken'] = str(end)
+        else:
+            response['nextSyncToken'] = str(len(self._changes))
+        return 200, response
+
+    def _watch(self, calendar_id, channel):
+        channel = dict(channel, resourceId='resource-%s' % calendar_id)
+        self.channels.setdefault(calendar_id, []).append(channel)
+        expiration_ms = int((time.time() + 7 * 24 * 60 * 60) * 1000)
+        return 200, dict(kind='api#channel', id=channel['id'], resourceId=channel['resourceId'], expiration=str(expiration_ms))
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def _respond(self):
+                length = int(self.headers.getheader('content-length') or 0)
+                raw_body = self.rfile.read(length) if length else ''
+                if self.command == 'POST' and self.path == '/batch':
+                    status = 200
+                    content_type, payload = server.handle_batch(self.headers.getheader('content-type'), raw_body)
+                else:
+                    status, response = server.handle(self.command, self.path, json.loads(raw_body) if raw_body else None)
+                    content_type, payload = 'application/json', json.dumps(response) if response is not None else ''
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def _error(status, message):
+    # Shaped like Google's errors, which apiclient's HttpError digs the message out of
+    return dict(error=dict(code=status, message=message))
+
+
+class StubService(object):
+    """The slice of the apiclient calendar service that ServiceClient calls, pointed at a StubCalendarServer.
+
+    Like the real service, each one holds its own httplib2 connection, and
+    its requests can be added to a BatchHttpRequest.
+    """
+
+    def __init__(self, base_url):
+        self._base_url = base_url
+        self._http = httplib2.Http()
+
+    def new_batch_http_request(self):
+        return BatchHttpRequest(batch_uri=self._base_url + '/batch')
+
+    def freebusy(self):
+        return _Resource(self, dict(
+            query=lambda body: ('POST', '/freeBusy', body),
+        ))
+
+    def events(self):
+        return _Resource(self, dict(
+            insert=lambda calendarId, body: ('POST', '/calendars/%s/events' % calendarId, body),
+            patch=lambda calendarId, eventId, body: ('PATCH', '/calendars/%s/events/%s' % (calendarId, eventId), body),
+            delete=lambda calendarId, eventId: ('DELETE', '/calendars/%s/events/%s' % (calendarId, eventId), None),
+            list=lambda calendarId, **query: ('GET', '/calendars/%s/events?%s' % (urllib.quote(calendarId), urllib.urlencode(
+                dict((name, value) for name, value in query.iteritems() if value is not None),
+            )), None),
+            watch=lambda calendarId, body: ('POST', '/calendars/%s/events/watch' % urllib.quote(calendarId), body),
+        ))
+
+    def request(self, method, path, body):
+        response, content = self._http.request(
+            self._base_url + path,
+            method=method,
+            body=json.dumps(body) if body is not None else None,
+            headers={'Content-Type': 'application/json'},
+        )
+        if response.status >= 400:
+            raise StubServiceError(response, content, uri=self._base_url + path)
+        return json.loads(content) if content else ''
+
+
+class StubServiceError(HttpError):
+    """What a failed StubService call raises; an HttpError, like the real service's."""
+
+
+class _Resource(object):
+
+    def __init__(self, service, methods):
+        self._service = service
+        self._methods = methods
+
+    def __getattr__(self, name):
+        if name not in self._methods:
+            raise AttributeError(name)
+
+        def method(**kwargs):
+            return _Request(self._service, *self._methods[name](**kwargs))
+        return method
+
+
+class _Request(object):
+    """Quacks enough like apiclient's HttpRequest for BatchHttpRequest to serialize it."""
+
+    resumable = None
+
+    def __init__(self, service, method, path, body):
+        self._service = service
+        self._path = path
+        self._body = body
+        self.method = method
+        self.uri = service._base_url + path
+        self.body = json.dumps(body) if body is not None else None
+        self.headers = {'content-type': 'application/json'}
+        self.http = service._http
+
+    def postproc(self, response, content):
+        return json.loads(content) if content else ''
+
+    def execute(self):
+        return self._service.request(self.method, self._path, self._body)
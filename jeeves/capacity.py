@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count
+
+import pytz
+
+from caltech import settings
+from jeeves import models
+
+
+def local_day(dt):
+    """The day dt falls on in our time zone."""
+    if dt.tzinfo is None:
+        return dt.date()
+    return dt.astimezone(pytz.timezone(settings.TIME_ZONE)).date()
+
+
+def iso_week(day):
+    iso_year, iso_week_number, _ = day.isocalendar()
+    return iso_year, iso_week_number
+
+
+def local_midnight(day):
+    return pytz.timezone(settings.TIME_ZONE).localize(datetime(day.year, day.month, day.day))
+
+
+def week_bounds(dt):
+    """Start of the Monday of dt's week and of the Monday after, as local datetimes."""
+    day = dt if type(dt) is date else local_day(dt)
+    monday = day - timedelta(days=day.weekday())
+    return local_midnight(monday), local_midnight(monday + timedelta(days=7))
+
+
+class CapacityLedger(object):
+    """Per-day alternate recruiting event counts for some interviewers.
+
+    Built by load_capacity_ledger from one aggregate query, so the tracker
+    can count for many interviewers without going back to the db.
+    """
+
+    def __init__(self, alternate_events_by_day):
+        # {(interviewer_id, day): count}
+        self._alternate_events_by_day = alternate_events_by_day
+
+    def alternate_events_by_weekday(self, interviewer_ids, start_date, end_date):
+        """({weekday: count}, total) of alternate events of interviewer_ids on days in [start_date, end_date)."""
+        interviewer_ids = set(interviewer_ids)
+        by_weekday = {}
+        total = 0
+        for (event_interviewer_id, day), count in self._alternate_events_by_day.iteritems():
+            if event_interviewer_id not in interviewer_ids or not start_date <= day < end_date:
+                continue
+            by_weekday[day.weekday()] = by_weekday.get(day.weekday(), 0) + count
+            total += count
+        return by_weekday, total
+
+
+def load_capacity_ledger(interviewer_ids, start_time, end_time):
+    """Load a CapacityLedger for interviewer_ids covering [start_time, end_time).
+
+    Dates are taken as local midnight.
+    """
+    if type(start_time) is date:
+        start_time = local_midnight(start_time)
+    if type(end_time) is date:
+        end_time = local_midnight(end_time)
+    # Counted per start time in the db; only the bucketing into local days,
+    # which the db can't do portably, is left to us.
+    alternate_events_by_day = defaultdict(int)
+    for row in models.AlternateRecruitingEvent.objects.filter(
+        interviewer_id__in=list(interviewer_ids),
+        time__gte=start_time,
+        time__lt=end_time,
+    ).values('interviewer_id', 'time').annotate(count=Count('id')).order_by():
+        alternate_events_by_day[(row['interviewer_id'], local_day(row['time']))] += row['count']
+
+    return CapacityLedger(dict(alternate_events_by_day))
+
+
+def load_weekly_loads(interviewer_ids, dt):
+    """{interviewer_id: InterviewerWeeklyLoad} for the week dt falls in.
+
+    Interviewers without a row have nothing booked that week.
+    """
+    iso_year, iso_week_number = iso_week(week_bounds(dt)[0].date())
+    return dict(
+        (weekly_load.interviewer_id, weekly_load)
+        for weekly_load in models.InterviewerWeeklyLoad.objects.filter(
+            interviewer_id__in=list(interviewer_ids),
+            iso_year=iso_year,
+            iso_week=iso_week_number,
+        )
+    )
+
+
+def refresh_weekly_loads(interviewer_times):
+    """Recount InterviewerWeeklyLoad rows from scratch for (interviewer_id, datetime) pairs."""
+    weeks = {}
+    for interviewer_id, dt in interviewer_times:
+        week_start, _ = week_bounds(dt)
+        weeks[(interviewer_id, week_start)] = True
+
+    for interviewer_id, week_start in weeks:
+        _refresh_weekly_load(interviewer_id, week_start)
+
+
+def _refresh_weekly_load(interviewer_id, week_start):
+    _, week_end = week_bounds(week_start)
+    iso_year, iso_week_number = iso_week(week_start.date())
+    interviews = models.InterviewSlot.objects.filter(
+        interviewer_id=interviewer_id,
+        start_time__gte=week_start,
+        start_time__lt=week_end,
+    ).count()
+    alternate_events = models.AlternateRecruitingEvent.objects.filter(
+        interviewer_id=interviewer_id,
+        time__gte=week_start,
+        time__lt=week_end,
+    ).count()
+
+    weekly_load, _ = models.InterviewerWeeklyLoad.objects.get_or_create(
+        interviewer_id=interviewer_id,
+        iso_year=iso_year,
+        iso_week=iso_week_number,
+    )
+    weekly_load.interviews = interviews
+    weekly_load.alternate_events = alternate_events
+    weekly_load.save()
+
+
+@transaction.commit_on_success
+def rebuild_weekly_loads():
+    """Throw away every InterviewerWeeklyLoad row and recount from the raw tables."""
+    counts = defaultdict(lambda: [0, 0])
+    for interviewer_id, start_time in models.InterviewSlot.objects.values_list('interviewer_id', 'start_time'):
+        counts[(interviewer_id,) + iso_week(local_day(start_time))][0] += 1
+    for interviewer_id, event_time in models.AlternateRecruitingEvent.objects.values_list('interviewer_id', 'time'):
+        counts[(interviewer_id,) + iso_week(local_day(event_time))][1] += 1
+
+    models.InterviewerWeeklyLoad.objects.all().delete()
+    models.InterviewerWeeklyLoad.objects.bulk_create([
+        models.InterviewerWeeklyLoad(
+            interviewer_id=interviewer_id,
+            iso_year=iso_year,
+            iso_week=iso_week_number,
+            interviews=interviews,
+            alternate_events=alternate_events,
+        )
+        for (interviewer_id, iso_year, iso_week_number), (interviews, alternate_events) in counts.iteritems()
+    ])
+    return len(counts)
@@ -0,0 +1,22 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from jeeves.calendar import prewarm
+from jeeves.calendar.client import calendar_client
+
+
+class Command(BaseCommand):
+    help = 'Fetch every interviewer, room and preferences calendar for the next business days into the freebusy store.'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--days',
+            type='int',
+            default=prewarm.PREWARM_BUSINESS_DAYS,
+            help='Business days to fetch, starting today',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        report = prewarm.prewarm(calendar_client, options['days'])
+        self.stdout.write('Prewarmed %s\n' % prewarm.format_report(report))
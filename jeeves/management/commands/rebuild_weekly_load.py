@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from jeeves import capacity
+
+
+class Command(BaseCommand):
+    help = 'Recount the interviewer weekly load table from interview slots and alternate recruiting events.'
+
+    def handle(self, *args, **options):
+        num_weeks = capacity.rebuild_weekly_loads()
+        self.stdout.write('Rebuilt %s interviewer weeks\n' % num_weeks)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from jeeves.calendar import mirror
+from jeeves.calendar.client import calendar_client
+
+
+class Command(BaseCommand):
+    help = 'Sync every scheduling calendar into the calendar mirror and renew expiring notification channels.'
+
+    def handle(self, *args, **options):
+        if not mirror.CALENDAR_MIRROR:
+            raise CommandError('Set calendar_mirror = True in secret.py first')
+        if calendar_client.mirror is None:
+            raise CommandError("The mock and replay calendar clients have no events to mirror")
+        calendar_ids = mirror.scheduling_calendar_ids()
+        failed = calendar_client.mirror.refresh(calendar_ids)
+        self.stdout.write('Synced %s calendars\n' % (len(calendar_ids) - len(failed)))
+        if failed:
+            self.stdout.write("Couldn't sync, so these stay on freebusy: %s\n" % ', '.join(failed))
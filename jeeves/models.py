@@ -3,6 +3,10 @@
 from collections import namedtuple
 
 from django.db import models
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
 from django.contrib import admin
 from django.contrib.auth.models import User
 
@@ -154,6 +158,48 @@ class AlternateRecruitingEvent(models.Model):
         return self.get_type_display()
 
 
+@receiver(pre_save, sender=AlternateRecruitingEvent)
+def _remember_previous_alternate_event_week(sender, instance, **kwargs):
+    instance._previous_interviewer_time = None
+    if instance.pk is not None:
+        previous = sender.objects.filter(pk=instance.pk).values_list('interviewer_id', 'time')[:1]
+        if previous:
+            instance._previous_interviewer_time = previous[0]
+
+
+@receiver(post_save, sender=AlternateRecruitingEvent)
+@receiver(post_delete, sender=AlternateRecruitingEvent)
+def _refresh_weekly_load_for_alternate_event(sender, instance, **kwargs):
+    from jeeves import capacity
+    interviewer_times = [(instance.interviewer_id, instance.time)]
+    if getattr(instance, '_previous_interviewer_time', None):
+        interviewer_times.append(instance._previous_interviewer_time)
+    capacity.refresh_weekly_loads(interviewer_times)
+
+
+class InterviewerWeeklyLoad(models.Model):
+    """Interviews and alternate recruiting events per interviewer per ISO week.
+
+    Kept up to date by the InterviewSlot and AlternateRecruitingEvent signal
+    receivers; rebuild with ./manage.py rebuild_weekly_load.
+    """
+    interviewer = models.ForeignKey(Interviewer)
+    iso_year = models.IntegerField()
+    iso_week = models.IntegerField()
+    interviews = models.IntegerField(default=0)
+    alternate_events = models.IntegerField(default=0)
+
+    @property
+    def load(self):
+        return self.interviews + self.alternate_events
+
+    def __unicode__(self):
+        return "%s: %s-W%02d" % (self.interviewer.display_name, self.iso_year, self.iso_week)
+
+    class Meta:
+        unique_together = (('interviewer', 'iso_year', 'iso_week'),)
+
+
 class Room(models.Model):
     name = models.CharField(max_length=256)
     domain = models.CharField(max_length=256)
@@ -223,6 +269,25 @@ class InterviewSlot(models.Model):
     end_time = models.DateTimeField()
 
 
+@receiver(pre_save, sender=InterviewSlot)
+def _remember_previous_interview_slot_week(sender, instance, **kwargs):
+    instance._previous_interviewer_time = None
+    if instance.pk is not None:
+        previous = sender.objects.filter(pk=instance.pk).values_list('interviewer_id', 'start_time')[:1]
+        if previous:
+            instance._previous_interviewer_time = previous[0]
+
+
+@receiver(post_save, sender=InterviewSlot)
+@receiver(post_delete, sender=InterviewSlot)
+def _refresh_weekly_load_for_interview_slot(sender, instance, **kwargs):
+    from jeeves import capacity
+    interviewer_times = [(instance.interviewer_id, instance.start_time)]
+    if getattr(instance, '_previous_interviewer_time', None):
+        interviewer_times.append(instance._previous_interviewer_time)
+    capacity.refresh_weekly_loads(interviewer_times)
+
+
 DAYS_OF_WEEK = (
     ('0', 'Monday'),
     ('1', 'Tuesday'),
@@ -276,6 +341,31 @@ class Recruiter(models.Model):
         ordering = ('display_name',)
 
 
+class MirroredCalendar(models.Model):
+    """A calendar whose events we keep a local copy of; see jeeves.calendar.mirror."""
+    calendar_id = models.CharField(max_length=256, unique=True)
+    sync_token = models.CharField(max_length=256, null=True, blank=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
+    sync_error = models.CharField(max_length=256, blank=True, default='')
+    channel_id = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    resource_id = models.CharField(max_length=256, null=True, blank=True)
+    channel_expiration = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return self.calendar_id
+
+
+class MirroredEvent(models.Model):
+    """The time one event blocks on a MirroredCalendar, in epoch minutes."""
+    calendar = models.ForeignKey(MirroredCalendar)
+    event_id = models.CharField(max_length=256)
+    start_minute = models.IntegerField()
+    end_minute = models.IntegerField()
+
+    class Meta:
+        unique_together = (('calendar', 'event_id'),)
+
+
 class RequisitionInline(admin.TabularInline):
     model = Requisition.interviewers.through
 
@@ -310,7 +400,9 @@ admin.site.register(Interview)
 admin.site.register(Requisition, RequisitionAdmin)
 admin.site.register(InterviewTemplate, InterviewTemplateAdmin)
 admin.site.register(AlternateRecruitingEvent)
+admin.site.register(InterviewerWeeklyLoad)
 admin.site.register(Preference)
 admin.site.register(Room)
 admin.site.register(InterviewSlot)
 admin.site.register(Recruiter)
+admin.site.register(MirroredCalendar)
@@ -2,18 +2,41 @@
 # -*- coding: utf-8 -*-
 from datetime import timedelta
 from datetime import datetime
-
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 from django.test.client import Client
+from django.utils import timezone
+import httplib2
 import mock
 import pytz
+import simplejson
 
+from caltech import secret
 from caltech import settings
+from jeeves import capacity
 from jeeves import models
 from jeeves import views
 from jeeves.calendar import schedule_calculator
 from jeeves.calendar import lib
+from jeeves.calendar import mirror
+from jeeves.calendar import prewarm
+from jeeves.calendar import schedule
+from jeeves.calendar import stub_server
+from jeeves.calendar import async_client
+from jeeves.calendar import cache
 from jeeves.calendar import client
+from jeeves.calendar import service_pool
+from jeeves.calendar import availability
+from jeeves.calendar import free_index
+from jeeves.calendar.availability import AvailabilityMatrix
 
 DATEPICKER_FORMAT = "%Y-%m-%d %H:%M:%S"
 
@@ -29,6 +52,54 @@ class BaseTestCase(TestCase):
         self.req.interviewers.add(self.captain, self.first_mate)
 
 
+class CalendarFixtures(object):
+    """Mix into a TestCase for times on Tue 2014-08-05, its working day in time_period, and stub calendars."""
+
+    def setUp(self):
+        super(CalendarFixtures, self).setUp()
+        self.tz = pytz.timezone(settings.TIME_ZONE)
+        self.time_period = lib.TimePeriod(self._time(9), self._time(17))
+
+    def _time(self, hour, day=5):
+        return self.tz.localize(datetime(2014, 8, day, hour, 0))
+
+    def _start_server(self, **kwargs):
+        server = stub_server.StubCalendarServer(**kwargs).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def _make_directory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        return directory
+
+    def _freebusy_service_client(self, test_service_client=None):
+        """A Mock service client that answers freebusy queries from test_service_client."""
+        service_client = mock.Mock()
+        service_client.process_calendar_query.side_effect = (test_service_client or client.TestServiceClient()).process_calendar_query
+        return service_client
+
+
+class BaseSchedulerTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(BaseSchedulerTestCase, self).setUp()
+        now = datetime(2012, 9, 27, 15, 0).replace(tzinfo=pytz.utc).astimezone(pytz.timezone(settings.TIME_ZONE)).replace(second=0, microsecond=0)
+        later = now + timedelta(hours=4)
+        self.time_period = lib.TimePeriod(now, later)
+        self.fifteen_minutes = lib.TimePeriod(self.time_period.start_time, self.time_period.start_time + timedelta(minutes=15))
+
+        self.default_break = lib.time_period_of_length_after_time(self.time_period.start_time, 75, 0)
+
+        self.test_service_client = client.TestServiceClient()
+        self.test_service_client.register_busyness(self.captain.address, self.fifteen_minutes.shift_minutes(60))
+        self.test_service_client.register_busyness(self.captain.address, self.fifteen_minutes.shift_minutes(75))
+        self.test_service_client.register_busyness(self.captain.address, self.fifteen_minutes.shift_minutes(90))
+        self.test_service_client.register_busyness(self.captain.address, self.fifteen_minutes.shift_minutes(105))
+
+        self.calendar_client = client.Client(self.test_service_client)
+
+
 class ModelsTestCase(BaseTestCase):
     def test_address(self):
         self.assertEqual(self.captain.address, 'malcolm@reynolds.com')
@@ -208,25 +279,866 @@ class CalendarClientTestCase(BaseTestCase):
         self.assertTrue(self.time_period.start_time <= busy_times[0].start_time)
 
 
-@mock.patch('caltech.secret.room_id', new=None)
-class SchedulerTestCase(BaseTestCase):
+class FakeFreeBusyService(object):
+    """Stands in for the Google service object, answering freebusy queries with no busy time."""
+
+    def __init__(self):
+        self.query_bodies = []
+
+    def freebusy(self):
+        return self
+
+    def query(self, body):
+        self.query_bodies.append(body)
+        return mock.Mock(execute=lambda: dict(
+            calendars=dict((item['id'], dict(busy=[])) for item in body['items']),
+        ))
+
+
+class ServiceClientTestCase(CalendarFixtures, TestCase):
 
     def setUp(self):
-        super(SchedulerTestCase, self).setUp()
-        now = datetime(2012, 9, 27, 15, 0).replace(tzinfo=pytz.utc).astimezone(pytz.timezone(settings.TIME_ZONE)).replace(second=0, microsecond=0)
-        later = now + timedelta(hours=4)
-        self.time_period = lib.TimePeriod(now, later)
-        self.fifteen_minutes = lib.TimePeriod(self.time_period.start_time, self.time_period.start_time + timedelta(minutes=15))
+        super(ServiceClientTestCase, self).setUp()
+        self.interviewers = [
+            models.Interviewer(name='interviewer%s' % index, domain='example.com')
+            for index in xrange(client.MAX_INTERVIEWERS_IN_QUERY * 2 + 3)
+        ]
 
-        self.default_break = lib.time_period_of_length_after_time(self.time_period.start_time, 75, 0)
+    def test_every_interviewer_is_queried_in_chunks(self):
+        service = FakeFreeBusyService()
+        services_built = []
+
+        def service_factory():
+            services_built.append(True)
+            return service
 
+        service_client = client.ServiceClient(service, service_factory=service_factory, max_concurrent_queries=2)
+        calendar_response = service_client.process_calendar_query(client.CalendarQuery(self.interviewers, self.time_period))
+
+        self.assertEqual(
+            sorted(len(body['items']) for body in service.query_bodies),
+            [3, client.MAX_INTERVIEWERS_IN_QUERY, client.MAX_INTERVIEWERS_IN_QUERY],
+        )
+        self.assertEqual(calendar_response.interviewers, self.interviewers)
+        self.assertEqual(
+            sorted(chunk_latency.num_calendars for chunk_latency in calendar_response.chunk_latencies),
+            [3, client.MAX_INTERVIEWERS_IN_QUERY, client.MAX_INTERVIEWERS_IN_QUERY],
+        )
+        # Two threads at most need a service at once, and one was passed in
+        self.assertTrue(len(services_built) <= 1, services_built)
+        self.assertEqual(service_client.service_pool.stats()['checkouts'], 3)
+
+    def test_serial_without_service_factory(self):
+        service = FakeFreeBusyService()
+        calendar_response = client.ServiceClient(service).process_calendar_query(
+            client.CalendarQuery(self.interviewers, self.time_period),
+        )
+        self.assertEqual(len(service.query_bodies), 3)
+        self.assertEqual(len(calendar_response.interview_calendars), len(self.interviewers))
+
+
+class ServicePoolTestCase(TestCase):
+
+    def test_services_are_reused_up_to_size(self):
+        services_built = []
+
+        def service_factory():
+            services_built.append(object())
+            return services_built[-1]
+
+        pool = service_pool.ServicePool(service_factory, size=2)
+        with pool.checkout() as first:
+            with pool.checkout() as second:
+                self.assertNotEqual(first, second)
+        with pool.checkout() as third:
+            self.assertEqual(third, first)
+
+        stats = pool.stats()
+        self.assertEqual(len(services_built), 2)
+        self.assertEqual((stats['checkouts'], stats['builds'], stats['reuses']), (3, 2, 1))
+        self.assertEqual(stats['idle'], 2)
+
+    def test_checkout_waits_when_every_service_is_out(self):
+        pool = service_pool.ServicePool(services=['only'])
+        checked_out = threading.Event()
+
+        def hold():
+            with pool.checkout():
+                checked_out.set()
+                time.sleep(0.05)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        checked_out.wait()
+        with pool.checkout() as service:
+            self.assertEqual(service, 'only')
+        thread.join()
+        self.assertTrue(pool.stats()['max_wait_ms'] > 0)
+
+    def test_failed_build_frees_its_slot(self):
+        def service_factory():
+            raise IOError('no credentials')
+
+        pool = service_pool.ServicePool(service_factory, size=1)
+        for _ in xrange(2):
+            with self.assertRaises(IOError):
+                with pool.checkout():
+                    pass
+        self.assertEqual(pool.stats()['built'], 0)
+
+    def test_concurrent_calls_scale_with_pool_size(self):
+        server = stub_server.StubCalendarServer(latency_ms=100).start()
+        try:
+            service_client = client.ServiceClient(
+                    None,
+                    service_factory=server.build_service,
+                    service_pool_size=4,
+            )
+            start_time = pytz.timezone(settings.TIME_ZONE).localize(datetime(2014, 8, 5, 9, 0))
+            time_period = lib.TimePeriod(start_time, start_time + timedelta(hours=1))
+            threads = [
+                threading.Thread(target=service_client.process_calendar_query, args=(
+                    client.CalendarQuery(
+                        [models.Interviewer(name='interviewer%s' % index, domain='example.com')],
+                        time_period,
+                    ),
+                ))
+                for index in xrange(4)
+            ]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.time() - start
+        finally:
+            server.stop()
+
+        self.assertEqual(len(server.requests), 4)
+        self.assertTrue(elapsed < 0.3, elapsed)
+        self.assertEqual(service_client.service_pool.stats()['builds'], 4)
+
+
+class FreeBusyCacheTestCase(CalendarFixtures, TestCase):
+
+    def setUp(self):
+        super(FreeBusyCacheTestCase, self).setUp()
+        self.now = [0]
+        self.freebusy_cache = cache.FreeBusyCache(ttl=60, clock=lambda: self.now[0])
         self.test_service_client = client.TestServiceClient()
-        self.test_service_client.register_busyness(self.captain.address, self.fifteen_minutes.shift_minutes(60))
-        self.test_service_client.register_busyness(self.captain.address, self.fifteen_minutes.shift_minutes(75))
-        self.test_service_client.register_busyness(self.captain.address, self.fifteen_minutes.shift_minutes(90))
-        self.test_service_client.register_busyness(self.captain.address, self.fifteen_minutes.shift_minutes(105))
+        self.service_client = mock.Mock(wraps=self.test_service_client)
+        self.calendar_client = client.Client(self.service_client, freebusy_cache=self.freebusy_cache)
+        self.interviewer = models.Interviewer(name='kaylee', domain='serenity.com')
+        self.test_service_client.register_busyness(
+            self.interviewer.address,
+            lib.TimePeriod(self._time(11), self._time(12)),
+        )
 
-        self.calendar_client = client.Client(self.test_service_client)
+    def _busy_times(self, time_period):
+        calendar_response = self.calendar_client.get_calendars([self.interviewer], time_period)
+        return [
+            (busy_time.start_time, busy_time.end_time)
+            for busy_time in calendar_response.interview_calendars[0].busy_times
+        ]
+
+    def test_week_fetch_answers_day_query(self):
+        self._busy_times(lib.TimePeriod(self._time(0, day=4), self._time(0, day=11)))
+        self.assertEqual(
+            self._busy_times(self.time_period),
+            [(self._time(11), self._time(12))],
+        )
+        self.assertEqual(self.service_client.process_calendar_query.call_count, 1)
+        self.assertEqual((self.freebusy_cache.hits, self.freebusy_cache.misses), (1, 1))
+
+    def test_busy_time_clipped_to_query(self):
+        self.assertEqual(
+            self._busy_times(lib.TimePeriod(self._time(11) + timedelta(minutes=30), self._time(17))),
+            [(self._time(11) + timedelta(minutes=30), self._time(12))],
+        )
+
+    def test_ttl(self):
+        time_period = self.time_period
+        self._busy_times(time_period)
+        self.now[0] = 61
+        self._busy_times(time_period)
+        self.assertEqual(self.service_client.process_calendar_query.call_count, 2)
+
+    def test_query_outside_cached_days_misses(self):
+        self._busy_times(self.time_period)
+        self._busy_times(lib.TimePeriod(self._time(9), self._time(17, day=6)))
+        self.assertEqual(self.service_client.process_calendar_query.call_count, 2)
+
+    def test_lru_eviction_by_size(self):
+        freebusy_cache = cache.FreeBusyCache(max_bytes=2 * cache.ENTRY_OVERHEAD_BYTES)
+        days = [self._time(0, day=day).date() for day in (4, 5, 6)]
+        for day in days[:2]:
+            freebusy_cache.put('kaylee@serenity.com', day, lib.IntervalSet())
+        freebusy_cache.get('kaylee@serenity.com', days[:1])
+        freebusy_cache.put('kaylee@serenity.com', days[2], lib.IntervalSet())
+        self.assertEqual(freebusy_cache.get('kaylee@serenity.com', days[1:2]), None)
+        self.assertNotEqual(freebusy_cache.get('kaylee@serenity.com', days[:1]), None)
+        self.assertEqual(freebusy_cache.stats()['evictions'], 1)
+
+
+class FreeBusyStoreTestCase(CalendarFixtures, TestCase):
+
+    def setUp(self):
+        super(FreeBusyStoreTestCase, self).setUp()
+        self.path = os.path.join(self._make_directory(), 'freebusy.db')
+        self.test_service_client = client.TestServiceClient()
+        self.service_client = self._freebusy_service_client(self.test_service_client)
+        self.room = models.Room(name='cargo-bay', domain='serenity.com', type=1)
+
+    def _worker_client(self):
+        return client.Client(self.service_client, freebusy_cache=cache.FreeBusyStore(self.path))
+
+    def test_shared_between_clients(self):
+        self.test_service_client.register_busyness(self.room.address, lib.TimePeriod(self._time(10), self._time(11)))
+        self._worker_client().get_calendars([self.room], self.time_period)
+        other_worker = self._worker_client()
+        calendar_response = other_worker.get_calendars([self.room], self.time_period)
+        self.assertEqual(self.service_client.process_calendar_query.call_count, 1)
+        self.assertEqual(
+            [(busy_time.start_time, busy_time.end_time) for busy_time in calendar_response.interview_calendars[0].busy_times],
+            [(self._time(10), self._time(11))],
+        )
+        self.assertEqual(other_worker.freebusy_cache.stats()['hits'], 1)
+
+    def test_ttl(self):
+        now = [0]
+        store = cache.FreeBusyStore(self.path, ttl=60, clock=lambda: now[0])
+        day = self._time(0).date()
+        store.put(self.room.address, day, lib.IntervalSet([(1, 2)]))
+        self.assertEqual(store.get(self.room.address, [day]), [lib.IntervalSet([(1, 2)])])
+        now[0] = 61
+        self.assertEqual(store.get(self.room.address, [day]), None)
+
+        store.put(self.room.address, day, lib.IntervalSet([(1, 2)]), ttl=600)
+        now[0] = 661
+        self.assertEqual(store.get(self.room.address, [day]), [lib.IntervalSet([(1, 2)])])
+        now[0] = 662
+        self.assertEqual(store.get(self.room.address, [day]), None)
+
+    def test_default_store_is_opt_in(self):
+        with mock.patch.object(secret, 'use_mock', False):
+            self.assertTrue(isinstance(cache.default_freebusy_cache(), cache.FreeBusyCache))
+            with mock.patch.object(cache, 'FREEBUSY_STORE_PATH', self.path):
+                self.assertTrue(isinstance(cache.default_freebusy_cache(), cache.FreeBusyStore))
+        with mock.patch.object(secret, 'use_mock', True):
+            with mock.patch.object(cache, 'FREEBUSY_STORE_PATH', self.path):
+                self.assertTrue(isinstance(cache.default_freebusy_cache(), cache.FreeBusyCache))
+
+    def test_replaces_store_without_expiry(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE freebusy (calendar_id TEXT, day TEXT, fetched_at REAL, busy TEXT, PRIMARY KEY (calendar_id, day))')
+        connection.commit()
+        connection.close()
+        store = cache.FreeBusyStore(self.path)
+        day = self._time(0).date()
+        store.put(self.room.address, day, lib.IntervalSet([(1, 2)]))
+        self.assertEqual(store.get(self.room.address, [day]), [lib.IntervalSet([(1, 2)])])
+
+    def test_event_writes_update_room_and_interview_calendar(self):
+        calendar_client = self._worker_client()
+        name, domain = secret.INTERVIEW_CALENDAR_GROUP_ID.split('@')
+        interview_calendar = models.Room(name=name, domain=domain, type=1)
+        calendar_client.get_calendars([self.room, interview_calendar], self.time_period)
+
+        calendar_client.create_event('Interview', '', self._time(10), self._time(11), self.room.address, 'Cargo bay')
+        calendar_response = calendar_client.get_calendars([self.room, interview_calendar], self.time_period)
+        self.assertEqual(self.service_client.process_calendar_query.call_count, 1)
+        for interview_calendar_response in calendar_response.interview_calendars:
+            self.assertTrue(interview_calendar_response.is_blocked_during(lib.TimePeriod(self._time(10), self._time(11))))
+
+        calendar_client.delete_event('event-id')
+        calendar_client.get_calendars([self.room], self.time_period)
+        self.assertEqual(self.service_client.process_calendar_query.call_count, 1)
+        calendar_client.get_calendars([interview_calendar], self.time_period)
+        self.assertEqual(self.service_client.process_calendar_query.call_count, 2)
+
+
+class WriteThroughTestCase(CalendarFixtures, BaseTestCase):
+
+    def setUp(self):
+        super(WriteThroughTestCase, self).setUp()
+        self.room = models.Room.objects.create(name='cargo-bay', domain='serenity.com', type=1)
+        self.service_client = self._freebusy_service_client()
+        self.calendar_client = client.Client(self.service_client, freebusy_cache=cache.FreeBusyCache())
+        self.calendars = [self.room, self.captain, self.first_mate, self.pilot]
+        self.calendar_client.get_calendars(self.calendars, self.time_period)
+
+    def _blocked(self, calendar, start_hour, end_hour):
+        calendar_response = self.calendar_client.get_calendars(self.calendars, self.time_period)
+        return calendar_response.get_interviewer(calendar.address).is_blocked_during(
+            lib.TimePeriod(self._time(start_hour), self._time(end_hour)),
+        )
+
+    def test_booking_is_written_through(self):
+        with mock.patch.object(schedule_calculator, 'calendar_client', self.calendar_client):
+            interview_id = schedule_calculator.persist_interview(
+                [
+                    dict(room_id=self.room.id, candidate_name='River', interviewer_id=self.captain.id,
+                        start_time=self._time(10), end_time=self._time(11)),
+                    dict(room_id=self.room.id, candidate_name='River', interviewer_id=self.first_mate.id,
+                        start_time=self._time(11), end_time=self._time(12)),
+                ],
+                models.InterviewType.ON_SITE,
+            )
+            self.assertTrue(self._blocked(self.room, 10, 12))
+            self.assertTrue(self._blocked(self.captain, 10, 11))
+            self.assertFalse(self._blocked(self.captain, 11, 12))
+            self.assertTrue(self._blocked(self.first_mate, 11, 12))
+            self.assertEqual(self.service_client.process_calendar_query.call_count, 1)
+
+            slot = models.InterviewSlot.objects.get(interview_id=interview_id, interviewer=self.captain)
+            schedule_calculator.change_interviewer(slot.id, self.pilot.id)
+            self.assertTrue(self._blocked(self.pilot, 10, 11))
+            self.assertFalse(self._blocked(self.captain, 10, 11))
+            # Only the previous interviewer was refetched
+            self.assertEqual(
+                [calendar.address for calendar in self.service_client.process_calendar_query.call_args[0][0].interviewers],
+                [self.captain.address],
+            )
+
+            schedule_calculator.delete_interview(interview_id)
+            self.assertFalse(self._blocked(self.room, 10, 12))
+            self.assertFalse(self._blocked(self.first_mate, 11, 12))
+
+
+class CalendarQueryPlanTestCase(CalendarFixtures, BaseTestCase):
+
+    def setUp(self):
+        super(CalendarQueryPlanTestCase, self).setUp()
+        start_time = self._time(9)
+        self.captain.preferences_address = 'malcolm-preferences@reynolds.com'
+        self.captain.save()
+        self.room = models.Room.objects.create(name='cargo-bay', domain='serenity.com', type=1)
+        self.test_service_client = client.TestServiceClient()
+        self.test_service_client.register_busyness(self.captain.address, lib.TimePeriod(start_time, start_time + timedelta(hours=1)))
+        self.service_client = mock.Mock(wraps=self.test_service_client)
+        self.calendar_client = client.Client(self.service_client)
+
+    def test_shared_calendars_fetched_once(self):
+        plan = client.CalendarQueryPlan(self.time_period)
+        plan.add('backend', [self.captain, self.first_mate])
+        plan.add('frontend', [self.first_mate, self.pilot])
+        plan.add('rooms', [self.room])
+        planned_calendars = plan.execute(self.calendar_client)
+
+        self.assertEqual(self.service_client.process_calendar_query.call_count, 1)
+        self.assertEqual(
+            [calendar.external_id for calendar in self.service_client.process_calendar_query.call_args[0][0].interviewers],
+            [self.captain.address, self.first_mate.address, self.pilot.address, self.room.address],
+        )
+        self.assertEqual(planned_calendars.response('frontend').interviewers, [self.first_mate, self.pilot])
+        captain_calendar = planned_calendars.response('backend').get_interviewer(self.captain.address)
+        self.assertTrue(captain_calendar.is_blocked_during(
+            lib.TimePeriod(self.time_period.start_time, self.time_period.start_time + timedelta(hours=1)),
+        ))
+        self.assertEqual(planned_calendars.response('nothing').interview_calendars, [])
+
+    def test_fetch_calendars_for_scheduling(self):
+        with mock.patch.object(schedule_calculator, 'calendar_client', self.calendar_client):
+            interviewer_groups, rooms, preferences = schedule_calculator.fetch_calendars_for_scheduling(
+                [
+                    schedule_calculator.InterviewerGroup(2, set([self.captain, self.first_mate])),
+                    schedule_calculator.InterviewerGroup(1, set([self.first_mate, self.pilot])),
+                ],
+                self.time_period,
+            )
+        self.assertEqual(self.service_client.process_calendar_query.call_count, 1)
+        self.assertEqual([interviewer_group.num_required for interviewer_group in interviewer_groups], [2, 1])
+        self.assertEqual(
+            set(interview_calendar.interviewer for interview_calendar in interviewer_groups[1].interviewers),
+            set([self.first_mate, self.pilot]),
+        )
+        self.assertEqual([room.interviewer for room in rooms], [self.room])
+        self.assertEqual(
+            [preference.interviewer.external_id for preference in preferences.interview_calendars],
+            [self.captain.preferences_address],
+        )
+
+
+class AsyncClientTestCase(CalendarFixtures, TestCase):
+
+    def setUp(self):
+        super(AsyncClientTestCase, self).setUp()
+        self.server = self._start_server(latency_ms=100)
+        self.calendar_client = client.Client(
+            client.ServiceClient(self.server.build_service(), service_factory=self.server.build_service),
+        )
+        self.async_client = async_client.AsyncClient(self.calendar_client)
+
+    def test_gather_calendars(self):
+        interviewers = [models.Interviewer(name='crew%s' % index, domain='serenity.com') for index in xrange(4)]
+        self.server.register_busyness(interviewers[2].address, lib.TimePeriod(self._time(10), self._time(11)))
+
+        start = time.time()
+        calendar_responses = async_client.gather(*[
+            self.async_client.get_calendars([interviewer], self.time_period)
+            for interviewer in interviewers
+        ])
+        elapsed = time.time() - start
+
+        self.assertEqual([response.interviewers for response in calendar_responses], [[interviewer] for interviewer in interviewers])
+        self.assertTrue(calendar_responses[2].interview_calendars[0].is_blocked_during(
+            lib.TimePeriod(self._time(10), self._time(11)),
+        ))
+        # Four 100ms round trips, side by side
+        self.assertTrue(elapsed < 0.3, elapsed)
+
+    def test_event_calls(self):
+        event, = async_client.gather(self.async_client.create_event(
+            'Interview', 'body', self._time(10), self._time(11), 'cargo-bay@serenity.com', 'Cargo bay',
+        ))
+        self.assertEqual(self.server.events[event['id']]['summary'], 'Interview')
+
+        async_client.gather(self.async_client.update_event(event['id'], 'new body'))
+        self.assertEqual(self.server.events[event['id']]['description'], 'new body')
+
+        async_client.gather(self.async_client.delete_event(event['id']))
+        self.assertEqual(self.server.events, {})
+
+    def test_errors_are_raised_by_gather(self):
+        pending_result = self.async_client.delete_event('no-such-event')
+        self.assertRaises(stub_server.StubServiceError, async_client.gather, pending_result)
+
+
+class EventBatchTestCase(CalendarFixtures, TestCase):
+
+    def setUp(self):
+        super(EventBatchTestCase, self).setUp()
+        self.server = self._start_server()
+        self.freebusy_cache = cache.FreeBusyCache(ttl=60)
+        self.calendar_client = client.Client(
+            client.ServiceClient(self.server.build_service()),
+            freebusy_cache=self.freebusy_cache,
+        )
+
+    def _create(self, batch, hour):
+        return batch.create_event(
+            'Interview', 'body', self._time(hour), self._time(hour + 1), 'cargo-bay@serenity.com', 'Cargo bay',
+        )
+
+    def test_results_and_errors_map_back_to_operations(self):
+        existing = self.calendar_client.create_event(
+            'Interview', 'body', self._time(9), self._time(10), 'cargo-bay@serenity.com', 'Cargo bay',
+        )
+        del self.server.requests[:]
+
+        with self.calendar_client.batch() as batch:
+            created = self._create(batch, 10)
+            updated = batch.update_event(existing['id'], 'new body')
+            missing = batch.delete_event('no-such-event')
+
+        self.assertEqual(self.server.requests, [('POST', '/batch')])
+        self.assertEqual(self.server.events[created.response['id']]['summary'], 'Interview')
+        self.assertEqual(updated.response['description'], 'new body')
+        self.assertEqual(self.server.events[existing['id']]['description'], 'new body')
+        self.assertEqual(missing.response, None)
+        self.assertEqual(missing.error.resp.status, 404)
+        self.assertEqual(batch.errors, [missing])
+
+    def test_large_batches_are_split(self):
+        batch = self.calendar_client.batch()
+        for _ in xrange(client.MAX_EVENTS_IN_BATCH + 1):
+            self._create(batch, 10)
+        batch.execute()
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len(self.server.events), client.MAX_EVENTS_IN_BATCH + 1)
+        # Sent operations aren't sent again
+        batch.execute()
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_created_events_are_written_through(self):
+        self.freebusy_cache.put('cargo-bay@serenity.com', datetime(2014, 8, 5).date(), lib.IntervalSet())
+        with self.calendar_client.batch() as batch:
+            self._create(batch, 10)
+
+        busy, = self.freebusy_cache.get('cargo-bay@serenity.com', [datetime(2014, 8, 5).date()])
+        self.assertEqual(
+            list(busy),
+            [(lib.to_epoch_minutes(self._time(10)), lib.to_epoch_minutes(self._time(11)))],
+        )
+
+    def test_nothing_is_sent_when_the_block_raises(self):
+        with self.assertRaises(ValueError):
+            with self.calendar_client.batch() as batch:
+                self._create(batch, 10)
+                raise ValueError
+        self.assertEqual(self.server.requests, [])
+
+
+class RecordReplayTestCase(CalendarFixtures, TestCase):
+
+    def setUp(self):
+        super(RecordReplayTestCase, self).setUp()
+        self.path = os.path.join(self._make_directory(), 'calls.log.gz')
+        self.server = self._start_server()
+        self.recording_client = client.RecordingServiceClient(client.ServiceClient(self.server.build_service()), self.path)
+        self.interviewer = models.Interviewer(name='kaylee', domain='serenity.com')
+        self.server.register_busyness(self.interviewer.external_id, lib.TimePeriod(self._time(10), self._time(11)))
+
+    def _replay_client(self, **kwargs):
+        self.recording_client.call_log.close()
+        return client.Client(client.ReplayServiceClient(self.path, **kwargs))
+
+    def test_replays_freebusy_and_event_writes(self):
+        recording_calendar_client = client.Client(self.recording_client)
+        recording_calendar_client.get_calendars([self.interviewer], self.time_period)
+        event = recording_calendar_client.create_event(
+            'Interview', 'body', self._time(10), self._time(11), 'cargo-bay@serenity.com', 'Cargo bay',
+        )
+        self.assertRaises(stub_server.StubServiceError, recording_calendar_client.delete_event, 'no-such-event')
+
+        self.server.stop()
+        replay_calendar_client = self._replay_client()
+        inside_window = lib.TimePeriod(self._time(10), self._time(12))
+        calendar_response = replay_calendar_client.get_calendars(
+            [self.interviewer, models.Interviewer(name='wash', domain='serenity.com')],
+            inside_window,
+        )
+        kaylee, wash = calendar_response.interview_calendars
+        self.assertEqual(
+            [(busy_time.start_time, busy_time.end_time) for busy_time in kaylee.busy_times],
+            [(self._time(10), self._time(11))],
+        )
+        self.assertEqual(wash.busy_times, [])
+        self.assertEqual(replay_calendar_client._service_client.misses, 1)
+
+        self.assertEqual(replay_calendar_client.create_event(
+            'Interview', 'body', self._time(10), self._time(11), 'cargo-bay@serenity.com', 'Cargo bay',
+        ), event)
+        self.assertRaises(client.ReplayError, replay_calendar_client.delete_event, 'no-such-event')
+        # Past the end of the recording, writes still succeed
+        self.assertEqual(replay_calendar_client.delete_event(event['id']), '')
+
+    def test_replays_batches(self):
+        with client.Client(self.recording_client).batch() as batch:
+            batch.create_event('Interview', 'body', self._time(10), self._time(11), 'cargo-bay@serenity.com', 'Cargo bay')
+            batch.delete_event('no-such-event')
+        recorded = [(operation.response, operation.error is not None) for operation in batch.operations]
+
+        with self._replay_client(latency_ms=1).batch() as batch:
+            batch.create_event('Interview', 'body', self._time(10), self._time(11), 'cargo-bay@serenity.com', 'Cargo bay')
+            batch.delete_event('no-such-event')
+        self.assertEqual([(operation.response, operation.error is not None) for operation in batch.operations], recorded)
+
+
+class CalendarMirrorTestCase(CalendarFixtures, TestCase):
+
+    def setUp(self):
+        super(CalendarMirrorTestCase, self).setUp()
+        self.now = [timezone.now()]
+        self.server = self._start_server()
+        patcher = mock.patch.object(mirror, 'WEBHOOK_TOKEN', 'shiny')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        service_client = client.ServiceClient(self.server.build_service())
+        self.calendar_mirror = mirror.CalendarMirror(service_client, clock=lambda: self.now[0])
+        self.mirroring_client = client.MirroringServiceClient(service_client, self.calendar_mirror)
+        self.calendar_client = client.Client(self.mirroring_client)
+        self.calendar_client.mirror = self.calendar_mirror
+        self.kaylee = models.Interviewer(name='kaylee', domain='serenity.com')
+        self.wash = models.Interviewer(name='wash', domain='serenity.com')
+
+    def _busy_times(self, interviewer):
+        calendar_response = self.calendar_client.get_calendars([interviewer], self.time_period)
+        return [(busy_time.start_time, busy_time.end_time) for busy_time in calendar_response.interview_calendars[0].busy_times]
+
+    def test_mirrored_calendars_skip_freebusy(self):
+        self.server.add_event(self.kaylee.external_id, lib.TimePeriod(self._time(10), self._time(11)))
+        self.server.add_event(self.wash.external_id, lib.TimePeriod(self._time(12), self._time(13)))
+        self.calendar_mirror.sync(self.kaylee.external_id)
+        del self.server.requests[:]
+
+        calendar_response = self.calendar_client.get_calendars([self.kaylee, self.wash], self.time_period)
+        kaylee, wash = calendar_response.interview_calendars
+        self.assertTrue(kaylee.is_blocked_during(lib.TimePeriod(self._time(10), self._time(11))))
+        self.assertTrue(wash.is_blocked_during(lib.TimePeriod(self._time(12), self._time(13))))
+        self.assertEqual(self.server.requests, [('POST', '/freeBusy')])
+        self.assertEqual((self.mirroring_client.mirrored, self.mirroring_client.fetched), (1, 1))
+
+        # Once the mirror is stale, kaylee goes back to freebusy
+        self.now[0] += mirror.MIRROR_MAX_AGE + timedelta(seconds=1)
+        self.calendar_client.get_calendars([self.kaylee], self.time_period)
+        self.assertEqual(self.mirroring_client.fetched, 2)
+
+    def test_sync_pulls_only_changes(self):
+        kept = self.server.add_event(self.kaylee.external_id, lib.TimePeriod(self._time(10), self._time(11)))
+        removed = self.server.add_event(self.kaylee.external_id, lib.TimePeriod(self._time(12), self._time(13)))
+        self.assertEqual(self.calendar_mirror.sync(self.kaylee.external_id), 2)
+
+        self.server.remove_event(removed['id'])
+        added = self.server.add_event(self.kaylee.external_id, lib.TimePeriod(self._time(14), self._time(15)))
+        self.server.add_event(self.wash.external_id, lib.TimePeriod(self._time(14), self._time(15)))
+        self.assertEqual(self.calendar_mirror.sync(self.kaylee.external_id), 2)
+        self.assertEqual(
+            self._busy_times(self.kaylee),
+            [(self._time(10), self._time(11)), (self._time(14), self._time(15))],
+        )
+        self.assertEqual(
+            sorted(models.MirroredEvent.objects.values_list('event_id', flat=True)),
+            sorted([kept['id'], added['id']]),
+        )
+
+    def test_expired_sync_token_starts_over(self):
+        self.server.add_event(self.kaylee.external_id, lib.TimePeriod(self._time(10), self._time(11)))
+        self.calendar_mirror.sync(self.kaylee.external_id)
+        self.server.add_event(self.kaylee.external_id, lib.TimePeriod(self._time(14), self._time(15)))
+        self.server.expire_sync_tokens()
+
+        self.assertEqual(self.calendar_mirror.sync(self.kaylee.external_id), 2)
+        self.assertEqual(
+            self._busy_times(self.kaylee),
+            [(self._time(10), self._time(11)), (self._time(14), self._time(15))],
+        )
+
+    def test_sync_follows_pages(self):
+        for hour in xrange(9, 14):
+            self.server.add_event(self.kaylee.external_id, lib.TimePeriod(self._time(hour), self._time(hour) + timedelta(minutes=30)))
+        with mock.patch.object(client, 'MAX_EVENTS_IN_PAGE', 2):
+            self.assertEqual(self.calendar_mirror.sync(self.kaylee.external_id), 5)
+        self.assertEqual(models.MirroredEvent.objects.count(), 5)
+
+    def _watch_kaylee(self):
+        with mock.patch.object(mirror, 'WEBHOOK_URL', 'https://caltech.example.com/calendar_notification/'):
+            self.calendar_mirror.refresh([self.kaylee.external_id])
+        self.server.add_event(self.kaylee.external_id, lib.TimePeriod(self._time(10), self._time(11)))
+        notification, = self.server.take_notifications()
+        return notification
+
+    def _notify(self, notification, token):
+        with mock.patch.object(views, 'calendar_client', self.calendar_client):
+            return Client().post(
+                '/calendar_notification/',
+                HTTP_X_GOOG_CHANNEL_ID=notification['channel_id'],
+                HTTP_X_GOOG_RESOURCE_ID=notification['resource_id'],
+                HTTP_X_GOOG_RESOURCE_STATE=notification['resource_state'],
+                HTTP_X_GOOG_CHANNEL_TOKEN=token,
+            )
+
+    def test_notifications_sync_the_calendar(self):
+        notification = self._watch_kaylee()
+        self.assertEqual(notification['token'], mirror.WEBHOOK_TOKEN)
+
+        response = self._notify(notification, notification['token'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._busy_times(self.kaylee), [(self._time(10), self._time(11))])
+        self.assertEqual(self.mirroring_client.fetched, 0)
+
+    def test_notifications_need_the_channel_token(self):
+        notification = self._watch_kaylee()
+
+        self.assertEqual(self._notify(notification, 'guess').status_code, 403)
+        with mock.patch.object(mirror, 'WEBHOOK_TOKEN', None):
+            self.assertEqual(self._notify(notification, '').status_code, 403)
+        self.assertEqual(self._busy_times(self.kaylee), [])
+
+    def test_no_mirror_without_webhook_token(self):
+        with mock.patch.object(mirror, 'CALENDAR_MIRROR', True):
+            with mock.patch.object(mirror, 'WEBHOOK_TOKEN', None):
+                with mock.patch.object(secret, 'use_mock', False):
+                    self.assertRaises(ImproperlyConfigured, client.Client, freebusy_cache=cache.FreeBusyCache())
+
+    def test_sync_drops_changed_days_from_freebusy_cache(self):
+        freebusy_cache = cache.FreeBusyCache()
+        self.calendar_mirror.freebusy_cache = freebusy_cache
+        cached_client = client.Client(self.mirroring_client, freebusy_cache=freebusy_cache)
+        self.calendar_mirror.sync(self.kaylee.external_id)
+        self.calendar_mirror.sync(self.wash.external_id)
+        cached_client.get_calendars([self.kaylee, self.wash], self.time_period)
+
+        self.server.add_event(self.kaylee.external_id, lib.TimePeriod(self._time(10), self._time(11)))
+        self.calendar_mirror.sync(self.kaylee.external_id)
+        day = self.time_period.start_time.date()
+        self.assertEqual(freebusy_cache.get(self.kaylee.external_id, [day]), None)
+        self.assertNotEqual(freebusy_cache.get(self.wash.external_id, [day]), None)
+        calendar = cached_client.get_calendars([self.kaylee], self.time_period).interview_calendars[0]
+        self.assertTrue(calendar.is_blocked_during(lib.TimePeriod(self._time(10), self._time(11))))
+
+    def test_no_mirror_without_events(self):
+        with mock.patch.object(mirror, 'CALENDAR_MIRROR', True):
+            with mock.patch.object(secret, 'use_mock', True):
+                self.assertEqual(client.Client(freebusy_cache=cache.FreeBusyCache()).mirror, None)
+
+    def test_unreadable_calendars_are_reported(self):
+        with mock.patch.object(client.ServiceClient, 'list_events', side_effect=stub_server.StubServiceError(
+                httplib2.Response(dict(status=403)), '{}',
+        )):
+            self.assertEqual(self.calendar_mirror.refresh([self.kaylee.external_id]), [self.kaylee.external_id])
+        self.assertEqual(models.MirroredCalendar.objects.get().sync_error, '403')
+
+    def test_busy_minutes(self):
+        start = dict(dateTime='2014-08-05T10:00:00-07:00')
+        end = dict(dateTime='2014-08-05T18:30:00Z')
+        self.assertEqual(
+            mirror.busy_minutes(dict(start=start, end=end)),
+            (lib.to_epoch_minutes(self._time(10)), lib.to_epoch_minutes(self._time(11)) + 30),
+        )
+        self.assertEqual(mirror.busy_minutes(dict(start=start, end=end, transparency='transparent')), None)
+        self.assertEqual(mirror.busy_minutes(dict(start=start, end=end, status='cancelled')), None)
+        self.assertEqual(
+            mirror.busy_minutes(dict(start=start, end=end, attendees=[dict(self=True, responseStatus='declined')])),
+            None,
+        )
+        self.assertEqual(
+            mirror.busy_minutes(dict(start=dict(date='2014-08-05'), end=dict(date='2014-08-06'))),
+            cache.day_bounds(datetime(2014, 8, 5).date()),
+        )
+
+
+class PrewarmTestCase(CalendarFixtures, TestCase):
+
+    def setUp(self):
+        super(PrewarmTestCase, self).setUp()
+        self.server = self._start_server()
+        self.freebusy_cache = cache.FreeBusyCache(ttl=60)
+        self.calendar_client = client.Client(
+            client.ServiceClient(self.server.build_service()),
+            freebusy_cache=self.freebusy_cache,
+        )
+        models.Interviewer.objects.create(name='kaylee', domain='serenity.com', display_name='Kaylee', preferences_address='kaylee-prefs@serenity.com')
+        models.Interviewer.objects.create(name='wash', domain='serenity.com', display_name='Wash')
+        models.Room.objects.create(name='cargo-bay', domain='serenity.com', display_name='Cargo bay', type=1)
+
+    def test_business_days(self):
+        friday = datetime(2014, 8, 8).date()
+        self.assertEqual(
+            prewarm.business_days(friday, 3),
+            [friday, datetime(2014, 8, 11).date(), datetime(2014, 8, 12).date()],
+        )
+
+    def test_prewarm_refetches_every_calendar(self):
+        days = prewarm.business_days(datetime(2014, 8, 8).date(), 3)
+        report = prewarm.prewarm(self.calendar_client, 3, today=days[0])
+        self.assertEqual((report.num_calendars, report.first_day, report.last_day), (4, days[0], days[-1]))
+        self.assertEqual(report.api_calls, 1)
+        self.assertTrue(report.response_bytes > 0)
+        for calendar_id in ('kaylee@serenity.com', 'kaylee-prefs@serenity.com', 'wash@serenity.com', 'cargo-bay@serenity.com'):
+            self.assertNotEqual(self.freebusy_cache.get(calendar_id, days), None)
+
+        # Already cached, but fetched again so it's fresh
+        self.assertEqual(prewarm.prewarm(self.calendar_client, 3, today=days[0]).api_calls, 1)
+
+    def test_prewarmed_days_outlive_the_cache_ttl(self):
+        now = [1000.0]
+        self.freebusy_cache._clock = lambda: now[0]
+        days = prewarm.business_days(datetime(2014, 8, 8).date(), 1)
+        prewarm.prewarm(self.calendar_client, 1, today=days[0])
+        now[0] += 60 * 60
+        self.assertNotEqual(self.freebusy_cache.get('wash@serenity.com', days), None)
+        now[0] += prewarm.PREWARM_CACHE_TTL
+        self.assertEqual(self.freebusy_cache.get('wash@serenity.com', days), None)
+
+    def test_scheduler_runs_until_stopped(self):
+        ran = threading.Event()
+        with mock.patch.object(prewarm, 'prewarm', side_effect=lambda *args: ran.set()) as prewarm_call:
+            scheduler = prewarm.PrewarmScheduler(self.calendar_client, interval=60).start()
+            self.assertTrue(ran.wait(5))
+            scheduler.stop()
+        prewarm_call.assert_called_once_with(self.calendar_client, prewarm.PREWARM_BUSINESS_DAYS)
+
+
+class CoalescingTestCase(CalendarFixtures, TestCase):
+
+    def setUp(self):
+        super(CoalescingTestCase, self).setUp()
+        start_time = self._time(9)
+        self.interviewers = [models.Interviewer(name='crew%s' % index, domain='serenity.com') for index in xrange(3)]
+        self.test_service_client = client.TestServiceClient()
+        self.test_service_client.register_busyness(
+            self.interviewers[0].address,
+            lib.TimePeriod(start_time, start_time + timedelta(hours=1)),
+        )
+        self.release = threading.Event()
+        self.service_client = mock.Mock()
+        self.service_client.process_calendar_query.side_effect = self._slow_query
+        self.calendar_client = client.Client(self.service_client, coalesce=True)
+
+    def _slow_query(self, calendar_query):
+        self.release.wait(5)
+        return self.test_service_client.process_calendar_query(calendar_query)
+
+    def test_identical_concurrent_queries_share_one_call(self):
+        single_flight = self.calendar_client.coalescing_client.single_flight
+        responses = []
+
+        def get_calendars(interviewers):
+            responses.append(self.calendar_client.get_calendars(interviewers, self.time_period))
+
+        threads = [
+            threading.Thread(target=get_calendars, args=(interviewers,))
+            for interviewers in (self.interviewers, list(reversed(self.interviewers)), self.interviewers)
+        ]
+        for thread in threads:
+            thread.start()
+        for _ in xrange(500):
+            if single_flight.saved_calls == 2:
+                break
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.service_client.process_calendar_query.call_count, 1)
+        self.assertEqual(single_flight.stats(), dict(calls=1, saved_calls=2))
+        for calendar_response in responses:
+            self.assertEqual(set(calendar_response.interviewers), set(self.interviewers))
+            self.assertTrue(calendar_response.get_interviewer(self.interviewers[0].address).is_blocked_during(
+                lib.TimePeriod(self.time_period.start_time, self.time_period.start_time + timedelta(hours=1)),
+            ))
+
+    def test_different_queries_are_not_shared(self):
+        self.release.set()
+        self.calendar_client.get_calendars(self.interviewers[:1], self.time_period)
+        self.calendar_client.get_calendars(self.interviewers[:1], self.time_period)
+        self.calendar_client.get_calendars(self.interviewers[1:], self.time_period)
+        self.assertEqual(self.service_client.process_calendar_query.call_count, 3)
+        self.assertEqual(self.calendar_client.coalescing_client.single_flight.saved_calls, 0)
+
+    def test_errors_reach_every_caller(self):
+        single_flight = client.SingleFlight()
+
+        def fail():
+            raise ValueError('boom')
+        self.assertRaises(ValueError, single_flight.do, 'key', fail)
+        self.assertEqual(single_flight.do('key', lambda: 1), 1)
+
+
+class ServiceStartupTestCase(CalendarFixtures, TestCase):
+
+    def setUp(self):
+        super(ServiceStartupTestCase, self).setUp()
+        self.directory = self._make_directory()
+        self.path = os.path.join(self.directory, 'discovery.json')
+
+    def test_discovery_document_cached_on_disk(self):
+        http = mock.Mock()
+        http.request.return_value = (mock.Mock(status=200), '{"name": "calendar"}')
+        self.assertEqual(schedule.load_discovery_document(http, self.path), '{"name": "calendar"}')
+        self.assertEqual(schedule.load_discovery_document(http, self.path), '{"name": "calendar"}')
+        self.assertEqual(http.request.call_count, 1)
+        self.assertEqual(os.listdir(self.directory), ['discovery.json'])
+
+    def test_discovery_document_fetch_failure(self):
+        http = mock.Mock()
+        http.request.return_value = (mock.Mock(status=503), '')
+        self.assertRaises(IOError, schedule.load_discovery_document, http, self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_service_built_lazily(self):
+        service_factory = mock.Mock(return_value=FakeFreeBusyService())
+        calendar_client = client.Client(client.ServiceClient(None, service_factory=service_factory))
+        self.assertEqual(service_factory.call_count, 0)
+        calendar_client.warm_up()
+        calendar_client.warm_up()
+        self.assertEqual(service_factory.call_count, 1)
+
+
+@mock.patch('caltech.secret.room_id', new=None)
+class SchedulerTestCase(BaseSchedulerTestCase):
 
     def test_possible(self):
         calendar_response = self.calendar_client.get_calendars([self.captain, self.first_mate], self.time_period)
@@ -270,6 +1182,188 @@ class SchedulerTestCase(BaseTestCase):
 
         self.assertEqual(len(schedules), 13)
 
+    def test_random_search_has_no_duplicates(self):
+        calendar_response = self.calendar_client.get_calendars([self.first_mate], self.time_period)
+        interviewer_groups = [schedule_calculator.InterviewerGroup(interviewers=calendar_response.interview_calendars, num_required=1)]
+
+        schedules = schedule_calculator.calculate_schedules(
+                interviewer_groups,
+                self.time_period,
+                randomized_search=True,
+        )
+
+        self.assertEqual(len(schedules), 13)
+        self.assertEqual(len(set(schedule.fingerprint for schedule in schedules)), 13)
+
+
+class SearchPossibleSchedulesTestCase(BaseSchedulerTestCase):
+
+    def _search(self, interviewer_groups, possible_break=None):
+        interviewers = [
+            interviewer
+            for interviewer_group in interviewer_groups
+            for interviewer in interviewer_group.interviewers
+        ]
+        preferences = self.calendar_client.get_calendars([], self.time_period)
+        availability = schedule_calculator.build_availability_matrix(self.time_period, interviewers, [], preferences)
+        return [
+            tuple((slot.interviewer, slot.start_time) for slot in schedule)
+            for schedule in schedule_calculator.search_possible_schedules(
+                interviewer_groups,
+                self.time_period,
+                possible_break,
+                availability,
+            )
+        ]
+
+    def test_each_schedule_once(self):
+        calendar_response = self.calendar_client.get_calendars([self.captain, self.first_mate, self.pilot], self.time_period)
+        interviewer_groups = [schedule_calculator.InterviewerGroup(interviewers=calendar_response.interview_calendars, num_required=2)]
+        schedules = self._search(interviewer_groups)
+
+        self.assertEqual(len(schedules), len(set(schedules)))
+        for schedule in schedules:
+            self.assertNotEqual(schedule[0][0], schedule[1][0])
+        # The captain is busy from 9:00 to 10:00, so can't take a slot that overlaps it
+        captain_starts = [start for schedule in schedules for address, start in schedule if address == self.captain.address]
+        self.assertTrue(captain_starts)
+        for start in captain_starts:
+            self.assertTrue(start + timedelta(minutes=45) <= self.time_period.start_time + timedelta(minutes=60) or start >= self.time_period.start_time + timedelta(minutes=120))
+
+    def test_matches_break_tests(self):
+        calendar_response = self.calendar_client.get_calendars([self.captain, self.first_mate], self.time_period)
+        interviewer_groups = [
+            schedule_calculator.InterviewerGroup(interviewers=[interview_calendar], num_required=1)
+            for interview_calendar in calendar_response.interview_calendars
+        ]
+        schedules = self._search(interviewer_groups, possible_break=self.default_break.shift_minutes(45))
+        self.assertEqual(len(schedules), 2)
+
+    def test_no_valid_schedule(self):
+        calendar_response = self.calendar_client.get_calendars([self.captain], self.time_period)
+        interviewer_groups = [schedule_calculator.InterviewerGroup(interviewers=calendar_response.interview_calendars, num_required=2)]
+        self.assertEqual([], self._search(interviewer_groups))
+
+
+class TopSchedulesTestCase(BaseSchedulerTestCase):
+
+    def setUp(self):
+        super(TopSchedulesTestCase, self).setUp()
+        models.Room.objects.create(name='serenity', domain='firefly.com', display_name='Serenity', type=1)
+        patcher = mock.patch.object(schedule_calculator, 'calendar_client', self.calendar_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        calendar_response = self.calendar_client.get_calendars([self.captain, self.first_mate, self.pilot], self.time_period)
+        self.interviewer_groups = [schedule_calculator.InterviewerGroup(interviewers=calendar_response.interview_calendars, num_required=2)]
+
+    def test_top_k_matches_full_search(self):
+        all_schedules = schedule_calculator.calculate_schedules(self.interviewer_groups, self.time_period, max_schedules=1000)
+        best_priorities = sorted([schedule.priority for schedule in all_schedules], reverse=True)[:5]
+
+        with mock.patch.object(schedule_calculator, 'create_interview', wraps=schedule_calculator.create_interview) as create_interview:
+            top_schedules = schedule_calculator.calculate_schedules(self.interviewer_groups, self.time_period, top_k=5)
+
+        self.assertEqual(best_priorities, sorted([schedule.priority for schedule in top_schedules], reverse=True))
+        self.assertTrue(create_interview.call_count < len(all_schedules))
+
+    def test_deadline_returns_best_so_far(self):
+        search_stats = schedule_calculator.SearchStats()
+        clock = [0.0]
+        create_interview = schedule_calculator.create_interview
+
+        def create_interview_and_wait(*args, **kwargs):
+            # Each schedule we look at takes 200ms
+            clock[0] += 0.2
+            return create_interview(*args, **kwargs)
+
+        with mock.patch.object(schedule_calculator.time, 'time', lambda: clock[0]):
+            with mock.patch.object(schedule_calculator, 'create_interview', wraps=create_interview_and_wait):
+                schedules = schedule_calculator.calculate_schedules(
+                    self.interviewer_groups,
+                    self.time_period,
+                    top_k=5,
+                    deadline_ms=500,
+                    search_stats=search_stats,
+                )
+
+        self.assertFalse(search_stats.completed)
+        self.assertEqual(search_stats.stopped_by, schedule_calculator.SearchStats.DEADLINE)
+        self.assertEqual(search_stats.num_explored, 3)
+        self.assertEqual(len(schedules), 3)
+
+    def test_completed_search_stats(self):
+        search_stats = schedule_calculator.SearchStats()
+        schedules = schedule_calculator.calculate_schedules(
+            self.interviewer_groups,
+            self.time_period,
+            max_schedules=1000,
+            deadline_ms=60000,
+            search_stats=search_stats,
+        )
+
+        self.assertTrue(search_stats.completed)
+        self.assertEqual(len(schedules), search_stats.num_explored)
+
+    def test_parallel_matches_serial(self):
+        serial_schedules = schedule_calculator.calculate_schedules(self.interviewer_groups, self.time_period, top_k=5)
+        search_pool = schedule_calculator.SearchPool(2)
+        try:
+            parallel_schedules = [
+                schedule_calculator.calculate_schedules(self.interviewer_groups, self.time_period, top_k=5, search_pool=search_pool)
+                for _ in xrange(2)
+            ]
+        finally:
+            search_pool.close()
+
+        self.assertEqual(
+            sorted([schedule.priority for schedule in serial_schedules]),
+            sorted([schedule.priority for schedule in parallel_schedules[0]]),
+        )
+        self.assertEqual(
+            [schedule.fingerprint for schedule in parallel_schedules[0]],
+            [schedule.fingerprint for schedule in parallel_schedules[1]],
+        )
+
+    def test_schedules_in_different_rooms_are_kept_apart(self):
+        interview, = schedule_calculator.calculate_schedules(self.interviewer_groups, self.time_period, top_k=1)
+        other_room = schedule_calculator.InterviewSlot(
+            'Shuttle', interview.room.start_time, interview.room.end_time, external_id='shuttle@firefly.com',
+        )
+        in_other_room = schedule_calculator.Interview(interview.interview_slots, other_room, interview.priority)
+
+        self.assertNotEqual(interview.fingerprint, in_other_room.fingerprint)
+        self.assertEqual(
+            2,
+            len(schedule_calculator._merge_partitions([[interview], [in_other_room]], mock.Mock(top_k=None, max_schedules=100))),
+        )
+
+    def test_truncated_search_spreads_start_times(self):
+        schedules = schedule_calculator.calculate_schedules(self.interviewer_groups, self.time_period, max_schedules=3)
+
+        self.assertEqual(len(schedules), 4)
+        self.assertTrue(len(set(schedule.start_time for schedule in schedules)) > 1)
+
+    def test_room_choice_is_deterministic(self):
+        models.Room.objects.create(name='shuttle', domain='firefly.com', display_name='Shuttle', type=1)
+        models.Room.objects.create(name='galley', domain='firefly.com', display_name='Galley', type=0)
+        runs = [
+            schedule_calculator.calculate_schedules(
+                self.interviewer_groups,
+                self.time_period,
+                max_schedules=1000,
+                interview_type=models.InterviewType.ON_SITE,
+            )
+            for _ in xrange(3)
+        ]
+
+        self.assertEqual(1, len(set(tuple(schedule.fingerprint for schedule in run) for run in runs)))
+        # Equally good rooms take turns, the one unsuitable for onsites never comes up
+        self.assertEqual(
+            set(['serenity@firefly.com', 'shuttle@firefly.com']),
+            set(schedule.room.external_id for schedule in runs[0]),
+        )
+
 
 class LibraryTestCase(BaseTestCase):
 
@@ -301,6 +1395,498 @@ class LibraryTestCase(BaseTestCase):
         )
 
 
+class IntervalSetTestCase(TestCase):
+
+    def test_merges_overlapping_and_adjacent(self):
+        interval_set = lib.IntervalSet([(30, 40), (0, 10), (5, 15), (15, 20), (50, 50)])
+        self.assertEqual([(0, 20), (30, 40)], list(interval_set))
+
+    def test_contains(self):
+        interval_set = lib.IntervalSet([(0, 20), (30, 40)])
+        self.assertTrue(interval_set.contains(0, 20))
+        self.assertTrue(interval_set.contains(32, 35))
+        self.assertFalse(interval_set.contains(15, 35))
+        self.assertFalse(interval_set.contains(-5, 5))
+        self.assertFalse(interval_set.contains(45, 50))
+
+    def test_overlaps(self):
+        interval_set = lib.IntervalSet([(0, 20), (30, 40)])
+        self.assertTrue(interval_set.overlaps(15, 25))
+        self.assertTrue(interval_set.overlaps(25, 35))
+        self.assertFalse(interval_set.overlaps(20, 30))
+        self.assertFalse(interval_set.overlaps(45, 50))
+
+    def test_union_and_intersection(self):
+        first = lib.IntervalSet([(0, 20), (30, 40)])
+        second = lib.IntervalSet([(10, 35), (50, 60)])
+        self.assertEqual([(0, 40), (50, 60)], list(first.union(second)))
+        self.assertEqual([(10, 20), (30, 35)], list(first.intersection(second)))
+
+    def test_complement(self):
+        interval_set = lib.IntervalSet([(0, 20), (30, 40)])
+        self.assertEqual([(20, 30), (40, 50)], list(interval_set.complement(10, 50)))
+        self.assertEqual([(-10, 0), (20, 30)], list(interval_set.complement(-10, 35)))
+        self.assertEqual([], list(interval_set.complement(0, 20)))
+
+    def test_epoch_minutes_round_trip(self):
+        now = datetime(2014, 5, 3, 12, 30).replace(tzinfo=pytz.utc)
+        minutes = lib.to_epoch_minutes(now)
+        self.assertEqual(now, lib.from_epoch_minutes(minutes))
+        self.assertEqual(minutes, lib.parse_utc_epoch_minutes(lib.format_datetime_utc(now)))
+
+
+class AvailabilityMatrixTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(AvailabilityMatrixTestCase, self).setUp()
+        start = datetime(2012, 9, 27, 16, 0).replace(tzinfo=pytz.utc)
+        self.time_period = lib.TimePeriod(start, start + timedelta(hours=2))
+        test_service_client = client.TestServiceClient()
+        # Busy from 9:40 to 10:00 local time
+        test_service_client.register_busyness(
+            self.captain.address,
+            lib.TimePeriod(start + timedelta(minutes=40), start + timedelta(minutes=60)),
+        )
+        calendar = client.Client(test_service_client).get_calendars([self.captain], self.time_period).interview_calendars[0]
+        self.key = ('interviewer', self.captain.address)
+        self.matrix = AvailabilityMatrix(self.time_period, 15)
+        self.matrix.add_calendar(self.key, calendar)
+
+    def test_masks(self):
+        row = self.matrix.row(self.key)
+        self.assertEqual(8, self.matrix.num_slots)
+        self.assertEqual(0b11110011, row.free_mask)
+        self.assertEqual(0b00001000, row.busy_mask)
+        self.assertEqual(0b11110111, row.open_mask)
+
+    def test_aligned_and_unaligned_lookups_agree(self):
+        start = self.time_period.start_time
+        self.assertTrue(self.matrix.has_availability_during(self.key, lib.TimePeriod(start, start + timedelta(minutes=30))))
+        self.assertFalse(self.matrix.has_availability_during(self.key, lib.TimePeriod(start, start + timedelta(minutes=45))))
+        self.assertTrue(self.matrix.has_availability_during(self.key, lib.TimePeriod(start, start + timedelta(minutes=40))))
+        self.assertFalse(self.matrix.has_availability_during(self.key, lib.TimePeriod(start, start + timedelta(minutes=41))))
+        self.assertTrue(self.matrix.is_blocked_during(self.key, lib.TimePeriod(start + timedelta(minutes=45), start + timedelta(minutes=60))))
+        self.assertFalse(self.matrix.has_availability_during(('interviewer', 'nobody'), self.time_period))
+
+    def test_interview_chunks(self):
+        chunks = list(self.matrix.interview_chunks(self.key, 3))
+        self.assertEqual(
+            [self.time_period.start_time + timedelta(minutes=60)],
+            [chunk.start_time for chunk in chunks],
+        )
+
+
+class HeatmapTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(HeatmapTestCase, self).setUp()
+        self.captain.display_name = 'Malcolm Reynolds'
+        self.captain.save()
+        self.first_mate.display_name = 'Zoe Washburne'
+        self.first_mate.save()
+        tz = pytz.timezone(settings.TIME_ZONE)
+        self.day = datetime(2012, 9, 27).date()
+        start = tz.localize(datetime(2012, 9, 27, 9, 0))
+        self.time_period = lib.TimePeriod(start, start + timedelta(hours=2))
+        self.test_service_client = client.TestServiceClient()
+        # Captain is busy from 10:00 to 11:00
+        self.test_service_client.register_busyness(
+            self.captain.address,
+            lib.TimePeriod(start + timedelta(hours=1), start + timedelta(hours=2)),
+        )
+        User.objects.create_user('kaylee', 'kaylee@serenity.com', 'shiny')
+        self.c = Client()
+        self.c.login(username='kaylee', password='shiny')
+
+    def test_heatmap(self):
+        calendars = client.Client(self.test_service_client).get_calendars(
+            [self.captain, self.first_mate],
+            self.time_period,
+        ).interview_calendars
+        days = availability.heatmap(calendars, [self.day], 9, 2, 4)
+        self.assertEqual(1, len(days))
+        self.assertEqual('2012-09-27', days[0]['date'])
+        self.assertEqual([2, 2, 2, 2, 1, 1, 1, 1], days[0]['counts'])
+        self.assertEqual(['f0', 'ff'], days[0]['free'])
+
+    def test_encode_mask(self):
+        self.assertEqual('10', availability.encode_mask(0b1, 8))
+        self.assertEqual('0c8', availability.encode_mask(0b100011000000, 12))
+
+    def test_heatmap_endpoint(self):
+        with mock.patch.object(views, 'calendar_client', client.Client(self.test_service_client)):
+            response = self.c.post('/find_times_heatmap/', dict(
+                requisition=self.req.id,
+                start_time=self.time_period.start_time.strftime(DATEPICKER_FORMAT),
+                end_time=self.time_period.end_time.strftime(DATEPICKER_FORMAT),
+            ))
+        self.assertEqual(200, response.status_code)
+        heatmap = simplejson.loads(response.content)
+        self.assertEqual(
+            [dict(id=self.captain.id, name='Malcolm Reynolds'), dict(id=self.first_mate.id, name='Zoe Washburne')],
+            heatmap['interviewers'],
+        )
+        self.assertEqual(lib.to_epoch_minutes(self.time_period.start_time), heatmap['start'])
+        day = [day for day in heatmap['days'] if day['date'] == '2012-09-27'][0]
+        self.assertEqual([1, 1, 1, 1], day['counts'][4:8])
+        self.assertEqual('0', day['free'][0][1])
+
+    def test_heatmap_endpoint_rejects_bad_form(self):
+        response = self.c.post('/find_times_heatmap/', dict(requisition=self.req.id))
+        self.assertEqual(400, response.status_code)
+        self.assertIn('start_time', simplejson.loads(response.content))
+
+    def test_busy_endpoint(self):
+        start = lib.to_epoch_minutes(self.time_period.start_time)
+        with mock.patch.object(views, 'calendar_client', client.Client(self.test_service_client)):
+            response = self.c.get('/find_times_busy/', dict(
+                interviewer=self.captain.id,
+                start=start,
+                end=start + 120,
+            ))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(dict(interviewer=self.captain.id, busy=[[start + 60, start + 120]]), simplejson.loads(response.content))
+
+    def test_busy_endpoint_rejects_bad_params(self):
+        start = lib.to_epoch_minutes(self.time_period.start_time)
+        for params in (
+            dict(interviewer='mal', start=start, end=start + 120),
+            dict(start=start, end=start + 120),
+            dict(interviewer=self.captain.id, start='now', end=start + 120),
+        ):
+            response = self.c.get('/find_times_busy/', params)
+            self.assertEqual(400, response.status_code)
+
+
+class FreeIndexTestCase(CalendarFixtures, BaseTestCase):
+
+    def setUp(self):
+        super(FreeIndexTestCase, self).setUp()
+        self.day_start = self._time(0)
+        test_service_client = client.TestServiceClient()
+        # Captain is busy from 14:00 to 14:30
+        test_service_client.register_busyness(self.captain.address, self._period(14 * 60, 14 * 60 + 30))
+        self.service_client = mock.Mock(wraps=test_service_client)
+        self.now = [1000.0]
+        self.calendar_client = client.Client(
+            self.service_client,
+            freebusy_cache=cache.FreeBusyCache(ttl=600, clock=lambda: self.now[0]),
+        )
+        self.calendar_client.get_calendars([self.captain, self.first_mate], self._period(9 * 60, 17 * 60))
+        self.free_index = free_index.FreeIndex(self.calendar_client, ttl=60, clock=lambda: self.now[0])
+
+    def _period(self, start_minute, end_minute):
+        return lib.TimePeriod(
+            self.day_start + timedelta(minutes=start_minute),
+            self.day_start + timedelta(minutes=end_minute),
+        )
+
+    def _free(self, start_minute, end_minute, duration):
+        free, unknown = self.free_index.free_interviewers(
+            self.req.interviewers.all(),
+            self._period(start_minute, end_minute),
+            duration,
+        )
+        return [interviewer for interviewer, _ in free], unknown
+
+    def test_free_for_whole_window(self):
+        free, unknown = self._free(14 * 60, 14 * 60 + 45, 45)
+        self.assertEqual([self.first_mate], free)
+        self.assertEqual([], unknown)
+
+    def test_free_somewhere_in_window(self):
+        free, _ = self._free(13 * 60, 15 * 60, 45)
+        self.assertEqual(set([self.captain, self.first_mate]), set(free))
+        free, _ = self._free(13 * 60 + 30, 15 * 60, 45)
+        self.assertEqual([self.first_mate], free)
+
+    def test_ranked_by_weekly_load(self):
+        year, week, _ = self.day_start.date().isocalendar()
+        models.InterviewerWeeklyLoad.objects.create(interviewer=self.first_mate, iso_year=year, iso_week=week, interviews=3)
+        models.InterviewerWeeklyLoad.objects.create(interviewer=self.captain, iso_year=year, iso_week=week, interviews=1)
+        free, _ = self.free_index.free_interviewers(self.req.interviewers.all(), self._period(10 * 60, 11 * 60), 45)
+        self.assertEqual([(self.captain, 1), (self.first_mate, 3)], free)
+
+    def test_uncached_interviewers_are_unknown(self):
+        self.req.interviewers.add(self.pilot)
+        calls = self.service_client.process_calendar_query.call_count
+        free, unknown = self._free(10 * 60, 11 * 60, 45)
+        self.assertEqual(set([self.captain, self.first_mate]), set(free))
+        self.assertEqual([self.pilot], unknown)
+        self.assertEqual(calls, self.service_client.process_calendar_query.call_count)
+
+    def test_rebuilt_after_ttl(self):
+        self.assertEqual([self.first_mate], self._free(14 * 60, 14 * 60 + 45, 45)[0])
+        self.calendar_client.freebusy_cache.invalidate(self.captain.external_id)
+        self.calendar_client.freebusy_cache.put(self.captain.external_id, self.day_start.date(), lib.IntervalSet())
+        self.assertEqual([self.first_mate], self._free(14 * 60, 14 * 60 + 45, 45)[0])
+        self.now[0] += 61
+        self.assertEqual(set([self.captain, self.first_mate]), set(self._free(14 * 60, 14 * 60 + 45, 45)[0]))
+
+    def test_endpoint(self):
+        User.objects.create_user('kaylee', 'kaylee@serenity.com', 'shiny')
+        c = Client()
+        c.login(username='kaylee', password='shiny')
+        with mock.patch.object(views, 'interviewer_free_index', self.free_index):
+            response = c.get('/free_interviewers/', dict(
+                requisition=self.req.id,
+                start_time=self.day_start.replace(hour=14).strftime(DATEPICKER_FORMAT),
+                end_time=self.day_start.replace(hour=15).strftime(DATEPICKER_FORMAT),
+                duration=45,
+            ))
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(
+                dict(interviewers=[dict(id=self.first_mate.id, name=self.first_mate.display_name, weekly_load=0)], unknown=[]),
+                simplejson.loads(response.content),
+            )
+
+            response = c.get('/free_interviewers/', dict(
+                requisition=self.req.id,
+                start_time=self.day_start.replace(hour=15).strftime(DATEPICKER_FORMAT),
+                end_time=self.day_start.replace(hour=14).strftime(DATEPICKER_FORMAT),
+            ))
+            self.assertEqual(400, response.status_code)
+
+
+class ReplacementInterviewersTestCase(CalendarFixtures, BaseTestCase):
+
+    def setUp(self):
+        super(ReplacementInterviewersTestCase, self).setUp()
+        self.jayne = models.Interviewer.objects.create(name='jayne', domain='cobb.com', display_name='Jayne')
+        self.kaylee = models.Interviewer.objects.create(name='kaylee', domain='frye.com', display_name='Kaylee', max_interviews_per_week=1)
+        self.book = models.Interviewer.objects.create(name='book', domain='shepherd.com', display_name='Book')
+        self.first_mate.preferences_address = 'zoe-preferences@washburn.com'
+        self.first_mate.save()
+        self.req.interviewers.add(self.pilot, self.jayne, self.kaylee, self.book)
+
+        self.day_start = self._time(0)
+        test_service_client = client.TestServiceClient()
+        # Zoe would like to interview from 10:00 to 11:00, Wash is busy right after
+        # the slot and Jayne during it
+        test_service_client.register_busyness(self.first_mate.preferences_address, self._period(10 * 60, 11 * 60))
+        test_service_client.register_busyness(self.pilot.address, self._period(10 * 60 + 45, 11 * 60))
+        test_service_client.register_busyness(self.jayne.address, self._period(10 * 60 + 30, 11 * 60))
+        calendar_client = client.Client(test_service_client, freebusy_cache=cache.FreeBusyCache())
+        calendar_client.get_calendars(
+            [self.captain, self.first_mate, self.pilot, self.jayne, self.kaylee]
+            + [models.InterviewerStruct(address=self.first_mate.preferences_address, external_id=self.first_mate.preferences_address)],
+            self._period(9 * 60, 17 * 60),
+        )
+        self.free_index = free_index.FreeIndex(calendar_client)
+
+        year, week, _ = self.day_start.date().isocalendar()
+        models.InterviewerWeeklyLoad.objects.create(interviewer=self.first_mate, iso_year=year, iso_week=week, interviews=2)
+        models.InterviewerWeeklyLoad.objects.create(interviewer=self.kaylee, iso_year=year, iso_week=week, interviews=1)
+
+        interview = models.Interview.objects.create(
+            candidate_name='River',
+            room=models.Room.objects.create(type=1),
+            type=models.InterviewType.SKYPE,
+        )
+        self.slot = models.InterviewSlot.objects.create(
+            interview=interview,
+            interviewer=self.captain,
+            start_time=self.day_start + timedelta(hours=10),
+            end_time=self.day_start + timedelta(hours=10, minutes=45),
+        )
+
+    def _period(self, start_minute, end_minute):
+        return lib.TimePeriod(
+            self.day_start + timedelta(minutes=start_minute),
+            self.day_start + timedelta(minutes=end_minute),
+        )
+
+    def test_ranked_like_create_interview(self):
+        replacements, unknown = schedule_calculator.replacement_interviewers(self.slot, self.free_index)
+        # Zoe: preference 15 + padding 5 - 5 * 2 interviews; Wash: no padding, no load
+        self.assertEqual(
+            [(self.first_mate, 10, 2), (self.pilot, 0, 0)],
+            [tuple(replacement) for replacement in replacements],
+        )
+        self.assertEqual([self.book], unknown)
+
+    def test_endpoint(self):
+        User.objects.create_user('simon', 'simon@serenity.com', 'tam')
+        c = Client()
+        c.login(username='simon', password='tam')
+        with mock.patch.object(views, 'interviewer_free_index', self.free_index):
+            response = c.get('/replacement_interviewers/', dict(interview_slot_id=self.slot.id))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            [self.first_mate.id, self.pilot.id],
+            [interviewer['id'] for interviewer in simplejson.loads(response.content)['interviewers']],
+        )
+
+
+class CapacityLedgerTestCase(CalendarFixtures, BaseTestCase):
+
+    def setUp(self):
+        super(CapacityLedgerTestCase, self).setUp()
+        room = models.Room.objects.create(type=1)
+        self.interview = models.Interview.objects.create(type=1, room=room)
+        # Tue 2014-08-05 and Wed 2014-08-06 are in ISO week 32
+        for day in (5, 6, 12):
+            self._add_slot(self.captain, datetime(2014, 8, day, 10, 0))
+        self._add_slot(self.first_mate, datetime(2014, 8, 5, 10, 0))
+        # Late Sunday evening locally is already Monday in UTC
+        self._add_slot(self.first_mate, datetime(2014, 8, 10, 20, 0))
+        # Same ISO week number, a year earlier
+        self._add_slot(self.first_mate, datetime(2013, 8, 6, 10, 0))
+        models.AlternateRecruitingEvent.objects.create(
+            interviewer=self.captain,
+            type=models.AlternateRecruitingEventType.CODE_TEST,
+            time=self.tz.localize(datetime(2014, 8, 7, 9, 0)),
+        )
+
+    def _add_slot(self, interviewer, start):
+        start = self.tz.localize(start)
+        models.InterviewSlot.objects.create(
+            interviewer=interviewer,
+            interview=self.interview,
+            start_time=start,
+            end_time=start + timedelta(minutes=45),
+        )
+
+    def test_query_count_does_not_grow_with_interviewers(self):
+        with self.assertNumQueries(1):
+            capacity.load_capacity_ledger(
+                [self.captain.id, self.first_mate.id, self.pilot.id],
+                datetime(2014, 8, 4).date(),
+                datetime(2014, 8, 11).date(),
+            )
+
+    def test_prune_interviewers_for_capacity(self):
+        capacity.rebuild_weekly_loads()
+        self.captain.max_interviews_per_week = 2
+        self.first_mate.max_interviews_per_week = 3
+        time_period = lib.TimePeriod(
+            self.tz.localize(datetime(2014, 8, 5, 9, 0)),
+            self.tz.localize(datetime(2014, 8, 5, 17, 0)),
+        )
+        calendars = [
+            mock.Mock(interviewer=interviewer)
+            for interviewer in (self.captain, self.first_mate, self.pilot)
+        ]
+        with self.assertNumQueries(1):
+            pruned = schedule_calculator._prune_interviewers_for_capacity(calendars, time_period)
+        self.assertEqual(
+            dict((address, load) for address, (_, load) in pruned.iteritems()),
+            {self.first_mate.address: 2, self.pilot.address: 0},
+        )
+
+    def test_alternate_events_by_weekday(self):
+        ledger = capacity.load_capacity_ledger(
+            [self.captain.id],
+            datetime(2014, 8, 4).date(),
+            datetime(2014, 8, 11).date(),
+        )
+        self.assertEqual(
+            ledger.alternate_events_by_weekday([self.captain.id], datetime(2014, 8, 4).date(), datetime(2014, 8, 11).date()),
+            ({3: 1}, 1),
+        )
+
+    def test_alternate_events_at_the_same_time_all_count(self):
+        for _ in range(2):
+            models.AlternateRecruitingEvent.objects.create(
+                interviewer=self.captain,
+                type=models.AlternateRecruitingEventType.RESUME_SCREEN,
+                time=self.tz.localize(datetime(2014, 8, 8, 9, 0)),
+            )
+        ledger = capacity.load_capacity_ledger([self.captain.id], datetime(2014, 8, 4).date(), datetime(2014, 8, 11).date())
+        self.assertEqual(
+            ledger.alternate_events_by_weekday([self.captain.id], datetime(2014, 8, 4).date(), datetime(2014, 8, 11).date()),
+            ({3: 1, 4: 2}, 3),
+        )
+
+    def test_tracker_counts_interviewers_sharing_a_display_name(self):
+        self.captain.display_name = 'Mal'
+        self.captain.save()
+        namesake = models.Interviewer.objects.create(name='mal', domain='serenity.com', display_name='Mal')
+        self.req.interviewers.add(namesake)
+        models.AlternateRecruitingEvent.objects.create(
+            interviewer=namesake,
+            type=models.AlternateRecruitingEventType.CODE_TEST,
+            time=self.tz.localize(datetime(2014, 8, 4, 9, 0)),
+        )
+        User.objects.create_user('wash', 'wash@serenity.com', 'leaf')
+        self.client.login(username='wash', password='leaf')
+        with mock.patch.object(views, 'render', return_value=views.HttpResponse()) as render:
+            self.client.get('/tracker/', {'start_date': time.mktime(datetime(2014, 8, 4).timetuple())})
+        mechanics = render.call_args[0][2]['tracker_dict'][self.req.name]['interviewer']
+        self.assertEqual(mechanics['Mal']['num_interviews'], 4)
+
+    def _weekly_load(self, interviewer, dt):
+        return capacity.load_weekly_loads([interviewer.id], dt).get(interviewer.id)
+
+    def test_rebuild_weekly_loads(self):
+        capacity.rebuild_weekly_loads()
+        day = self.tz.localize(datetime(2014, 8, 5, 9, 0))
+        weekly_load = self._weekly_load(self.captain, day)
+        self.assertEqual((weekly_load.interviews, weekly_load.alternate_events), (2, 1))
+        self.assertEqual(self._weekly_load(self.first_mate, day).load, 2)
+        self.assertEqual(self._weekly_load(self.first_mate, day - timedelta(days=364)).load, 1)
+        self.assertEqual(self._weekly_load(self.pilot, day), None)
+
+    def test_writes_keep_weekly_loads_current(self):
+        start = self.tz.localize(datetime(2014, 8, 20, 10, 0))
+        interview_id = schedule_calculator.persist_interview(
+            [{
+                'room_id': self.interview.room_id,
+                'candidate_name': 'River',
+                'interviewer_id': self.pilot.id,
+                'start_time': start,
+                'end_time': start + timedelta(minutes=45),
+            }],
+            models.InterviewType.ON_SITE,
+        )
+        self.assertEqual(self._weekly_load(self.pilot, start).interviews, 1)
+
+        slot = models.InterviewSlot.objects.get(interview_id=interview_id)
+        schedule_calculator.change_interviewer(slot.id, self.captain.id)
+        self.assertEqual(self._weekly_load(self.pilot, start).interviews, 0)
+        self.assertEqual(self._weekly_load(self.captain, start).interviews, 1)
+
+        schedule_calculator.delete_interview(interview_id)
+        self.assertEqual(self._weekly_load(self.captain, start).interviews, 0)
+
+    def test_interview_slot_signals(self):
+        first_week = self.tz.localize(datetime(2014, 8, 20, 10, 0))
+        slot = models.InterviewSlot.objects.create(
+            interviewer=self.pilot,
+            interview=self.interview,
+            start_time=first_week,
+            end_time=first_week + timedelta(minutes=45),
+        )
+        self.assertEqual(self._weekly_load(self.pilot, first_week).interviews, 1)
+
+        slot.interviewer = self.captain
+        slot.start_time = first_week + timedelta(days=7)
+        slot.end_time = slot.start_time + timedelta(minutes=45)
+        slot.save()
+        self.assertEqual(self._weekly_load(self.pilot, first_week).interviews, 0)
+        self.assertEqual(self._weekly_load(self.captain, slot.start_time).interviews, 1)
+
+        slot.delete()
+        self.assertEqual(self._weekly_load(self.captain, slot.start_time).interviews, 0)
+
+    def test_alternate_event_signals(self):
+        first_week = self.tz.localize(datetime(2014, 8, 20, 10, 0))
+        event = models.AlternateRecruitingEvent.objects.create(
+            interviewer=self.pilot,
+            type=models.AlternateRecruitingEventType.RESUME_SCREEN,
+            time=first_week,
+        )
+        self.assertEqual(self._weekly_load(self.pilot, first_week).alternate_events, 1)
+
+        event.time = first_week + timedelta(days=7)
+        event.save()
+        self.assertEqual(self._weekly_load(self.pilot, first_week).alternate_events, 0)
+        self.assertEqual(self._weekly_load(self.pilot, event.time).alternate_events, 1)
+
+        event.delete()
+        self.assertEqual(self._weekly_load(self.pilot, event.time).alternate_events, 0)
+
+
 class RetryLibTest(TestCase):
 
     class TestException(Exception):
@@ -409,6 +1995,58 @@ class InterviewTypeTest(TestCase):
         )
 
 
+class InterviewPostTest(CalendarFixtures, TestCase):
+
+    def setUp(self):
+        super(InterviewPostTest, self).setUp()
+        self.interviewer = models.Interviewer.objects.create(name='malcolm', domain='reynolds.com', display_name='Malcolm')
+        self.room = models.Room.objects.create(name='cargo-bay', domain='serenity.com', display_name='Cargo bay', type=1)
+        self.recruiter = models.Recruiter.objects.create(name='inara', domain='serra.com', display_name='Inara')
+        User.objects.create_user('simon', 'simon@serenity.com', 'tam')
+        self.c = Client()
+        self.c.login(username='simon', password='tam')
+
+        self.service_client = self._freebusy_service_client()
+        self.service_client.process_calendar_create.return_value = dict(id='event')
+        self.calendar_client = client.Client(
+            self.service_client,
+            freebusy_cache=cache.FreeBusyStore(os.path.join(self._make_directory(), 'freebusy.db')),
+        )
+
+    def _timestamp(self, hour, minute=0):
+        # What the scheduler page posts: epoch seconds
+        return str(lib.to_epoch_minutes(self._time(hour) + timedelta(minutes=minute)) * 60)
+
+    def test_booking_with_epoch_timestamps(self):
+        self.calendar_client.get_calendars([self.interviewer], self.time_period)
+
+        with mock.patch.object(views, 'calendar_client', self.calendar_client):
+            with mock.patch.object(schedule_calculator, 'calendar_client', self.calendar_client):
+                response = self.c.post('/interview_post/', dict(
+                    csrfmiddlewaretoken='',
+                    interview_type=models.InterviewType.ON_SITE,
+                    recruiter_id=self.recruiter.id,
+                    interview_template_name='Onsite',
+                    candidate_name='River',
+                    interviewer='malcolm@reynolds.com',
+                    room='Cargo bay',
+                    start_time=self._timestamp(10),
+                    end_time=self._timestamp(10, 45),
+                    room_start_time=self._timestamp(10),
+                    room_end_time=self._timestamp(10, 45),
+                    external_id=self.room.external_id,
+                ))
+
+        self.assertEqual(302, response.status_code)
+        slot = models.InterviewSlot.objects.get(interviewer=self.interviewer)
+        self.assertEqual(self._time(10), slot.start_time)
+        calendar = self.calendar_client.get_calendars([self.interviewer], self.time_period).interview_calendars[0]
+        self.assertEqual(
+            [(self._time(10), self._time(10) + timedelta(minutes=45))],
+            [(period.start_time, period.end_time) for period in calendar.busy_set.to_time_periods()],
+        )
+
+
 class PersistInterviewTest(TestCase):
 
     def test_that_we_can_persist_interviews(self):
@@ -562,6 +2200,18 @@ class GetAllRecruiters(TestCase):
         self.assertIn(recruiter, recruiters)
 
 
+class GetDeadlineMsTest(TestCase):
+    def test_bad_input_gets_default(self):
+        self.assertEqual(views.DEFAULT_SCHEDULE_DEADLINE_MS, views.get_deadline_ms({}))
+        self.assertEqual(views.DEFAULT_SCHEDULE_DEADLINE_MS, views.get_deadline_ms({'deadline_ms': 'soon'}))
+        self.assertEqual(views.DEFAULT_SCHEDULE_DEADLINE_MS, views.get_deadline_ms({'deadline_ms': ''}))
+
+    def test_clamped(self):
+        self.assertEqual(2000, views.get_deadline_ms({'deadline_ms': '2000'}))
+        self.assertEqual(views.MAX_SCHEDULE_DEADLINE_MS, views.get_deadline_ms({'deadline_ms': '100000000'}))
+        self.assertEqual(1, views.get_deadline_ms({'deadline_ms': '-5'}))
+
+
 class ConvertTimesToPSTTest(TestCase):
     def test_convert_times_to_pst(self):
         old_datetime = datetime(
@@ -3,6 +3,7 @@ import simplejson
 import pytz
 import time
 
+from collections import defaultdict
 import datetime
 from datetime import date
 from datetime import datetime
@@ -17,10 +18,22 @@ from django.shortcuts import render
 from django.shortcuts import redirect
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.http import Http404
 from django.http import HttpResponse
-
+from django.http import HttpResponseBadRequest
+from django.http import HttpResponseForbidden
+from django.shortcuts import get_object_or_404
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from jeeves import capacity
 from jeeves import models
 from jeeves import rules
+from jeeves.calendar import availability
+from jeeves.calendar import free_index
+from jeeves.calendar import lib
+from jeeves.calendar import mirror
 from jeeves.calendar import schedule_calculator
 from jeeves.calendar.client import calendar_client
 from jeeves.calendar.lib import TimePeriod
@@ -44,6 +57,12 @@ START_HOUR = 9
 HOURS_PER_DAY = 10
 CHUNKS_PER_HOUR = 4  # Must divide evenly into 60
 SCHEDULE_TIME_FORMAT = "%I:%M"
+NUMBER_OF_SCHEDULES_TO_SHOW = 10
+DEFAULT_SCHEDULE_DEADLINE_MS = 5000
+# Callers can ask for a shorter search, but never a longer one than this
+MAX_SCHEDULE_DEADLINE_MS = 15000
+
+interviewer_free_index = free_index.FreeIndex(calendar_client)
 
 # TODO: Where does this go?
 def all_reqs():
@@ -121,6 +140,31 @@ class FindTimesForm(forms.Form):
         return TimePeriod(self.cleaned_data['start_time'], self.cleaned_data['end_time'])
 
 
+class FreeInterviewersForm(forms.Form):
+    requisition = forms.ModelChoiceField(queryset=all_reqs())
+
+    start_time = forms.DateTimeField()
+    end_time = forms.DateTimeField()
+    # Minutes; the whole window when left out
+    duration = forms.IntegerField(min_value=1, required=False)
+
+    def clean(self):
+        cleaned_data = super(FreeInterviewersForm, self).clean()
+        if 'start_time' in cleaned_data and 'end_time' in cleaned_data:
+            if cleaned_data['end_time'] <= cleaned_data['start_time']:
+                raise forms.ValidationError("End time must be after start time")
+        return cleaned_data
+
+    @property
+    def time_period(self):
+        return TimePeriod(self.cleaned_data['start_time'], self.cleaned_data['end_time'])
+
+    @property
+    def duration_minutes(self):
+        time_period = self.time_period
+        return self.cleaned_data['duration'] or lib.to_epoch_minutes(time_period.end_time) - lib.to_epoch_minutes(time_period.start_time)
+
+
 class RequisitionScheduleForm(forms.Form):
     requisition = forms.ModelChoiceField(
         queryset=all_reqs(),
@@ -139,10 +183,6 @@ def index(request):
 def find_times(request):
     context = dict(
             find_times_form=FindTimesForm(),
-            START_DATE=datetime.now().isoformat(),
-            START_HOUR=START_HOUR,
-            HOURS_PER_DAY=HOURS_PER_DAY,
-            CHUNKS_PER_HOUR=CHUNKS_PER_HOUR,
     )
 
     return render_to_response('find_times.html', context, context_instance=RequestContext(request))
@@ -150,25 +190,12 @@ def find_times(request):
 def find_times_post(request):
     find_times_form = FindTimesForm(request.POST)
     if find_times_form.is_valid():
-        required_interviewers, optional_interviewers = get_interviewers(
-                *find_times_form.requisition_and_custom_interviewers
-        )
-
-        calendar_response = calendar_client.get_calendars(
-            required_interviewers | optional_interviewers,
-            find_times_form.time_period,
-        )
-
         return render(
                 request,
                 'find_times.html',
                 dict(
                     find_times_form=find_times_form,
-                    calendar_response=calendar_response,
-                    START_DATE=find_times_form.time_period.start_time.isoformat(),
-                    START_HOUR=START_HOUR,
-                    HOURS_PER_DAY=HOURS_PER_DAY,
-                    CHUNKS_PER_HOUR=CHUNKS_PER_HOUR,
+                    heatmap=simplejson.dumps(get_availability_heatmap(find_times_form)),
                 )
         )
 
@@ -181,6 +208,126 @@ def find_times_post(request):
     )
 
 
+@login_required
+def find_times_heatmap(request):
+    """The find_times heatmap as JSON, for the same fields find_times_post takes."""
+    find_times_form = FindTimesForm(request.POST or request.GET)
+    if not find_times_form.is_valid():
+        return HttpResponseBadRequest(simplejson.dumps(find_times_form.errors), mimetype='application/json')
+    return HttpResponse(
+        simplejson.dumps(get_availability_heatmap(find_times_form)),
+        mimetype='application/json',
+    )
+
+@login_required
+def find_times_busy(request):
+    """One interviewer's busy times between epoch minutes start and end, fetched when the heatmap is drilled into."""
+    try:
+        interviewer_id = int(request.GET['interviewer'])
+        start = int(request.GET['start'])
+        end = int(request.GET['end'])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest()
+    interviewer = get_object_or_404(models.Interviewer, id=interviewer_id)
+
+    calendar_response = calendar_client.get_calendars(
+        [interviewer],
+        TimePeriod(lib.from_epoch_minutes(start), lib.from_epoch_minutes(end)),
+    )
+    busy = []
+    for interview_calendar in calendar_response.interview_calendars:
+        busy = list(interview_calendar.busy_set)
+    return HttpResponse(
+        simplejson.dumps(dict(interviewer=interviewer.id, busy=busy)),
+        mimetype='application/json',
+    )
+
+def get_availability_heatmap(find_times_form):
+    """How many and which interviewers are free in each chunk of each day of the form's period.
+
+    Each day's free lists one availability.encode_mask string per
+    interviewer, in the order of interviewers; their busy times are left to
+    find_times_busy. start and end are the period in epoch minutes.
+    """
+    required_interviewers, optional_interviewers = get_interviewers(
+            *find_times_form.requisition_and_custom_interviewers
+    )
+    time_period = find_times_form.time_period
+    calendar_response = calendar_client.get_calendars(
+        sorted(required_interviewers | optional_interviewers, key=lambda interviewer: interviewer.display_name),
+        time_period,
+    )
+    interview_calendars = calendar_response.interview_calendars
+
+    first_day = capacity.local_day(time_period.start_time)
+    days = [
+        first_day + timedelta(days=offset)
+        for offset in xrange((capacity.local_day(time_period.end_time) - first_day).days + 1)
+    ]
+    return dict(
+        start=lib.to_epoch_minutes(time_period.start_time),
+        end=lib.to_epoch_minutes(time_period.end_time),
+        start_hour=START_HOUR,
+        hours_per_day=HOURS_PER_DAY,
+        chunks_per_hour=CHUNKS_PER_HOUR,
+        interviewers=[
+            dict(id=interview_calendar.interviewer.id, name=interview_calendar.interviewer.display_name)
+            for interview_calendar in interview_calendars
+        ],
+        days=availability.heatmap(interview_calendars, days, START_HOUR, HOURS_PER_DAY, CHUNKS_PER_HOUR),
+    )
+
+@login_required
+def free_interviewers(request):
+    """Who in a requisition is free for duration minutes of a window, least loaded first, from cached availability only."""
+    form = FreeInterviewersForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(simplejson.dumps(form.errors), mimetype='application/json')
+
+    free, unknown = interviewer_free_index.free_interviewers(
+        form.cleaned_data['requisition'].interviewers.all(),
+        form.time_period,
+        form.duration_minutes,
+    )
+    return HttpResponse(
+        simplejson.dumps(dict(
+            interviewers=[
+                dict(id=interviewer.id, name=interviewer.display_name, weekly_load=weekly_load)
+                for interviewer, weekly_load in free
+            ],
+            unknown=[dict(id=interviewer.id, name=interviewer.display_name) for interviewer in unknown],
+        )),
+        mimetype='application/json',
+    )
+
+@login_required
+def replacement_interviewers(request):
+    """Who could take over an interview slot, for the tracker hovercard; see schedule_calculator.replacement_interviewers."""
+    interview_slot = get_object_or_404(
+        models.InterviewSlot.objects.select_related('interview', 'interviewer'),
+        id=request.GET.get('interview_slot_id'),
+    )
+    replacements, unknown = schedule_calculator.replacement_interviewers(interview_slot, interviewer_free_index)
+    return HttpResponse(
+        simplejson.dumps(dict(
+            interviewers=[
+                dict(
+                    id=replacement.interviewer.id,
+                    name=replacement.interviewer.display_name,
+                    score=replacement.score,
+                    weekly_load=replacement.weekly_load,
+                )
+                for replacement in replacements
+            ],
+            unknown=[dict(id=interviewer.id, name=interviewer.display_name) for interviewer in unknown],
+        )),
+        mimetype='application/json',
+    )
+
+def datetime_from_timestamp(timestamp):
+    """Local, aware datetime for a posted epoch seconds timestamp."""
+    return datetime.fromtimestamp(float(timestamp), pytz.utc).astimezone(pytz.timezone(settings.TIME_ZONE))
+
 def interview_post(request):
     interview_form = dict(request.POST)
     del interview_form['csrfmiddlewaretoken']
@@ -190,10 +337,8 @@ def interview_post(request):
     candidate_name = interview_form.pop('candidate_name')
     interviews = map(dict, zip(*[[(k, v) for v in value] for k, value in interview_form.items()]))
     for interview_slot in interviews:
-        interview_slot['start_time'] = datetime.fromtimestamp(float(interview_slot['start_time']))
-        interview_slot['start_time'].replace(tzinfo=pytz.timezone(settings.TIME_ZONE))
-        interview_slot['end_time'] = datetime.fromtimestamp(float(interview_slot['end_time']))
-        interview_slot['end_time'].replace(tzinfo=pytz.timezone(settings.TIME_ZONE))
+        interview_slot['start_time'] = datetime_from_timestamp(interview_slot['start_time'])
+        interview_slot['end_time'] = datetime_from_timestamp(interview_slot['end_time'])
 
         interview_slot['interviewer_id'] = models.Interviewer.objects.get(name=interview_slot['interviewer'].split('@')[0]).id
         interview_slot['room_id'] = models.Room.objects.get(display_name=interview_slot['room']).id
@@ -209,11 +354,8 @@ def interview_post(request):
         request.user,
     )
 
-    start_time = datetime.fromtimestamp(float(interview_form['room_start_time'][0]))
-    start_time = start_time.replace(tzinfo=pytz.timezone(settings.TIME_ZONE))
-
-    end_time = datetime.fromtimestamp(float(interview_form['room_end_time'][0]))
-    end_time = end_time.replace(tzinfo=pytz.timezone(settings.TIME_ZONE))
+    start_time = datetime_from_timestamp(interview_form['room_start_time'][0])
+    end_time = datetime_from_timestamp(interview_form['room_end_time'][0])
 
     interview_type_string = models.InterviewTypeChoice(interview_type).display_string
 
@@ -261,6 +403,17 @@ def tracker(request):
         start_date,
         end_date
     )
+    # Tracker rows are per display name, which interviewers can share
+    interviewer_ids = []
+    interviewer_ids_by_name = defaultdict(list)
+    for interviewer_id, display_name in models.Interviewer.objects.values_list('id', 'display_name'):
+        interviewer_ids.append(interviewer_id)
+        interviewer_ids_by_name[display_name].append(interviewer_id)
+    ledger = capacity.load_capacity_ledger(
+        interviewer_ids,
+        last_week_start,
+        next_week_start,
+    )
 
     for index, item in enumerate(tracker_dict.iteritems()):
         group, interviewer_dict = item
@@ -274,7 +427,8 @@ def tracker(request):
             interviews_dict_by_day_of_week = {}
             day_of_week_to_number_of_interviewers, total_number_of_interviews_for_week = \
                 get_number_of_alternate_events_for_interviewer(
-                    interviewer_name,
+                    ledger,
+                    interviewer_ids_by_name[interviewer_name],
                     last_week_start,
                     next_week_start,
                 )
@@ -301,7 +455,9 @@ def tracker(request):
                 group_dict,
                 interviewer_name,
                 last_week_start,
-                next_week_start
+                next_week_start,
+                ledger,
+                interviewer_ids_by_name[interviewer_name],
             )
         tracker_dict[group] = group_dict
 
@@ -332,14 +488,17 @@ def update_group_dict_with_alternate_recruiting_events(
     group_dict,
     interviewer_name,
     last_week_start,
-    next_week_start
+    next_week_start,
+    ledger,
+    interviewer_ids,
 ):
     if interviewer_name not in group_dict['interviewer']:
         return
     interview_info_dict = group_dict['interviewer'][interviewer_name]
     day_of_week_to_number_of_arc, total_number_of_arc_for_week = \
         get_number_of_alternate_events_for_interviewer(
-            interviewer_name,
+            ledger,
+            interviewer_ids,
             last_week_start,
             next_week_start,
         )
@@ -357,25 +516,12 @@ def update_group_dict_with_alternate_recruiting_events(
 
 
 def get_number_of_alternate_events_for_interviewer(
-    interviewer_name,
+    ledger,
+    interviewer_ids,
     start_date,
     end_date
 ):
-    events = models.AlternateRecruitingEvent.objects.filter(
-        time__gte=start_date,
-        time__lte=end_date,
-        interviewer__display_name=interviewer_name,
-    )
-    day_of_week_to_number_of_arc = {}
-    total_number_of_arc_for_week = 0
-    for event in events:
-        weekday = event.time.weekday()
-        if weekday not in day_of_week_to_number_of_arc:
-            day_of_week_to_number_of_arc[weekday] = 0
-        day_of_week_to_number_of_arc[weekday] += 1
-        total_number_of_arc_for_week += 1
-
-    return day_of_week_to_number_of_arc, total_number_of_arc_for_week
+    return ledger.alternate_events_by_weekday(interviewer_ids, start_date, end_date)
 
 
 def convert_times_to_pst(dt):
@@ -410,6 +556,28 @@ def modify_interview(request):
 
     return redirect('/tracker/')
 
+@csrf_exempt
+@require_POST
+def calendar_notification(request):
+    """Google's webhook for changes to a watched calendar; syncs it into the mirror."""
+    if calendar_client.mirror is None:
+        raise Http404
+    if not mirror.WEBHOOK_TOKEN or not constant_time_compare(
+        request.META.get('HTTP_X_GOOG_CHANNEL_TOKEN', ''),
+        mirror.WEBHOOK_TOKEN,
+    ):
+        return HttpResponseForbidden()
+
+    known_channel = calendar_client.mirror.handle_notification(
+        request.META.get('HTTP_X_GOOG_CHANNEL_ID'),
+        request.META.get('HTTP_X_GOOG_RESOURCE_ID'),
+        request.META.get('HTTP_X_GOOG_RESOURCE_STATE'),
+    )
+    if not known_channel:
+        # Probably one we've since replaced; it'll expire on its own
+        logger.info("notification for unknown channel %s", request.META.get('HTTP_X_GOOG_CHANNEL_ID'))
+    return HttpResponse()
+
 def get_time_period(start_time, end_time, date):
     def convert_form_datetime_to_sql_datetime(date, time):
       date_time = datetime.strptime("{date} {time}".format(date=date, time=time), "%m/%d/%Y %H:%M:%S")
@@ -454,6 +622,14 @@ def determine_break_from_interview_time(time_period, interview_type):
     return None
 
 
+def get_deadline_ms(form_data):
+    """The posted deadline_ms, clamped to 1 .. MAX_SCHEDULE_DEADLINE_MS; the default when it's missing or not a number."""
+    try:
+        deadline_ms = int(form_data.get('deadline_ms', DEFAULT_SCHEDULE_DEADLINE_MS))
+    except (TypeError, ValueError):
+        return DEFAULT_SCHEDULE_DEADLINE_MS
+    return min(max(deadline_ms, 1), MAX_SCHEDULE_DEADLINE_MS)
+
 def new_scheduler_post(request):
     form_data = request.POST
     candidate_name = form_data['candidate_name']
@@ -474,35 +650,34 @@ def new_scheduler_post(request):
         form_data['date'],
     )
 
-    calendar_responses = [
-        calendar_client.get_calendars(
-            interviewer_group.interviewers,
-            time_period)
-        for interviewer_group in interviewer_groups
-        if interviewer_group.num_required
-    ]
-
-    interviewer_groups_with_calendars = [
-        schedule_calculator.InterviewerGroup(
-            interviewers=calendar_response.interview_calendars,
-            num_required=interviewer_group.num_required,
-        )
-        for calendar_response, interviewer_group in zip(calendar_responses, interviewer_groups)
-    ]
+    interviewer_groups_with_calendars, rooms, preferences = schedule_calculator.fetch_calendars_for_scheduling(
+        [interviewer_group for interviewer_group in interviewer_groups if interviewer_group.num_required],
+        time_period,
+    )
 
     possible_break = determine_break_from_interview_time(
         time_period,
         interview_template.type,
     )
 
+    search_stats = schedule_calculator.SearchStats()
     schedules = schedule_calculator.calculate_schedules(
             interviewer_groups_with_calendars,
             time_period=time_period,
             interview_type=interview_template.type,
             possible_break=possible_break,
+            top_k=NUMBER_OF_SCHEDULES_TO_SHOW,
+            deadline_ms=get_deadline_ms(form_data),
+            search_stats=search_stats,
+            rooms=rooms,
+            preferences=preferences,
     )
     if not schedules:
-        return HttpResponse(simplejson.dumps({'form_is_valid': False, 'error_fields': ['no result found']}))
+        return HttpResponse(simplejson.dumps({
+            'form_is_valid': False,
+            'error_fields': ['no result found'],
+            'search': search_stats.to_dict(),
+        }))
 
     scheduler_post_result = {
         'form_is_valid': form_is_valid,
@@ -510,6 +685,7 @@ def new_scheduler_post(request):
         'interview_type': interview_template.type,
         'candidate_name': candidate_name,
         'interview_template_name': interview_template.template_name,
+        'search': search_stats.to_dict(),
     }
 
     return HttpResponse(
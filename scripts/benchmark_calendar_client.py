@@ -0,0 +1,72 @@
+"""Time calendar calls made one after another against the same calls gathered.
+
+Runs against a local StubCalendarServer that waits latency_ms before every
+answer, standing in for Google:
+
+    python scripts/benchmark_calendar_client.py [latency_ms] [num_groups] [interviewers_per_group]
+"""
+import os
+import sys
+import time
+from datetime import datetime
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "caltech.settings")
+
+import pytz
+
+from caltech import settings
+from jeeves import models
+from jeeves.calendar import client
+from jeeves.calendar import lib
+from jeeves.calendar.async_client import AsyncClient
+from jeeves.calendar.async_client import gather
+from jeeves.calendar.stub_server import StubCalendarServer
+
+
+def main(latency_ms, num_groups, interviewers_per_group):
+    server = StubCalendarServer(latency_ms=latency_ms).start()
+    start_time = pytz.timezone(settings.TIME_ZONE).localize(datetime(2014, 8, 5, 9, 0))
+    time_period = lib.TimePeriod(start_time, start_time + timedelta(hours=9))
+    groups = [
+        [
+            models.Interviewer(name='interviewer%s-%s' % (group_index, index), domain='example.com')
+            for index in xrange(interviewers_per_group)
+        ]
+        for group_index in xrange(num_groups)
+    ]
+
+    try:
+        calendar_client = client.Client(client.ServiceClient(server.build_service()))
+        start = time.time()
+        for group in groups:
+            calendar_client.get_calendars(group, time_period)
+        serial_time = time.time() - start
+
+        # Gathering needs a service_factory so the service pool can grow past one connection
+        service_client = client.ServiceClient(server.build_service(), service_factory=server.build_service)
+        calendar_client = client.Client(service_client)
+        async_client = AsyncClient(calendar_client)
+        start = time.time()
+        gather(*[async_client.get_calendars(group, time_period) for group in groups])
+        gathered_time = time.time() - start
+
+        print "%s groups of %s, %sms per request: serial %.2fs  gathered %.2fs" % (
+            num_groups,
+            interviewers_per_group,
+            latency_ms,
+            serial_time,
+            gathered_time,
+        )
+        print "service pool: %s" % service_client.service_pool.stats()
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 120,
+    )
@@ -0,0 +1,94 @@
+"""Time freebusy against the calendar mirror, and how fast the mirror keeps up with changes.
+
+Runs against a local StubCalendarServer that waits latency_ms before every
+answer, with events_per_calendar events on each of num_calendars
+calendars, and a throwaway test database for the mirror:
+
+    python scripts/benchmark_calendar_mirror.py [latency_ms] [num_calendars] [events_per_calendar] [num_changes]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "caltech.settings")
+
+import pytz
+from django.db import connection
+
+from caltech import settings
+from jeeves import models
+from jeeves.calendar import client
+from jeeves.calendar import lib
+from jeeves.calendar import mirror
+from jeeves.calendar.stub_server import StubCalendarServer
+
+NUM_QUERIES = 10
+
+
+def main(latency_ms, num_calendars, events_per_calendar, num_changes):
+    random.seed(0)
+    connection.creation.create_test_db(verbosity=0)
+    server = StubCalendarServer(latency_ms=latency_ms).start()
+    start_time = pytz.timezone(settings.TIME_ZONE).localize(datetime(2014, 8, 5, 9, 0))
+    time_period = lib.TimePeriod(start_time, start_time + timedelta(hours=9))
+    interviewers = [
+        models.Interviewer(name='interviewer%s' % index, domain='example.com')
+        for index in xrange(num_calendars)
+    ]
+
+    def add_random_event(interviewer):
+        event_start = start_time + timedelta(days=random.randint(-30, 30), minutes=15 * random.randint(0, 32))
+        return server.add_event(interviewer.external_id, lib.TimePeriod(event_start, event_start + timedelta(minutes=45)))
+
+    try:
+        for interviewer in interviewers:
+            for _ in xrange(events_per_calendar):
+                add_random_event(interviewer)
+
+        service_client = client.ServiceClient(server.build_service(), service_factory=server.build_service)
+        freebusy_client = client.Client(service_client)
+        start = time.time()
+        for _ in xrange(NUM_QUERIES):
+            freebusy_client.get_calendars(interviewers, time_period)
+        freebusy_time = (time.time() - start) / NUM_QUERIES
+
+        calendar_mirror = mirror.CalendarMirror(service_client)
+        start = time.time()
+        for interviewer in interviewers:
+            calendar_mirror.sync(interviewer.external_id)
+        full_sync_time = time.time() - start
+
+        mirrored_client = client.Client(client.MirroringServiceClient(service_client, calendar_mirror))
+        start = time.time()
+        for _ in xrange(NUM_QUERIES):
+            mirrored_client.get_calendars(interviewers, time_period)
+        mirrored_time = (time.time() - start) / NUM_QUERIES
+
+        # Each change is what a notification would trigger: one delta sync of that calendar
+        start = time.time()
+        for _ in xrange(num_changes):
+            interviewer = random.choice(interviewers)
+            add_random_event(interviewer)
+            calendar_mirror.sync(interviewer.external_id)
+        delta_sync_time = (time.time() - start) / max(num_changes, 1)
+
+        print "%s calendars of %s events, %sms per request" % (num_calendars, events_per_calendar, latency_ms)
+        print "  get_calendars: freebusy %.0fms  mirror %.0fms" % (freebusy_time * 1000, mirrored_time * 1000)
+        print "  full sync of every calendar: %.2fs" % full_sync_time
+        print "  change to synced: %.0fms each over %s changes" % (delta_sync_time * 1000, num_changes)
+    finally:
+        server.stop()
+        connection.creation.destroy_test_db(settings.DATABASES['default']['NAME'], verbosity=0)
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 150,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 40,
+        int(sys.argv[4]) if len(sys.argv) > 4 else 50,
+    )
@@ -0,0 +1,126 @@
+"""Time the schedule search serially and across a process pool.
+
+Builds a synthetic on-site day (no database or Google calls) and runs the
+same search both ways. The pool is started before timing, the way the web
+server keeps one around:
+
+    python scripts/benchmark_parallel_search.py [processes] [interviewers_per_group]
+"""
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "caltech.settings")
+
+import pytz
+
+from caltech import settings
+from jeeves import models
+from jeeves.calendar import client
+from jeeves.calendar import lib
+from jeeves.calendar import schedule_calculator
+
+GROUP_SIZES = (2, 2, 1)
+SATURATION = 0.35
+
+
+def build_search_problem(interviewers_per_group, top_k, max_schedules):
+    random.seed(0)
+    start_time = pytz.timezone(settings.TIME_ZONE).localize(datetime(2014, 8, 5, 9, 0))
+    time_period = lib.TimePeriod(start_time, start_time + timedelta(hours=9))
+
+    test_service_client = client.TestServiceClient()
+    calendar_client = client.Client(test_service_client)
+
+    interviewer_groups = []
+    for group_index, num_required in enumerate(GROUP_SIZES):
+        interviewers = [
+            models.Interviewer(
+                name='interviewer%s-%s' % (group_index, index),
+                domain='example.com',
+                display_name='Interviewer %s-%s' % (group_index, index),
+            )
+            for index in xrange(interviewers_per_group)
+        ]
+        for interviewer in interviewers:
+            for chunk in xrange(9 * 4):
+                if random.random() < SATURATION:
+                    test_service_client.register_busyness(
+                        interviewer.address,
+                        lib.time_period_of_length_after_time(start_time, 15, chunk),
+                    )
+        interviewer_groups.append(schedule_calculator.InterviewerGroup(
+            num_required=num_required,
+            interviewers=calendar_client.get_calendars(interviewers, time_period).interview_calendars,
+        ))
+
+    rooms = [
+        models.Room(name='room%s' % index, domain='example.com', display_name='Room %s' % index, type=index % 2)
+        for index in xrange(10)
+    ]
+    room_calendars = calendar_client.get_calendars(rooms, time_period).interview_calendars
+    interviewers = [
+        interviewer
+        for interviewer_group in interviewer_groups
+        for interviewer in interviewer_group.interviewers
+    ]
+    availability = schedule_calculator.build_availability_matrix(
+        time_period,
+        interviewers,
+        room_calendars,
+        calendar_client.get_calendars([], time_period),
+    )
+
+    return schedule_calculator.SearchProblem(
+        position_candidates=schedule_calculator._position_candidates(interviewer_groups),
+        time_period=time_period,
+        possible_break=None,
+        availability=availability,
+        rooms=schedule_calculator._search_rooms(room_calendars),
+        interviewer_to_num_interviews_map=dict(
+            (interviewer.interviewer.address, (None, random.randint(0, 2)))
+            for interviewer in interviewers
+        ),
+        interview_type=models.InterviewType.ON_SITE,
+        max_schedules=max_schedules,
+        top_k=top_k,
+    )
+
+
+def time_it(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+
+def main(processes, interviewers_per_group):
+    search_pool = schedule_calculator.SearchPool(processes)
+    for label, top_k, max_schedules in (
+        ('top 10', 10, 100),
+        ('every schedule', None, 10 ** 9),
+    ):
+        search_problem = build_search_problem(interviewers_per_group, top_k, max_schedules)
+        serial_time, (serial_result, _) = time_it(schedule_calculator._search_partition, search_problem)
+        parallel_time, parallel_result = time_it(search_pool.search, search_problem)
+        print "%-15s serial %.2fs (%s schedules)  %s processes %.2fs (%s schedules)  speedup %.1fx" % (
+            label,
+            serial_time,
+            len(serial_result),
+            processes,
+            parallel_time,
+            len(parallel_result),
+            serial_time / parallel_time,
+        )
+    search_pool.close()
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else multiprocessing.cpu_count(),
+        int(sys.argv[2]) if len(sys.argv) > 2 else 12,
+    )
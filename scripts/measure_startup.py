@@ -0,0 +1,27 @@
+"""Time what a fresh worker spends before it can serve a scheduling request.
+
+    python scripts/measure_startup.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "caltech.settings")
+
+
+def main():
+    start = time.time()
+    from jeeves.calendar.client import calendar_client
+    import_time = time.time() - start
+
+    warm_up_ms = calendar_client.warm_up()
+    print "import %.0fms  warm up %.0fms  total %.0fms" % (
+        import_time * 1000,
+        warm_up_ms,
+        (time.time() - start) * 1000,
+    )
+
+
+if __name__ == '__main__':
+    main()
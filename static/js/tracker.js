@@ -11,10 +11,33 @@ $(document).ready(function() {
   });
   $('.tracker-int').hover(function() {
       $(this).find('.hovercard').show(); // show() doesn't seem to work with delay
+      $(this).find('.hovercard form').each(load_replacement_interviewers);
   }, function() {
       $(this).find('.hovercard').hide();
   });
 
+  // Put the interviewers who are free for the slot and under capacity, best
+  // first, at the top of the reassign list. Only asked for once per slot.
+  function load_replacement_interviewers() {
+      var form = $(this);
+      if (form.data('replacements-loaded')) {
+          return;
+      }
+      form.data('replacements-loaded', true);
+      var interview_slot_id = form.find('input[name="interview_slot_id"]').val();
+      $.getJSON('/replacement_interviewers/', {interview_slot_id: interview_slot_id}, function(response) {
+          var select = form.find('select.interviewer_id');
+          var everyone = $('<optgroup label="Everyone"></optgroup>').append(select.find('option[value]'));
+          var suggested = $('<optgroup label="Free then"></optgroup>');
+          $.each(response.interviewers, function(index, interviewer) {
+              suggested.append(
+                  $('<option></option>').val(interviewer.id).text(interviewer.name + ' (' + interviewer.weekly_load + ' this week)')
+              );
+          });
+          select.append(suggested).append(everyone);
+      });
+  }
+
 
   /*
   ################################################